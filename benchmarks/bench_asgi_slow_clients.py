@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+مقارنة نشر gunicorn المتزامن (sync) مع وضع ASGI (uvicorn src.asgi:app) تحت عملاء بطيئين
+
+يفتح السكريبت عدداً كبيراً من الاتصالات البطيئة التي ترسل جسم POST /track/batch
+على أجزاء خلال عدة ثوانٍ (مثل عملاء الهواتف على شبكات ضعيفة)، ويقيس أثناء ذلك
+زمن استجابة طلبات GET /count السريعة. في gunicorn المتزامن يشغل كل عميل بطيء
+عاملاً كاملاً حتى ينتهي الرفع، أما في وضع ASGI فيُقرأ الجسم في حلقة asyncio
+ولا يُحجز خيط قاعدة البيانات إلا بعد اكتمال الطلب.
+
+يتطلب gunicorn وuvicorn مثبتين، ويُتخطى الخادم غير المثبت.
+
+الاستخدام:
+    python benchmarks/bench_asgi_slow_clients.py --slow-clients 1000 --slow-seconds 5 --probes 200
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'gunicorn_sync': ('gunicorn', lambda port, workers, threads: [
+        sys.executable, '-m', 'gunicorn', 'src.main:app',
+        '--bind', f'127.0.0.1:{port}', '--workers', str(workers),
+        '--worker-class', 'sync', '--timeout', '120', '--log-level', 'warning',
+    ]),
+    'uvicorn_asgi': ('uvicorn', lambda port, workers, threads: [
+        sys.executable, '-m', 'uvicorn', 'src.asgi:app',
+        '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers),
+        '--backlog', '4096', '--log-level', 'warning',
+    ]),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('توقف الخادم قبل أن يصبح جاهزاً')
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/api/visitor-counter/health', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('انتهت مهلة انتظار الخادم')
+
+
+async def http_request(port, method, path, body=b'', pieces=1, spread_seconds=0.0, timeout=60.0):
+    """طلب HTTP/1.1 بسيط يرسل الجسم على أجزاء موزعة على spread_seconds ويعيد رمز الحالة"""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+    try:
+        writer.write((
+            f'{method} {path} HTTP/1.1\r\n'
+            f'Host: 127.0.0.1:{port}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            'Connection: close\r\n\r\n'
+        ).encode())
+        await writer.drain()
+        size = max(1, -(-len(body) // pieces)) if body else 0
+        for start in range(0, len(body), size or 1):
+            if start:
+                await asyncio.sleep(spread_seconds / pieces)
+            writer.write(body[start:start + size])
+            await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        await asyncio.wait_for(reader.read(), timeout)
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * fraction))] * 1000, 1)
+
+
+async def run_load(port, slow_clients, slow_seconds, probes, probe_concurrency, probe_timeout):
+    async def slow_client(index):
+        body = json.dumps({'events': [{'session_id': f'slow_client_{index}', 'ip_address': '10.0.0.1'}]}).encode()
+        try:
+            return await http_request(port, 'POST', '/api/visitor-counter/track/batch', body,
+                                      pieces=10, spread_seconds=slow_seconds,
+                                      timeout=slow_seconds + 60)
+        except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+            return None
+
+    latencies = []
+    probe_errors = 0
+    semaphore = asyncio.Semaphore(probe_concurrency)
+
+    async def probe():
+        nonlocal probe_errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                status = await http_request(port, 'GET', '/api/visitor-counter/count', timeout=probe_timeout)
+            except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+                status = None
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                probe_errors += 1
+
+    started = time.perf_counter()
+    slow_tasks = [asyncio.create_task(slow_client(index)) for index in range(slow_clients)]
+    # الطلبات السريعة تبدأ بعد أن تفتح الاتصالات البطيئة
+    await asyncio.sleep(min(1.0, slow_seconds / 4))
+    await asyncio.gather(*(probe() for _ in range(probes)))
+    probes_done = time.perf_counter() - started
+    slow_statuses = await asyncio.gather(*slow_tasks)
+    elapsed = time.perf_counter() - started
+
+    return {
+        'slow_clients_completed': sum(1 for status in slow_statuses if status == 200),
+        'slow_clients_failed': sum(1 for status in slow_statuses if status != 200),
+        'probe_ok': len(latencies),
+        'probe_errors': probe_errors,
+        'probe_p50_ms': percentile(latencies, 0.50),
+        'probe_p99_ms': percentile(latencies, 0.99),
+        'probes_finished_after_s': round(probes_done, 2),
+        'total_seconds': round(elapsed, 2),
+    }
+
+
+def run_server(name, args):
+    module, build_command = SERVERS[name]
+    if importlib.util.find_spec(module) is None:
+        return {'server': name, 'skipped': f'{module} غير مثبت'}
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=f'sqlite:///{path}',
+        SCHEDULER_ENABLED='false',
+        SQLITE_POOL_SIZE=str(args.threads),
+        ASGI_EXECUTOR_WORKERS=str(args.threads),
+    )
+    process = subprocess.Popen(
+        build_command(port, args.workers, args.threads),
+        cwd=PROJECT_ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(port, process)
+        result = asyncio.run(run_load(
+            port, args.slow_clients, args.slow_seconds,
+            args.probes, args.probe_concurrency, args.probe_timeout,
+        ))
+        return {'server': name, 'workers': args.workers, **result}
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='مقارنة gunicorn المتزامن مع وضع ASGI تحت عملاء بطيئين')
+    parser.add_argument('--servers', default=','.join(SERVERS), help='الخوادم المراد قياسها')
+    parser.add_argument('--workers', type=int, default=2, help='عدد العمليات لكل خادم')
+    parser.add_argument('--threads', type=int, default=8, help='خيوط قاعدة البيانات لكل عامل ASGI')
+    parser.add_argument('--slow-clients', type=int, default=1000, help='عدد الاتصالات البطيئة المتزامنة')
+    parser.add_argument('--slow-seconds', type=float, default=5.0, help='مدة رفع جسم كل طلب بطيء')
+    parser.add_argument('--probes', type=int, default=200, help='عدد طلبات GET /count السريعة')
+    parser.add_argument('--probe-concurrency', type=int, default=20, help='التزامن بين الطلبات السريعة')
+    parser.add_argument('--probe-timeout', type=float, default=30.0, help='مهلة الطلب السريع بالثواني')
+    args = parser.parse_args()
+
+    results = [run_server(name, args) for name in args.servers.split(',')]
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+قياس زمن الاستعلامات الساخنة على جدول visitor_sessions قبل الفهارس وبعدها
+
+الاستخدام:
+    python benchmarks/bench_session_queries.py --sizes 100000,1000000,10000000
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.models.migrations import MIGRATIONS
+
+SCHEMA = """
+CREATE TABLE visitor_sessions (
+    id INTEGER NOT NULL PRIMARY KEY,
+    session_id VARCHAR(255) NOT NULL UNIQUE,
+    ip_address VARCHAR(45),
+    user_agent TEXT,
+    first_visit DATETIME NOT NULL,
+    last_activity DATETIME NOT NULL,
+    page_views INTEGER NOT NULL,
+    is_active BOOLEAN NOT NULL
+)
+"""
+
+# الاستعلامات كما كانت قبل الترحيل (مرشحات تعتمد على دوال التاريخ ونطاقات مفتوحة)
+QUERIES_BEFORE = {
+    'active_visitors': (
+        'SELECT count(*) FROM (SELECT * FROM visitor_sessions '
+        'WHERE last_activity >= :active_cutoff AND is_active = 1)'
+    ),
+    'visitors_today': (
+        'SELECT count(*) FROM (SELECT * FROM visitor_sessions WHERE first_visit >= :today_start)'
+    ),
+    'page_views_today': (
+        'SELECT sum(page_views) FROM visitor_sessions WHERE date(first_visit) = :today'
+    ),
+    'stale_sessions': (
+        'SELECT count(*) FROM visitor_sessions WHERE last_activity < :stale_cutoff'
+    ),
+}
+
+# الاستعلامات بعد الترحيل (نطاقات نصف مفتوحة قابلة لاستخدام الفهارس)
+QUERIES_AFTER = {
+    'active_visitors': (
+        'SELECT count(id) FROM visitor_sessions '
+        'WHERE is_active = 1 AND last_activity >= :active_cutoff'
+    ),
+    'visitors_today': (
+        'SELECT count(id) FROM visitor_sessions '
+        'WHERE first_visit >= :today_start AND first_visit < :tomorrow_start'
+    ),
+    'page_views_today': (
+        'SELECT coalesce(sum(page_views), 0) FROM visitor_sessions '
+        'WHERE first_visit >= :today_start AND first_visit < :tomorrow_start'
+    ),
+    'stale_sessions': (
+        'SELECT count(id) FROM visitor_sessions WHERE is_active = 1 AND last_activity < :stale_cutoff'
+    ),
+}
+
+
+def populate(connection, size, now):
+    """توليد جلسات موزعة على آخر 90 يوماً باستخدام CTE تكراري داخل SQLite"""
+    span_seconds = 90 * 24 * 3600
+    connection.execute(
+        """
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < :size)
+        INSERT INTO visitor_sessions
+            (session_id, ip_address, user_agent, first_visit, last_activity, page_views, is_active)
+        SELECT
+            'bench_' || n,
+            '10.' || (n % 250) || '.' || (n / 250 % 250) || '.' || (n % 7),
+            'Benchmark Browser',
+            strftime('%Y-%m-%d %H:%M:%f', :now, '-' || ((n * 7919) % :span) || ' seconds'),
+            strftime('%Y-%m-%d %H:%M:%f', :now, '-' || (((n * 7919) % :span) / 2) || ' seconds'),
+            (n % 20) + 1,
+            (n % 10) != 0
+        FROM seq
+        """,
+        {'size': size, 'now': now.strftime('%Y-%m-%d %H:%M:%S'), 'span': span_seconds}
+    )
+    connection.commit()
+
+
+def time_queries(connection, queries, params, repeat):
+    results = {}
+    for name, sql in queries.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            connection.execute(sql, params).fetchall()
+            timings.append(time.perf_counter() - start)
+        results[name] = round(min(timings) * 1000, 3)
+    return results
+
+
+def run(size, repeat):
+    now = datetime.utcnow()
+    today_start = datetime.combine(now.date(), datetime.min.time())
+    params = {
+        'active_cutoff': (now - timedelta(minutes=30)).strftime('%Y-%m-%d %H:%M:%S'),
+        'stale_cutoff': (now - timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S'),
+        'today_start': today_start.strftime('%Y-%m-%d %H:%M:%S'),
+        'tomorrow_start': (today_start + timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S'),
+        'today': now.date().isoformat(),
+    }
+
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        connection = sqlite3.connect(path)
+        connection.execute(SCHEMA)
+
+        start = time.perf_counter()
+        populate(connection, size, now)
+        populate_time = time.perf_counter() - start
+
+        before = time_queries(connection, QUERIES_BEFORE, params, repeat)
+
+        start = time.perf_counter()
+        for migration_id, statements in MIGRATIONS:
+            if migration_id == '0001_visitor_sessions_indexes':
+                for statement in statements:
+                    connection.execute(statement)
+        connection.commit()
+        migration_time = time.perf_counter() - start
+
+        after = time_queries(connection, QUERIES_AFTER, params, repeat)
+        connection.close()
+
+        return {
+            'sessions': size,
+            'populate_seconds': round(populate_time, 2),
+            'migration_seconds': round(migration_time, 2),
+            'before_ms': before,
+            'after_ms': after,
+            'speedup': {
+                name: round(before[name] / after[name], 1) if after[name] else None
+                for name in before
+            }
+        }
+    finally:
+        os.unlink(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='قياس أداء استعلامات visitor_sessions قبل الفهارس وبعدها')
+    parser.add_argument('--sizes', default='100000,1000000,10000000', help='أحجام الجدول مفصولة بفواصل')
+    parser.add_argument('--repeat', type=int, default=5, help='عدد مرات تكرار كل استعلام (يُؤخذ الأسرع)')
+    args = parser.parse_args()
+
+    results = [run(int(size), args.repeat) for size in args.sizes.split(',')]
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
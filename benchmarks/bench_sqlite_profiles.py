@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+مقارنة إنتاجية SQLite بين ملف التعريف الافتراضي وملف production تحت حمل متزامن
+
+يحاكي السكريبت عدة عمال gunicorn (عمليات) لكل منها عدة خيوط، تنفذ مزيجاً من
+عمليات الكتابة (تتبع زائر) والقراءة (عدّ الزوار النشطين) على نفس ملف قاعدة البيانات.
+
+الاستخدام:
+    python benchmarks/bench_sqlite_profiles.py --workers 4 --threads 8 --duration 5
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, func, select, update
+from sqlalchemy.exc import OperationalError
+from src.models.visitor_counter import db, VisitorSession
+from src.models.sqlite_profile import build_engine_options, apply_sqlite_profile
+
+SESSIONS_TABLE = VisitorSession.__table__
+
+
+def make_engine(path, profile):
+    uri = f'sqlite:///{path}'
+    engine = create_engine(uri, **build_engine_options(uri, profile))
+    apply_sqlite_profile(engine, profile)
+    return engine
+
+
+def worker(path, profile, worker_id, threads, duration, write_ratio, results):
+    engine = make_engine(path, profile)
+    counters = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def run_thread(thread_id):
+        local = {'reads': 0, 'writes': 0, 'errors': 0}
+        sequence = 0
+        while time.monotonic() < deadline:
+            try:
+                if random.random() < write_ratio:
+                    sequence += 1
+                    now = datetime.utcnow()
+                    with engine.begin() as connection:
+                        session_id = f'bench_{worker_id}_{thread_id}_{sequence % 500}'
+                        updated = connection.execute(
+                            update(SESSIONS_TABLE)
+                            .where(SESSIONS_TABLE.c.session_id == session_id)
+                            .values(page_views=SESSIONS_TABLE.c.page_views + 1, last_activity=now)
+                        ).rowcount
+                        if not updated:
+                            connection.execute(SESSIONS_TABLE.insert().values(
+                                session_id=session_id, ip_address='10.0.0.1', user_agent='bench',
+                                first_visit=now, last_activity=now, page_views=1, is_active=True
+                            ))
+                    local['writes'] += 1
+                else:
+                    with engine.connect() as connection:
+                        connection.execute(
+                            select(func.count(SESSIONS_TABLE.c.id)).where(
+                                SESSIONS_TABLE.c.is_active == True,
+                                SESSIONS_TABLE.c.last_activity >= datetime.utcnow() - timedelta(minutes=30)
+                            )
+                        ).scalar()
+                    local['reads'] += 1
+            except OperationalError:
+                local['errors'] += 1
+
+        with lock:
+            for key, value in local.items():
+                counters[key] += value
+
+    pool = [threading.Thread(target=run_thread, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    engine.dispose()
+    results.put(counters)
+
+
+def run_profile(profile, workers, threads, duration, write_ratio):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        engine = make_engine(path, profile)
+        db.metadata.create_all(engine, tables=[SESSIONS_TABLE])
+        engine.dispose()
+
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=worker,
+                args=(path, profile, worker_id, threads, duration, write_ratio, results)
+            )
+            for worker_id in range(workers)
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        totals = {'reads': 0, 'writes': 0, 'errors': 0}
+        for _ in processes:
+            for key, value in results.get().items():
+                totals[key] += value
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        operations = totals['reads'] + totals['writes']
+        return {
+            'profile': profile,
+            'workers': workers,
+            'threads_per_worker': threads,
+            'seconds': round(elapsed, 2),
+            'reads': totals['reads'],
+            'writes': totals['writes'],
+            'errors': totals['errors'],
+            'ops_per_second': round(operations / elapsed, 1),
+            'error_rate': round(totals['errors'] / max(operations + totals['errors'], 1), 4),
+        }
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='مقارنة ملفات تعريف محرك SQLite تحت حمل متزامن')
+    parser.add_argument('--profiles', default='default,production', help='ملفات التعريف المراد مقارنتها')
+    parser.add_argument('--workers', type=int, default=4, help='عدد العمليات (محاكاة عمال gunicorn)')
+    parser.add_argument('--threads', type=int, default=8, help='عدد الخيوط لكل عامل')
+    parser.add_argument('--duration', type=float, default=5.0, help='مدة القياس بالثواني لكل ملف تعريف')
+    parser.add_argument('--write-ratio', type=float, default=0.3, help='نسبة عمليات الكتابة من إجمالي العمليات')
+    args = parser.parse_args()
+
+    results = [
+        run_profile(profile, args.workers, args.threads, args.duration, args.write_ratio)
+        for profile in args.profiles.split(',')
+    ]
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
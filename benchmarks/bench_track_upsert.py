@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+مقارنة عدد الرحلات إلى قاعدة البيانات وزمن تتبع الزيارة بين طريقتين:
+
+- read_then_write: قراءة الجلسة ثم تحديثها من بايثون (الطريقة السابقة، عبارتان لكل زيارة)
+- upsert: عبارة INSERT ... ON CONFLICT DO UPDATE واحدة تزيد page_views داخل قاعدة البيانات
+
+يعدّ السكريبت العبارات المنفذة فعلياً عبر حدث before_cursor_execute، ويقيس
+الزيارات المفقودة عند تشغيل عدة خيوط على الجلسات نفسها.
+
+الاستخدام:
+    python benchmarks/bench_track_upsert.py --visits 20000 --sessions 1000 --threads 4
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import DateTime, bindparam, create_engine, event, func, select, text, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from src.models.visitor_counter import db, VisitorSession
+from src.models.sqlite_profile import build_engine_options, apply_sqlite_profile
+
+SESSIONS_TABLE = VisitorSession.__table__
+
+
+def track_read_then_write(connection, session_id, now):
+    row = connection.execute(
+        select(SESSIONS_TABLE.c.id, SESSIONS_TABLE.c.page_views)
+        .where(SESSIONS_TABLE.c.session_id == session_id)
+    ).first()
+    if row:
+        connection.execute(
+            update(SESSIONS_TABLE)
+            .where(SESSIONS_TABLE.c.id == row.id)
+            .values(page_views=row.page_views + 1, last_activity=now)
+        )
+    else:
+        connection.execute(SESSIONS_TABLE.insert().values(
+            session_id=session_id, ip_address='10.0.0.1', user_agent='bench',
+            first_visit=now, last_activity=now, page_views=1, is_active=True
+        ))
+
+
+# نفس عبارة الخدمة: نص ثابت تُعاد استعماله ترجمته بدلاً من بناء insert().on_conflict_do_update() مع كل زيارة
+UPSERT_SESSION = text("""
+    INSERT INTO visitor_sessions
+        (session_id, ip_address, user_agent, first_visit, last_activity, page_views, is_active)
+    VALUES (:session_id, '10.0.0.1', 'bench', :now, :now, 1, 1)
+    ON CONFLICT (session_id) DO UPDATE SET
+        page_views = page_views + 1,
+        last_activity = excluded.last_activity,
+        is_active = 1
+    RETURNING id, session_id, ip_address, user_agent, first_visit, last_activity, page_views, is_active
+""").bindparams(bindparam('now', type_=DateTime)).columns(*SESSIONS_TABLE.c)
+
+
+def track_upsert(connection, session_id, now):
+    connection.execute(UPSERT_SESSION, {'session_id': session_id, 'now': now}).one()
+
+
+STRATEGIES = {
+    'read_then_write': track_read_then_write,
+    'upsert': track_upsert,
+}
+
+
+def run_strategy(name, visits, sessions, threads, profile):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    uri = f'sqlite:///{path}'
+    engine = create_engine(uri, **build_engine_options(uri, profile))
+    apply_sqlite_profile(engine, profile)
+    try:
+        db.metadata.create_all(engine, tables=[SESSIONS_TABLE])
+
+        statements = [0]
+        counter_lock = threading.Lock()
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            with counter_lock:
+                statements[0] += 1
+
+        track = STRATEGIES[name]
+        session_ids = [f'bench_session_{index}' for index in range(sessions)]
+        per_thread = visits // threads
+        totals = {'succeeded': 0, 'errors': 0}
+
+        def run_thread(seed):
+            rng = random.Random(seed)
+            succeeded = errors = 0
+            for _ in range(per_thread):
+                try:
+                    with engine.begin() as connection:
+                        track(connection, rng.choice(session_ids), datetime.utcnow())
+                    succeeded += 1
+                except (IntegrityError, OperationalError):
+                    errors += 1
+            with counter_lock:
+                totals['succeeded'] += succeeded
+                totals['errors'] += errors
+
+        pool = [threading.Thread(target=run_thread, args=(seed,)) for seed in range(threads)]
+        start = time.perf_counter()
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        with engine.connect() as connection:
+            recorded = connection.execute(select(func.sum(SESSIONS_TABLE.c.page_views))).scalar() or 0
+
+        performed = totals['succeeded']
+        return {
+            'strategy': name,
+            'visits': performed,
+            'threads': threads,
+            'seconds': round(elapsed, 3),
+            'visits_per_second': round(performed / elapsed, 1),
+            'statements_per_visit': round(statements[0] / max(performed + totals['errors'], 1), 2),
+            'lost_increments': performed - recorded,
+            'errors': totals['errors'],
+        }
+    finally:
+        engine.dispose()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='مقارنة تتبع الزيارة بالقراءة ثم الكتابة مقابل upsert واحد')
+    parser.add_argument('--visits', type=int, default=20000, help='إجمالي الزيارات لكل طريقة')
+    parser.add_argument('--sessions', type=int, default=1000, help='عدد الجلسات المميزة')
+    parser.add_argument('--threads', type=int, default=4, help='عدد الخيوط المتزامنة')
+    parser.add_argument('--profile', default='production', help='ملف تعريف محرك SQLite')
+    args = parser.parse_args()
+
+    results = [
+        run_strategy(name, args.visits, args.sessions, args.threads, args.profile)
+        for name in STRATEGIES
+    ]
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
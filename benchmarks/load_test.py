@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+مولّد حمل لخدمة عداد الزوار يشغّل gunicorn حقيقياً ويقيس الإنتاجية وزمن الاستجابة
+
+لكل حجم من أحجام قاعدة البيانات المطلوبة (--db-sizes) يُنشئ السكريبت قاعدة بيانات
+مؤقتة، ويشغّل gunicorn عليها، ويملؤها بجلسات موزعة على آخر 90 يوماً، ثم يرسل مزيجاً
+موزوناً من الطلبات (--mix) من عدة مستخدمين افتراضيين لمدة محددة. كل مستخدم يحتفظ
+بملف تعريف الزائر مثل المتصفح، ويبدأ زائراً جديداً باحتمال --new-visitor-ratio.
+
+مع --rate يعمل المولّد بحمل مفتوح (عدد ثابت من الطلبات في الثانية) ويُحسب زمن
+الاستجابة من الموعد المجدول للطلب لا من لحظة إرساله، فلا يخفي تباطؤ الخادم
+(coordinated omission). بدونه يرسل كل مستخدم طلبه التالي فور انتهاء السابق.
+
+النتائج تُطبع بصيغة JSON: عدد الطلبات في الثانية، ونسب الأخطاء، وp50/p95/p99/max
+بالمللي ثانية لكل نقطة نهاية وللمجموع.
+
+الاستخدام:
+    python benchmarks/load_test.py --db-sizes 0,100000,1000000 --users 32 --duration 20
+    python benchmarks/load_test.py --mix count=60,track=30,statistics=8,admin=2 --rate 500
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --duration 30
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_PREFIX = '/api/visitor-counter'
+
+# اسم المكون في --mix -> (الطريقة، المسار)
+ENDPOINTS = {
+    'count': ('GET', f'{API_PREFIX}/count'),
+    'track': ('POST', f'{API_PREFIX}/track'),
+    'statistics': ('GET', f'{API_PREFIX}/statistics'),
+    'admin': ('GET', f'{API_PREFIX}/admin/settings'),
+    'health': ('GET', f'{API_PREFIX}/health'),
+}
+DEFAULT_MIX = 'count=70,track=20,statistics=8,admin=2'
+
+
+def parse_mix(spec):
+    """تحويل 'count=70,track=20' إلى قائمة (اسم، وزن)"""
+    mix = []
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f'نقطة نهاية غير معروفة في المزيج: {name}')
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return round(sorted_values[index] * 1000, 2)
+
+
+def summarize(latencies, errors, elapsed):
+    """ملخص مجموعة قياسات: العدد والإنتاجية ونسبة الأخطاء والمئينات بالمللي ثانية"""
+    latencies = sorted(latencies)
+    total = len(latencies) + errors
+    return {
+        'requests': total,
+        'rps': round(total / elapsed, 1) if elapsed else None,
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': round(latencies[-1] * 1000, 2) if latencies else None,
+        },
+    }
+
+
+class VirtualUser:
+    """مستخدم افتراضي باتصال HTTP دائم وملف تعريف زائر خاص به"""
+
+    def __init__(self, host, port, rng, new_visitor_ratio, timeout):
+        self.host = host
+        self.port = port
+        self.rng = rng
+        self.new_visitor_ratio = new_visitor_ratio
+        self.timeout = timeout
+        self.cookie = None
+        self.connection = None
+
+    def request(self, method, path):
+        """إرسال طلب وإرجاع رمز الحالة (إعادة الاتصال إذا أغلقه الخادم)"""
+        if self.rng.random() < self.new_visitor_ratio:
+            self.cookie = None
+        headers = {'User-Agent': 'naebak-load-test'}
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request(method, path, body=b'' if method == 'POST' else None, headers=headers)
+                response = self.connection.getresponse()
+                response.read()
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                # الاتصال الدائم أُغلق من الخادم (مثل عمال sync): إعادة المحاولة مرة على اتصال جديد
+                self.close()
+                if attempt:
+                    raise
+        for header, value in response.getheaders():
+            if header.lower() == 'set-cookie' and value.startswith('visitor_id='):
+                self.cookie = value.split(';', 1)[0]
+        if response.will_close:
+            self.close()
+        return response.status
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def run_load(base_url, mix, users, duration, rate, warmup, new_visitor_ratio, timeout, seed):
+    parsed = urllib.parse.urlsplit(base_url)
+    host, port = parsed.hostname, parsed.port or 80
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+
+    results = {name: {'latencies': [], 'errors': 0} for name in names}
+    lock = threading.Lock()
+    start_at = time.perf_counter() + warmup
+    stop_at = start_at + duration
+    # في الحمل المفتوح كل مستخدم مسؤول عن جزء من المعدل الكلي بمواعيد ثابتة
+    interval = users / rate if rate else None
+
+    def run_user(index):
+        rng = random.Random(seed + index)
+        user = VirtualUser(host, port, rng, new_visitor_ratio, timeout)
+        local = {name: {'latencies': [], 'errors': 0} for name in names}
+        next_send = time.perf_counter() + (rng.random() * interval if interval else 0)
+        try:
+            while True:
+                if interval:
+                    delay = next_send - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    scheduled = next_send
+                    next_send += interval
+                else:
+                    scheduled = time.perf_counter()
+                if scheduled >= stop_at:
+                    break
+
+                name = rng.choices(names, weights)[0]
+                method, path = ENDPOINTS[name]
+                try:
+                    status = user.request(method, path)
+                    ok = status < 400
+                except (OSError, http.client.HTTPException):
+                    ok = False
+                    user.close()
+                finished = time.perf_counter()
+
+                # الطلبات المجدولة أثناء الإحماء لا تدخل في النتائج
+                if scheduled < start_at:
+                    continue
+                if ok:
+                    local[name]['latencies'].append(finished - scheduled)
+                else:
+                    local[name]['errors'] += 1
+        finally:
+            user.close()
+            with lock:
+                for name, values in local.items():
+                    results[name]['latencies'].extend(values['latencies'])
+                    results[name]['errors'] += values['errors']
+
+    threads = [threading.Thread(target=run_user, args=(index,), daemon=True) for index in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # الطلبات الأخيرة قد تنتهي بعد stop_at؛ تُحسب الإنتاجية على مدة القياس المطلوبة
+    elapsed = duration
+
+    all_latencies = [value for values in results.values() for value in values['latencies']]
+    all_errors = sum(values['errors'] for values in results.values())
+    return {
+        **summarize(all_latencies, all_errors, elapsed),
+        'endpoints': {
+            name: summarize(values['latencies'], values['errors'], elapsed)
+            for name, values in results.items()
+        },
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(base_url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('توقف gunicorn قبل أن يصبح جاهزاً')
+        try:
+            urllib.request.urlopen(f'{base_url}{API_PREFIX}/health', timeout=2).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('انتهت مهلة انتظار gunicorn')
+
+
+def populate(path, size, active_ratio=0.01):
+    """إضافة جلسات موزعة على آخر 90 يوماً، منها نسبة نشطة خلال آخر نصف ساعة"""
+    if size <= 0:
+        return
+    now = datetime.utcnow()
+    connection = sqlite3.connect(path, timeout=60)
+    try:
+        connection.execute(
+            """
+            WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < :size)
+            INSERT INTO visitor_sessions
+                (session_id, ip_address, user_agent, first_visit, last_activity, page_views, is_active)
+            SELECT
+                printf('load_seed_%d', n),
+                '10.0.0.1',
+                'naebak-load-test',
+                strftime('%Y-%m-%d %H:%M:%f', :now, printf('-%d seconds', offset)),
+                strftime('%Y-%m-%d %H:%M:%f', :now, printf('-%d seconds', recent)),
+                1 + abs(random()) % 10,
+                recent < 86400
+            FROM (
+                SELECT
+                    n,
+                    abs(random()) % (90 * 86400) AS offset,
+                    CASE WHEN abs(random()) % 1000000 < :active THEN abs(random()) % 1800
+                         ELSE 86400 + abs(random()) % (89 * 86400) END AS recent
+                FROM seq
+            )
+            """,
+            {'size': size, 'now': now.isoformat(sep=' '), 'active': int(active_ratio * 1000000)},
+        )
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def file_size(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ('', '-wal') if os.path.exists(path + suffix))
+
+
+def run_gunicorn(size, args, mix):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    env = dict(
+        os.environ,
+        DATABASE_URL=f'sqlite:///{path}',
+        SCHEDULER_ENABLED='false',
+        SQLITE_POOL_SIZE=str(max(args.threads, 1)),
+    )
+    command = [
+        sys.executable, '-m', 'gunicorn', 'src.main:app',
+        '--bind', f'127.0.0.1:{port}',
+        '--workers', str(args.workers),
+        '--threads', str(args.threads),
+        '--worker-class', args.worker_class or ('gthread' if args.threads > 1 else 'sync'),
+        '--backlog', '2048',
+        '--timeout', '120',
+        '--log-level', 'warning',
+    ]
+    process = subprocess.Popen(command, cwd=PROJECT_ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # الخادم ينشئ الجداول والفهارس عند تشغيله ثم تُملأ قاعدة البيانات قبل بدء الحمل
+        wait_until_ready(base_url, process)
+        populate(path, size)
+        result = run_load(base_url, mix, args.users, args.duration, args.rate,
+                          args.warmup, args.new_visitor_ratio, args.timeout, args.seed)
+        return {
+            'db_sessions': size,
+            'db_bytes': file_size(path),
+            'server': {
+                'workers': args.workers,
+                'threads': args.threads,
+                'worker_class': command[command.index('--worker-class') + 1],
+            },
+            **result,
+        }
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='اختبار حمل لخدمة عداد الزوار عبر gunicorn')
+    parser.add_argument('--url', help='استهداف خادم قائم بدلاً من تشغيل gunicorn (يتجاهل --db-sizes)')
+    parser.add_argument('--db-sizes', default='0', help='أحجام قاعدة البيانات بعدد الجلسات، مفصولة بفواصل')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'أوزان نقاط النهاية ({", ".join(ENDPOINTS)})')
+    parser.add_argument('--users', type=int, default=16, help='عدد المستخدمين الافتراضيين المتزامنين')
+    parser.add_argument('--duration', type=float, default=15.0, help='مدة القياس بالثواني')
+    parser.add_argument('--warmup', type=float, default=2.0, help='مدة الإحماء المستبعدة من النتائج')
+    parser.add_argument('--rate', type=float, default=0.0, help='معدل ثابت للطلبات في الثانية (0 = حمل مغلق)')
+    parser.add_argument('--new-visitor-ratio', type=float, default=0.2, help='احتمال أن يكون الطلب من زائر جديد')
+    parser.add_argument('--timeout', type=float, default=30.0, help='مهلة الطلب الواحد بالثواني')
+    parser.add_argument('--workers', type=int, default=2, help='عدد عمال gunicorn')
+    parser.add_argument('--threads', type=int, default=4, help='خيوط كل عامل gunicorn')
+    parser.add_argument('--worker-class', help='نوع عامل gunicorn (sync أو gthread افتراضياً)')
+    parser.add_argument('--seed', type=int, default=1, help='بذرة اختيار الطلبات')
+    parser.add_argument('--output', help='حفظ النتائج في ملف JSON أيضاً')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    if args.url:
+        results = [{
+            'url': args.url,
+            **run_load(args.url.rstrip('/'), mix, args.users, args.duration, args.rate,
+                       args.warmup, args.new_visitor_ratio, args.timeout, args.seed),
+        }]
+    else:
+        results = [run_gunicorn(int(size), args, mix) for size in args.db_sizes.split(',')]
+
+    report = {
+        'mix': dict(mix),
+        'users': args.users,
+        'duration': args.duration,
+        'rate': args.rate or None,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            handle.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
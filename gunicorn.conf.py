@@ -0,0 +1,23 @@
+# إعدادات gunicorn: gunicorn -c gunicorn.conf.py src.main:app
+import os
+import shutil
+import tempfile
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8008')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# مجلد ملفات القياسات المشتركة بين العمال؛ يجب ضبطه قبل أن يستورد أي عامل prometheus_client
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'naebak-visitor-counter-metrics'))
+
+
+def on_starting(server):
+    # ملفات تشغيل سابق ستُجمع مع القيم الجديدة إذا لم تُحذف
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,237 @@
+import asyncio
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# إضافة مسار المشروع
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from src.main import app as flask_app
+from src.routes.visitor_counter import SSE_HEADERS
+from src.services.count_stream import count_broadcaster
+
+
+class ExecutorASGIApp:
+    """تطبيق ASGI يخدم مسارات Flask نفسها: الشبكة تُدار في حلقة asyncio وعمل قاعدة البيانات في مجمع خيوط محدود"""
+
+    def __init__(self, wsgi_app, max_workers=10, max_body_size=16 * 1024 * 1024, streams=None):
+        self.wsgi_app = wsgi_app
+        # مسارات SSE تُخدم مباشرة في الحلقة: الاتصال المفتوح لا يشغل خيطاً من المجمع
+        self.streams = streams or {}
+        self.max_workers = max_workers
+        self.max_body_size = max_body_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='asgi-db')
+        self._slots = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self._executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        broadcaster = self.streams.get(scope['path'])
+        if broadcaster is not None and scope['method'] == 'GET' and not broadcaster.is_full():
+            await self._stream(broadcaster, scope, receive, send)
+            return
+
+        # قراءة الجسم كاملاً قبل حجز خيط حتى لا يشغل عميل بطيء خيطاً أثناء الرفع
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.extend(message.get('body', b''))
+            if len(body) > self.max_body_size:
+                await self._send_simple(send, 413, b'Request Entity Too Large')
+                return
+            if not message.get('more_body', False):
+                break
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+        loop = asyncio.get_running_loop()
+        environ = self._environ(scope, bytes(body))
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ]
+            # استجابات text/event-stream لا تنتهي، والاستجابات بلا Content-Length (التصدير) قد تكون
+            # بحجم الجدول كاملاً، فتُرسل أجزاؤها أولاً بأول بدلاً من جمعها
+            environ['asgi.streaming_response'] = any(
+                name == b'content-type' and value.startswith(b'text/event-stream')
+                for name, value in started['headers']
+            ) or not any(name == b'content-length' for name, _ in started['headers'])
+            return lambda data: None
+
+        self._count('waiting', 1)
+        async with self._slots:
+            self._count('waiting', -1)
+            self._count('in_flight', 1)
+            try:
+                # الطلبات الزائدة تنتظر في الحلقة (تكلفة ضئيلة) لا في طابور المجمع
+                chunks = await loop.run_in_executor(
+                    self._executor, self._run_wsgi, environ, start_response
+                )
+            finally:
+                self._count('in_flight', -1)
+
+        await send({
+            'type': 'http.response.start',
+            'status': started['status'],
+            'headers': started['headers']
+        })
+        if isinstance(chunks, list):
+            await send({'type': 'http.response.body', 'body': b''.join(chunks)})
+            return
+
+        # استجابة متدفقة: كل جزء يُنتج في المجمع ويُرسل من الحلقة
+        try:
+            while True:
+                chunk = await loop.run_in_executor(self._executor, next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(chunks, 'close'):
+                await loop.run_in_executor(self._executor, chunks.close)
+
+    async def _stream(self, broadcaster, scope, receive, send):
+        """إرسال أحداث المنتج حتى يقطع العميل الاتصال"""
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'text/event-stream; charset=utf-8')] + [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in SSE_HEADERS.items()
+            ] + self._cors_headers(scope)
+        })
+
+        async def relay():
+            async for chunk in broadcaster.async_events():
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+        async def wait_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        tasks = [asyncio.ensure_future(relay()), asyncio.ensure_future(wait_disconnect())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is not None and task is tasks[0]:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    def _cors_headers(scope):
+        """ترويسات CORS التي يضيفها CORS(app, supports_credentials=True) في main.py لطلبات Flask.
+
+        البث لا يمر بـ Flask، ومع supports_credentials يُعاد أصل الطلب نفسه بدل * حتى يقبله
+        EventSource المفتوح بـ withCredentials من الواجهة الأمامية.
+        """
+        origin = next((value for name, value in scope.get('headers', []) if name.lower() == b'origin'), None)
+        if origin is None:
+            return []
+        return [
+            (b'access-control-allow-origin', origin),
+            (b'access-control-allow-credentials', b'true'),
+            (b'vary', b'Origin'),
+        ]
+
+    def _run_wsgi(self, environ, start_response):
+        """تنفيذ تطبيق Flask داخل خيط المجمع؛ الاستجابات العادية تُجمع كاملة قبل العودة إلى الحلقة"""
+        result = self.wsgi_app(environ, start_response)
+        if environ.get('asgi.streaming_response'):
+            return iter(result)
+        try:
+            return list(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    @staticmethod
+    def _environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for raw_name, raw_value in scope.get('headers', []):
+            name = raw_name.decode('latin-1').upper().replace('-', '_')
+            value = raw_value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = f'HTTP_{name}'
+                environ[key] = f'{environ[key]},{value}' if key in environ else value
+        return environ
+
+    def _count(self, name, delta):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + delta)
+
+    @staticmethod
+    async def _send_simple(send, status, body):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'text/plain'), (b'content-length', str(len(body)).encode())]
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting
+            }
+
+
+app = ExecutorASGIApp(
+    flask_app,
+    max_workers=flask_app.config['ASGI_EXECUTOR_WORKERS'],
+    streams={'/api/visitor-counter/stream': count_broadcaster}
+)
+flask_app.extensions['asgi'] = app
@@ -0,0 +1,118 @@
+import click
+from datetime import datetime, timedelta
+from src.models.migrations import run_migrations
+from src.services.export import EXPORT_FORMATS, EXPORT_TABLES, iter_export
+from src.services.log_import import import_access_log
+from src.services.visitor_service import VisitorCounterService
+
+
+def register_commands(app):
+    """تسجيل أوامر سطر الأوامر الخاصة بخدمة عداد الزوار"""
+
+    @app.cli.command('rebuild-stats')
+    @click.option('--date', 'date_text', default=None, help='اليوم المراد إعادة حسابه بصيغة YYYY-MM-DD (اليوم الحالي افتراضياً)')
+    @click.option('--days', default=1, show_default=True, help='عدد الأيام المراد إعادة حسابها انتهاءً بالتاريخ المحدد')
+    def rebuild_stats(date_text, days):
+        """إعادة حساب الإحصائيات اليومية بدقة من جلسات الزوار.
+
+        الأيام الأقدم من SESSION_RETENTION_DAYS تُتخطى لأن التنظيف حذف جلساتها وإحصائياتها المحفوظة هي المرجع.
+        """
+        if date_text:
+            try:
+                end_day = datetime.strptime(date_text, '%Y-%m-%d').date()
+            except ValueError:
+                raise click.BadParameter('يجب أن يكون التاريخ بصيغة YYYY-MM-DD', param_hint='--date')
+        else:
+            end_day = datetime.utcnow().date()
+
+        for offset in range(days - 1, -1, -1):
+            day = end_day - timedelta(days=offset)
+            try:
+                stats = VisitorCounterService.rebuild_daily_stats(day)
+            except ValueError as error:
+                click.echo(f'{day.isoformat()}: تم التخطي. {error}')
+                continue
+            if stats:
+                click.echo(f'{day.isoformat()}: {stats.unique_visitors} زائر، {stats.total_page_views} مشاهدة')
+            else:
+                click.echo(f'{day.isoformat()}: لا توجد بيانات')
+
+    @app.cli.command('migrate-db')
+    def migrate_db():
+        """تطبيق ترحيلات مخطط قاعدة البيانات على ملف قائم"""
+        applied = run_migrations()
+        if applied:
+            for migration_id in applied:
+                click.echo(f'تم تطبيق {migration_id}')
+        else:
+            click.echo('قاعدة البيانات محدثة')
+
+    @app.cli.command('cleanup-sessions')
+    @click.option('--retention-days', type=int, default=None, help='حذف الجلسات غير النشطة الأقدم من هذا العدد من الأيام (إعداد SESSION_RETENTION_DAYS افتراضياً)')
+    @click.option('--batch-size', type=int, default=None, help='عدد الصفوف في كل دفعة (إعداد CLEANUP_BATCH_SIZE افتراضياً)')
+    def cleanup_sessions(retention_days, batch_size):
+        """إلغاء تفعيل الجلسات غير النشطة وحذف المنتهية على دفعات.
+
+        الإحصائيات اليومية تبقى بعد الحذف، لكن أيامها لا يمكن إعادة حسابها بعده (rebuild-stats يتخطاها).
+        """
+        deactivated = VisitorCounterService.cleanup_old_sessions(batch_size=batch_size)
+        deleted = VisitorCounterService.purge_expired_sessions(retention_days, batch_size)
+        click.echo(f'تم إلغاء تفعيل {deactivated} جلسة وحذف {deleted} جلسة')
+
+    @app.cli.command('compact-rollups')
+    @click.option('--hours', type=int, default=None, help='عدد الساعات المراد إعادة تجميعها انتهاءً بالآن (إعداد ROLLUP_COMPACTION_HOURS افتراضياً)')
+    def compact_rollups(hours):
+        """إعادة بناء جداول التجميع الساعية والشهرية"""
+        result = VisitorCounterService.compact_rollups(hours)
+        click.echo(f"تم تجميع {result['hours']} ساعة و{result['months']} شهر")
+
+    @app.cli.command('export-data')
+    @click.argument('table', type=click.Choice(sorted(EXPORT_TABLES)))
+    @click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_FORMATS)), default='csv', show_default=True, help='صيغة الملف')
+    @click.option('--from', 'start_text', default=None, help='بداية النطاق (ضمنية) بصيغة ISO 8601')
+    @click.option('--to', 'end_text', default=None, help='نهاية النطاق (غير ضمنية) بصيغة ISO 8601')
+    @click.option('--gzip', 'compress', is_flag=True, help='ضغط الملف بصيغة gzip')
+    @click.option('--output', type=click.File('wb'), default='-', help='مسار الملف (المخرج القياسي افتراضياً)')
+    def export_data(table, fmt, start_text, end_text, compress, output):
+        """تصدير جلسات الزوار أو الإحصائيات اليومية دفعةً دفعة دون تحميلها في الذاكرة"""
+        try:
+            start = VisitorCounterService.parse_event_timestamp(start_text, None)
+        except ValueError:
+            raise click.BadParameter('يجب أن يكون التاريخ بصيغة ISO 8601', param_hint='--from')
+        try:
+            end = VisitorCounterService.parse_event_timestamp(end_text, None)
+        except ValueError:
+            raise click.BadParameter('يجب أن يكون التاريخ بصيغة ISO 8601', param_hint='--to')
+
+        batch_size = app.config.get('EXPORT_BATCH_SIZE', 1000)
+        for chunk in iter_export(table, fmt, start, end, compress, batch_size):
+            output.write(chunk)
+
+    @app.cli.command('import-access-logs')
+    @click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+    @click.option('--batch-size', type=int, default=20000, show_default=True, help='عدد الزوار في كل معاملة كتابة')
+    @click.option('--chunk-lines', type=int, default=10000, show_default=True, help='عدد الأسطر في كل مهمة تحليل')
+    @click.option('--workers', type=int, default=None, help='عدد عمليات التحليل (عدد المعالجات افتراضياً، 1 للتحليل في العملية نفسها)')
+    @click.option('--path-regex', default=None, help='احتساب المسارات المطابقة لهذا التعبير فقط')
+    @click.option('--reset', is_flag=True, help='تجاهل موضع الاستئناف المحفوظ والبدء من أول الملف')
+    def import_access_logs(paths, batch_size, chunk_lines, workers, path_regex, reset):
+        """استيراد سجلات وصول nginx/gunicorn (صيغة combined، مضغوطة بـ gzip أو لا) إلى الجلسات والإحصائيات"""
+        def report(progress):
+            click.echo(
+                f"{progress['source']}: {progress['lines']} سطر، "
+                f"{progress['new_sessions']} جلسة جديدة، {progress['updated_sessions']} محدثة، "
+                f"{progress['lines_per_second']:.0f} سطر/ثانية"
+            )
+
+        for path in paths:
+            try:
+                result = import_access_log(
+                    path, batch_size, chunk_lines, workers, path_regex, reset, progress=report
+                )
+            except ValueError as error:
+                raise click.ClickException(str(error))
+            resumed = f"، استؤنف من السطر {result['resumed_from']}" if result['resumed_from'] else ''
+            click.echo(
+                f"اكتمل {result['source']}: {result['lines'] - result['resumed_from']} سطر "
+                f"({result['skipped']} متجاهل{resumed}) بمعدل {result['lines_per_second']:.0f} سطر/ثانية"
+            )
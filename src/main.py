@@ -6,7 +6,19 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 from flask import Flask, send_from_directory
 from flask_cors import CORS
 from src.models.visitor_counter import db
+from src.models.migrations import run_migrations
+from src.models.sqlite_profile import build_engine_options, apply_sqlite_profile
 from src.routes.visitor_counter import visitor_counter_bp
+from src.services.visitor_buffer import visitor_buffer
+from src.services.active_window import active_visitor_window
+from src.services.visitor_id import visitor_id_cookie
+from src.services.scheduler import scheduler
+from src.services.count_stream import count_broadcaster
+from src.services.metrics import service_metrics
+from src.services.counter_store import counter_store
+from src.models.partitions import session_partitions
+from src.services.hyperloglog import register_sqlite_functions
+from src.commands import register_commands
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'naebak_visitor_counter_secret_key_2024'
@@ -18,18 +30,131 @@ CORS(app, supports_credentials=True)
 app.register_blueprint(visitor_counter_bp, url_prefix='/api/visitor-counter')
 
 # إعداد قاعدة البيانات
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'visitor_counter.db')}"
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'visitor_counter.db')}"
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# ملف تعريف محرك SQLite (production: WAL + busy_timeout + pragmas، default: إعدادات SQLite الافتراضية)
+app.config['SQLITE_PROFILE'] = os.environ.get('SQLITE_PROFILE', 'production')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'],
+    app.config['SQLITE_PROFILE'],
+    pool_size=int(os.environ.get('SQLITE_POOL_SIZE', 0)) or None
+)
 db.init_app(app)
 
+with app.app_context():
+    apply_sqlite_profile(db.engine, app.config['SQLITE_PROFILE'])
+    register_sqlite_functions(db.engine)
+
+# قياسات Prometheus في /metrics (تُجمع من كل العمال عند ضبط PROMETHEUS_MULTIPROC_DIR)
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+# ترويسات X-DB-Queries وX-DB-Time-Ms للتشخيص، وتحذير في السجل للطلبات التي تتجاوز عدد الاستعلامات (0 لتعطيله)
+app.config['QUERY_COUNT_HEADER'] = os.environ.get('QUERY_COUNT_HEADER', 'false').lower() == 'true'
+app.config['QUERY_LOG_THRESHOLD'] = int(os.environ.get('QUERY_LOG_THRESHOLD', 20))
+with app.app_context():
+    service_metrics.init_app(app, db.engine)
+
+# وضع الكتابة المؤجلة لتتبع الزوار (اختياري)
+app.config['VISITOR_BUFFER_ENABLED'] = os.environ.get('VISITOR_BUFFER_ENABLED', 'false').lower() == 'true'
+app.config['VISITOR_BUFFER_MAX_SIZE'] = int(os.environ.get('VISITOR_BUFFER_MAX_SIZE', 500))
+app.config['VISITOR_BUFFER_FLUSH_INTERVAL'] = float(os.environ.get('VISITOR_BUFFER_FLUSH_INTERVAL', 2.0))
+# حد الجلسات المعلقة في الذاكرة إذا تعذرت الكتابة في قاعدة البيانات، وما يزيد عليه يُسقط ويُسجل
+app.config['VISITOR_BUFFER_MAX_PENDING'] = int(os.environ.get('VISITOR_BUFFER_MAX_PENDING', 10000))
+visitor_buffer.init_app(app)
+
+# نافذة منزلقة في الذاكرة لعدّ الزوار النشطين (يحتفظ كل عامل بنافذته الخاصة)
+app.config['ACTIVE_WINDOW_ENABLED'] = os.environ.get('ACTIVE_WINDOW_ENABLED', 'false').lower() == 'true'
+app.config['ACTIVE_WINDOW_MINUTES'] = int(os.environ.get('ACTIVE_WINDOW_MINUTES', 30))
+app.config['ACTIVE_WINDOW_BUCKET_SECONDS'] = int(os.environ.get('ACTIVE_WINDOW_BUCKET_SECONDS', 60))
+active_visitor_window.init_app(app)
+
+# ملف تعريف معرف الزائر الموقّع (يحل محل تخزين المعرف في جلسة Flask)
+app.config['VISITOR_COOKIE_NAME'] = os.environ.get('VISITOR_COOKIE_NAME', 'visitor_id')
+app.config['VISITOR_COOKIE_MAX_AGE'] = int(os.environ.get('VISITOR_COOKIE_MAX_AGE', 365 * 24 * 3600))
+app.config['VISITOR_COOKIE_SECURE'] = os.environ.get('VISITOR_COOKIE_SECURE', 'false').lower() == 'true'
+visitor_id_cookie.init_app(app)
+
+# الحد الأقصى لعدد الزيارات في طلب POST /track/batch
+app.config['VISITOR_BATCH_MAX_EVENTS'] = int(os.environ.get('VISITOR_BATCH_MAX_EVENTS', 10000))
+
+# فترة صلاحية لقطة العدد المعروض بالثواني (0 لتعطيل التخزين المؤقت)
+app.config['VISITOR_COUNT_CACHE_TTL'] = float(os.environ.get('VISITOR_COUNT_CACHE_TTL', 5))
+
+# تقسيم جدول الجلسات زمنياً إلى جداول يومية أو أسبوعية (none لتعطيله)
+app.config['SESSION_PARTITIONING'] = os.environ.get('SESSION_PARTITIONING', 'none').lower()
+session_partitions.init_app(app)
+
+# ترويسات Cache-Control لكل نقطة نهاية (مع ETag وردود 304) لتتمكن الشبكات الوسيطة والمتصفحات من إعادة الاستخدام
+app.config['COUNT_CACHE_CONTROL'] = os.environ.get('COUNT_CACHE_CONTROL', 'public, max-age=5, stale-while-revalidate=30')
+app.config['STATISTICS_CACHE_CONTROL'] = os.environ.get('STATISTICS_CACHE_CONTROL', 'public, max-age=60, stale-while-revalidate=300')
+app.config['SETTINGS_CACHE_CONTROL'] = os.environ.get('SETTINGS_CACHE_CONTROL', 'private, no-cache')
+
+# بث العدد المعروض عبر SSE: منتج واحد لكل عامل يقرأ العدد كل فترة ويرسله عند تغيره
+app.config['COUNT_STREAM_INTERVAL'] = float(os.environ.get('COUNT_STREAM_INTERVAL', 2))
+app.config['COUNT_STREAM_KEEPALIVE'] = float(os.environ.get('COUNT_STREAM_KEEPALIVE', 15))
+app.config['COUNT_STREAM_MAX_SUBSCRIBERS'] = int(os.environ.get('COUNT_STREAM_MAX_SUBSCRIBERS', 1000))
+# تحت gunicorn (gthread) يحجز كل اتصال بث خيط طلب طوال بقائه، فيبقى الحد ربع خيوط العامل حتى لا تتوقف /count و/track
+app.config['COUNT_STREAM_MAX_WSGI_SUBSCRIBERS'] = int(os.environ.get(
+    'COUNT_STREAM_MAX_WSGI_SUBSCRIBERS', max(1, int(os.environ.get('GUNICORN_THREADS', 8)) // 4)
+))
+count_broadcaster.init_app(app)
+
 # إنشاء الجداول
 with app.app_context():
     db.create_all()
+    run_migrations()
     
     # إنشاء الإعدادات الافتراضية إذا لم تكن موجودة
     from src.services.visitor_service import VisitorCounterService
     VisitorCounterService.get_or_create_settings()
 
+# تنظيف الجلسات على دفعات: إلغاء تفعيل غير النشطة ثم حذف الأقدم من فترة الاحتفاظ
+app.config['SESSION_INACTIVE_HOURS'] = int(os.environ.get('SESSION_INACTIVE_HOURS', 24))
+app.config['SESSION_RETENTION_DAYS'] = int(os.environ.get('SESSION_RETENTION_DAYS', 30))
+app.config['CLEANUP_BATCH_SIZE'] = int(os.environ.get('CLEANUP_BATCH_SIZE', 1000))
+app.config['CLEANUP_BATCH_PAUSE'] = float(os.environ.get('CLEANUP_BATCH_PAUSE', 0.05))
+app.config['CLEANUP_INTERVAL'] = int(os.environ.get('CLEANUP_INTERVAL', 900))
+
+# إعادة بناء لقطة /statistics في جدول statistics_snapshot كل فترة بالثواني (0 لحساب الإحصائيات مع كل طلب)
+app.config['STATISTICS_SNAPSHOT_INTERVAL'] = int(os.environ.get('STATISTICS_SNAPSHOT_INTERVAL', 60))
+
+# ضغط الجلسات الخام إلى تجميعات ساعية وشهرية لـ /statistics/range، مع إعادة تجميع آخر N ساعة في كل تشغيل
+app.config['ROLLUP_COMPACTION_INTERVAL'] = int(os.environ.get('ROLLUP_COMPACTION_INTERVAL', 300))
+app.config['ROLLUP_COMPACTION_HOURS'] = int(os.environ.get('ROLLUP_COMPACTION_HOURS', 48))
+
+# عدد الصفوف التي يجلبها مؤشر التصدير في كل مرة (ذاكرة التصدير ثابتة بحجم دفعة واحدة)
+app.config['EXPORT_BATCH_SIZE'] = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+# الواجهة الخلفية للعدادات الساخنة (تتبع الجلسات والزوار النشطين وعدادات اليوم): sql أو memory أو redis.
+# خارج SQL يبقى تاريخ الجلسات والإحصائيات في قاعدة البيانات ويُكتب عبر المخزن المؤقت إن كان مفعلاً
+app.config['COUNTER_BACKEND'] = os.environ.get('COUNTER_BACKEND', 'sql').lower()
+app.config['COUNTER_REDIS_URL'] = os.environ.get('COUNTER_REDIS_URL', 'redis://localhost:6379/0')
+app.config['COUNTER_REDIS_PREFIX'] = os.environ.get('COUNTER_REDIS_PREFIX', 'naebak:visitor-counter:')
+counter_store.init_app(app)
+
+# المجدول الدوري داخل العامل (عامل واحد فقط ينفذ كل مهمة في كل فترة)
+app.config['SCHEDULER_ENABLED'] = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
+app.config['SCHEDULER_TICK_SECONDS'] = float(os.environ.get('SCHEDULER_TICK_SECONDS', 5))
+scheduler.add_job('cleanup-sessions', app.config['CLEANUP_INTERVAL'], VisitorCounterService.cleanup_sessions)
+scheduler.add_job('compact-rollups', app.config['ROLLUP_COMPACTION_INTERVAL'], VisitorCounterService.compact_rollups)
+if app.config['STATISTICS_SNAPSHOT_INTERVAL'] > 0:
+    scheduler.add_job(
+        'refresh-statistics', app.config['STATISTICS_SNAPSHOT_INTERVAL'],
+        lambda: VisitorCounterService.refresh_statistics_snapshot()['generated_at']
+    )
+scheduler.init_app(app)
+
+# عدد خيوط قاعدة البيانات لكل عامل في وضع ASGI (src.asgi:app)؛ يُفضَّل أن يساوي SQLITE_POOL_SIZE
+app.config['ASGI_EXECUTOR_WORKERS'] = int(
+    os.environ.get('ASGI_EXECUTOR_WORKERS', os.environ.get('SQLITE_POOL_SIZE', 0)) or 10
+)
+
+# أوامر الصيانة (flask --app src.main <command>)
+register_commands(app)
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
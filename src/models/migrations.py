@@ -0,0 +1,70 @@
+from datetime import datetime
+from sqlalchemy import text
+from src.models.visitor_counter import db
+
+# ترحيلات مخطط قاعدة البيانات لملفات visitor_counter.db الموجودة مسبقاً.
+# db.create_all() لا يعدّل الجداول القائمة، لذلك تُضاف هنا الفهارس والأعمدة الجديدة
+# بالترتيب، ويُسجَّل كل ترحيل مطبّق في جدول schema_migrations.
+MIGRATIONS = [
+    ('0001_visitor_sessions_indexes', [
+        'CREATE INDEX IF NOT EXISTS ix_visitor_sessions_active_last_activity '
+        'ON visitor_sessions (is_active, last_activity)',
+        'CREATE INDEX IF NOT EXISTS ix_visitor_sessions_first_visit_page_views '
+        'ON visitor_sessions (first_visit, page_views)',
+        'ANALYZE visitor_sessions',
+    ]),
+    ('0002_settings_version', [
+        lambda connection: _add_column(
+            connection, 'visitor_counter_settings', 'version', 'INTEGER NOT NULL DEFAULT 1'
+        ),
+    ]),
+    ('0003_settings_base_seed', [
+        lambda connection: _add_column(
+            connection, 'visitor_counter_settings', 'base_seed', 'INTEGER NOT NULL DEFAULT 0'
+        ),
+        # بذرة عشوائية للصفوف الموجودة، وزيادة version حتى تعيد العمال تحميل الإعدادات
+        'UPDATE visitor_counter_settings SET base_seed = 1 + abs(random() % 2147483646), '
+        'version = version + 1 WHERE base_seed = 0',
+    ]),
+]
+
+
+def _add_column(connection, table, column, definition):
+    # الجداول المنشأة حديثاً عبر create_all تحتوي العمود مسبقاً
+    columns = {row[1] for row in connection.execute(text(f'PRAGMA table_info({table})'))}
+    if column not in columns:
+        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {definition}'))
+
+
+def _applied_migrations(connection):
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'id VARCHAR(100) PRIMARY KEY, applied_at DATETIME NOT NULL)'
+    ))
+    return {row[0] for row in connection.execute(text('SELECT id FROM schema_migrations'))}
+
+
+def run_migrations():
+    """تطبيق الترحيلات غير المطبقة وإرجاع معرفاتها"""
+    applied_now = []
+
+    with db.engine.begin() as connection:
+        applied = _applied_migrations(connection)
+
+        for migration_id, statements in MIGRATIONS:
+            if migration_id in applied:
+                continue
+
+            for statement in statements:
+                if callable(statement):
+                    statement(connection)
+                else:
+                    connection.execute(text(statement))
+
+            connection.execute(
+                text('INSERT INTO schema_migrations (id, applied_at) VALUES (:id, :applied_at)'),
+                {'id': migration_id, 'applied_at': datetime.utcnow()}
+            )
+            applied_now.append(migration_id)
+
+    return applied_now
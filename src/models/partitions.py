@@ -0,0 +1,177 @@
+import re
+import threading
+from datetime import datetime, timedelta
+from flask import g, has_app_context
+from sqlalchemy import Index, MetaData, Table, event, select, text, union_all
+from src.models.visitor_counter import db, VisitorSession
+
+# التقسيم الزمني لجدول الجلسات: كل جلسة تُخزَّن في جدول الفترة التي بدأت فيها (أول زيارة)،
+# فاستعلامات أول زيارة (زوار اليوم، إعادة حساب يوم) تلمس جدولاً واحداً، والاحتفاظ يصبح DROP TABLE.
+PARTITION_DAYS = {
+    'day': 1,
+    'week': 7,
+}
+PARTITION_PREFIX = 'visitor_sessions_p'
+_PARTITION_NAME = re.compile(rf'^{PARTITION_PREFIX}(\d{{8}})$')
+
+
+class SessionPartitions:
+    """توجيه جلسات الزوار إلى جداول يومية أو أسبوعية (اختياري)"""
+
+    def __init__(self, app=None):
+        self.granularity = None
+        self._metadata = MetaData()
+        self._tables = {}
+        self._keys = None
+        self._keys_version = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    @property
+    def enabled(self):
+        return self.granularity is not None
+
+    def init_app(self, app):
+        """قراءة نمط التقسيم من التطبيق (none أو day أو week)"""
+        granularity = app.config.get('SESSION_PARTITIONING', 'none')
+        if granularity != 'none' and granularity not in PARTITION_DAYS:
+            raise ValueError(f'نمط تقسيم الجلسات غير معروف: {granularity}')
+        self.granularity = None if granularity == 'none' else granularity
+        app.extensions['session_partitions'] = self
+
+    def partition_key(self, day):
+        """تاريخ بداية الفترة التي يقع فيها اليوم"""
+        if isinstance(day, datetime):
+            day = day.date()
+        if self.granularity == 'week':
+            return day - timedelta(days=day.weekday())
+        return day
+
+    def partition_end(self, key):
+        return key + timedelta(days=PARTITION_DAYS[self.granularity])
+
+    def _table(self, key):
+        name = f'{PARTITION_PREFIX}{key:%Y%m%d}'
+        with self._lock:
+            table = self._tables.get(name)
+            if table is None:
+                # أسماء الفهارس في SQLite عامة على مستوى قاعدة البيانات، لذا تُلحق باسم الجدول
+                table = Table(
+                    name,
+                    self._metadata,
+                    *[column._copy() for column in VisitorSession.__table__.columns],
+                    Index(f'ix_{name}_active_last_activity', 'is_active', 'last_activity'),
+                    Index(f'ix_{name}_first_visit_page_views', 'first_visit', 'page_views'),
+                )
+                self._tables[name] = table
+            return table
+
+    def table_named(self, name):
+        """جدول الجلسات باسمه كما يعيده استعلام union"""
+        if name == VisitorSession.__tablename__:
+            return VisitorSession.__table__
+        return self._table(datetime.strptime(_PARTITION_NAME.match(name).group(1), '%Y%m%d').date())
+
+    def keys(self):
+        """تواريخ بداية الجداول الموجودة، من نسخة في ذاكرة العامل يُتحقق من صلاحيتها بـ PRAGMA schema_version.
+
+        SQLite يزيد schema_version مع كل CREATE أو DROP من أي اتصال، فجدول أنشأه عامل آخر أو حذفه
+        التنظيف يُعيد قراءة sqlite_master في كل العمال. داخل الطلب الواحد تُعاد القائمة نفسها دون أي استعلام.
+        """
+        if has_app_context() and 'session_partition_keys' in g:
+            return list(g.session_partition_keys)
+
+        version = db.session.execute(text('PRAGMA schema_version')).scalar()
+        with self._lock:
+            keys = self._keys if self._keys_version == version else None
+
+        if keys is None:
+            names = db.session.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE :prefix"
+            ), {'prefix': f'{PARTITION_PREFIX}%'}).scalars()
+            keys = []
+            for name in names:
+                match = _PARTITION_NAME.match(name)
+                if match:
+                    keys.append(datetime.strptime(match.group(1), '%Y%m%d').date())
+            keys.sort()
+            with self._lock:
+                self._keys = keys
+                self._keys_version = version
+
+        if has_app_context():
+            g.session_partition_keys = keys
+        return list(keys)
+
+    def invalidate_keys(self):
+        """إسقاط النسخة المخزنة من قائمة الجداول لتُقرأ من قاعدة البيانات عند الاستخدام التالي"""
+        with self._lock:
+            self._keys = None
+            self._keys_version = None
+        if has_app_context():
+            g.pop('session_partition_keys', None)
+
+    def tables(self, start_day=None, end_day=None):
+        """الجداول التي قد تحتوي جلسات أول زيارتها في [start_day, end_day)؛ visitor_sessions عند تعطيل التقسيم"""
+        if not self.enabled:
+            return [VisitorSession.__table__]
+        return [
+            self._table(key)
+            for key in self.keys()
+            if (start_day is None or self.partition_end(key) > start_day)
+            and (end_day is None or key < end_day)
+        ]
+
+    def union(self, build, start_day=None, end_day=None):
+        """استعلام فرعي يجمع build(table) لكل جدول معني بالنطاق، أو None إذا لم يوجد جدول"""
+        selects = [build(table) for table in self.tables(start_day, end_day)]
+        if not selects:
+            return None
+        if len(selects) == 1:
+            return selects[0].subquery()
+        return union_all(*selects).subquery()
+
+    def ensure_table(self, day):
+        """جدول الفترة التي يقع فيها اليوم، مع إنشائه عند أول استخدام ضمن معاملة الجلسة الحالية"""
+        key = self.partition_key(day)
+        table = self._table(key)
+        if key not in self.keys():
+            table.create(db.session.connection(), checkfirst=True)
+            # إنشاء الجدول جزء من المعاملة، فإلغاؤها يلغيه ويجب أن تُقرأ القائمة من جديد
+            event.listen(db.session(), 'after_rollback', lambda session: self.invalidate_keys(), once=True)
+            self.invalidate_keys()
+        return table
+
+    def table_for_visit(self, session_id, now, first_seen=None, lookup=False):
+        """اختيار جدول جلسة: جدول أول زيارتها إن وُجد، وإلا جدول الفترة الحالية"""
+        if first_seen is not None:
+            key = self.partition_key(first_seen)
+            if key in self.keys():
+                return self._table(key)
+        elif lookup:
+            # معرف بلا وقت أول زيارة معروف: البحث في الجداول من الأحدث للأقدم
+            for key in reversed(self.keys()):
+                table = self._table(key)
+                found = db.session.execute(
+                    select(table.c.id).where(table.c.session_id == session_id)
+                ).first()
+                if found:
+                    return table
+        return self.ensure_table(now)
+
+    def drop_before(self, day):
+        """حذف الجداول التي انتهت فترتها قبل اليوم المحدد وإرجاع عددها"""
+        dropped = 0
+        self.invalidate_keys()
+        for key in self.keys():
+            if self.partition_end(key) <= day:
+                table = self._table(key)
+                table.drop(db.session.connection(), checkfirst=True)
+                dropped += 1
+        db.session.commit()
+        self.invalidate_keys()
+        return dropped
+
+
+session_partitions = SessionPartitions()
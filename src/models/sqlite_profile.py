@@ -0,0 +1,80 @@
+from sqlalchemy import event
+
+# ملفات تعريف محرك SQLite. ملف "production" مناسب لعدة عمال gunicorn متعددي الخيوط:
+# WAL يسمح للقراء بالعمل أثناء الكتابة، وbusy_timeout يجعل الكاتب ينتظر القفل
+# بدلاً من فشل الطلب فوراً بخطأ "database is locked".
+SQLITE_PROFILES = {
+    'default': {
+        'pragmas': {},
+        'pool': {},
+    },
+    'production': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'busy_timeout': 5000,  # بالمللي ثانية
+            'synchronous': 'NORMAL',
+            'cache_size': -64000,  # بالكيلوبايت عند استخدام قيمة سالبة (64 ميجابايت)
+            'mmap_size': 268435456,  # 256 ميجابايت
+            'temp_store': 'MEMORY',
+        },
+        'pool': {
+            'pool_size': 10,
+            'max_overflow': 20,
+            'pool_timeout': 10,
+            'pool_recycle': 3600,
+            'pool_pre_ping': True,
+        },
+    },
+}
+
+
+def _is_memory_database(uri):
+    return uri in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in uri
+
+
+def build_engine_options(uri, profile_name='production', pool_size=None):
+    """بناء SQLALCHEMY_ENGINE_OPTIONS لملف التعريف المطلوب"""
+    if not uri.startswith('sqlite'):
+        return {}
+
+    if profile_name not in SQLITE_PROFILES:
+        raise ValueError(f'ملف تعريف SQLite غير معروف: {profile_name}')
+
+    profile = SQLITE_PROFILES[profile_name]
+    options = {}
+
+    # قاعدة البيانات في الذاكرة تستخدم اتصالاً واحداً مشتركاً ولا تقبل إعدادات التجمع
+    if profile['pool'] and not _is_memory_database(uri):
+        options.update(profile['pool'])
+        if pool_size:
+            options['pool_size'] = pool_size
+
+    busy_timeout = profile['pragmas'].get('busy_timeout')
+    if busy_timeout:
+        # مهلة مكتبة sqlite3 نفسها بالثواني، متوافقة مع busy_timeout
+        options['connect_args'] = {'timeout': busy_timeout / 1000, 'check_same_thread': False}
+
+    return options
+
+
+def apply_sqlite_profile(engine, profile_name='production'):
+    """تطبيق pragmas ملف التعريف على كل اتصال جديد عبر حدث connect"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = dict(SQLITE_PROFILES[profile_name]['pragmas'])
+    if not pragmas:
+        return
+
+    if _is_memory_database(str(engine.url)):
+        pragmas.pop('journal_mode', None)
+        pragmas.pop('mmap_size', None)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
@@ -1,9 +1,16 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime, timedelta
+import hashlib
 import random
 
 db = SQLAlchemy()
 
+
+def _new_base_seed():
+    return random.SystemRandom().randint(1, 2 ** 31 - 1)
+
+
 class VisitorCounterSettings(db.Model):
     """إعدادات عداد الزوار التي يتحكم فيها الأدمن"""
     __tablename__ = 'visitor_counter_settings'
@@ -11,40 +18,63 @@ class VisitorCounterSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     min_base_count = db.Column(db.Integer, default=1000, nullable=False)  # الحد الأدنى للرقم العشوائي
     max_base_count = db.Column(db.Integer, default=1500, nullable=False)  # الحد الأقصى للرقم العشوائي
-    current_base_count = db.Column(db.Integer, default=1450, nullable=False)  # الرقم العشوائي الحالي
-    last_update = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # آخر تحديث للرقم العشوائي
+    # نسخة للاطلاع فقط من الرقم عند آخر إعادة توليد؛ الخدمة لا تقرؤها، فالرقم الحالي يُحسب دائماً بـ compute_base_count
+    current_base_count = db.Column(db.Integer, default=1450, nullable=False)
+    base_seed = db.Column(db.Integer, default=_new_base_seed, nullable=False)  # بذرة الرقم الأساسي المشتركة بين العمال
+    last_update = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # آخر إعادة توليد للبذرة
     update_interval = db.Column(db.Integer, default=30, nullable=False)  # فترة التحديث بالثواني
     is_active = db.Column(db.Boolean, default=True, nullable=False)  # تفعيل/إلغاء تفعيل العداد
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    version = db.Column(db.Integer, default=1, nullable=False)  # يزداد مع كل تعديل لإبطال نسخ العمال المخزنة
+    
+    __mapper_args__ = {'version_id_col': version}
     
     def __repr__(self):
         return f'<VisitorCounterSettings {self.min_base_count}-{self.max_base_count}>'
     
-    def update_base_count(self):
-        """تحديث الرقم العشوائي الأساسي"""
+    @staticmethod
+    def base_count_for(seed, bucket, min_count, max_count):
+        """الرقم الأساسي كدالة بحتة في (البذرة، رقم الفترة الزمنية، النطاق)"""
         # التأكد من أن النطاق صحيح
-        min_count = min(self.min_base_count, self.max_base_count)
-        max_count = max(self.min_base_count, self.max_base_count)
-        self.current_base_count = random.randint(min_count, max_count)
+        low, high = min(min_count, max_count), max(min_count, max_count)
+        digest = hashlib.blake2b(f'{seed}:{bucket}'.encode(), digest_size=8).digest()
+        return low + int.from_bytes(digest, 'big') % (high - low + 1)
+    
+    def base_bucket(self, when=None):
+        """رقم الفترة الزمنية (update_interval) التي يقع فيها الوقت المحدد"""
+        when = when or datetime.utcnow()
+        seconds = (when - datetime(1970, 1, 1)).total_seconds()
+        return int(seconds // max(self.update_interval or 1, 1))
+    
+    def base_period_start(self, when=None):
+        """بداية الفترة الزمنية الحالية للرقم الأساسي (آخر تغير له دون تعديل الإعدادات)"""
+        return datetime(1970, 1, 1) + timedelta(seconds=self.base_bucket(when) * max(self.update_interval or 1, 1))
+    
+    def compute_base_count(self, when=None):
+        """الرقم الأساسي للفترة الزمنية الحالية؛ كل العمال يحصلون على القيمة نفسها دون أي كتابة"""
+        seed = self.base_seed if self.base_seed is not None else 0
+        return self.base_count_for(seed, self.base_bucket(when), self.min_base_count, self.max_base_count)
+    
+    def update_base_count(self):
+        """إعادة توليد البذرة للحصول على تسلسل أرقام جديد فوراً"""
+        old_count = self.compute_base_count()
+        for _ in range(8):
+            self.base_seed = _new_base_seed()
+            # إعادة التوليد يجب أن تغيّر الرقم الظاهر ما لم يكن النطاق قيمة واحدة
+            if self.compute_base_count() != old_count:
+                break
+        self.current_base_count = self.compute_base_count()
         self.last_update = datetime.utcnow()
         db.session.commit()
         return self.current_base_count
     
-    def should_update(self):
-        """فحص ما إذا كان يجب تحديث الرقم العشوائي"""
-        if not self.last_update:
-            return True
-        
-        time_diff = (datetime.utcnow() - self.last_update).total_seconds()
-        return time_diff >= self.update_interval
-    
     def to_dict(self):
         return {
             'id': self.id,
             'min_base_count': self.min_base_count,
             'max_base_count': self.max_base_count,
-            'current_base_count': self.current_base_count,
+            'current_base_count': self.compute_base_count(),
             'last_update': self.last_update.isoformat() if self.last_update else None,
             'update_interval': self.update_interval,
             'is_active': self.is_active,
@@ -55,6 +85,12 @@ class VisitorCounterSettings(db.Model):
 class VisitorSession(db.Model):
     """جلسات الزوار لحساب العدد الحقيقي"""
     __tablename__ = 'visitor_sessions'
+    __table_args__ = (
+        # عدّ الزوار النشطين وتنظيف الجلسات القديمة
+        db.Index('ix_visitor_sessions_active_last_activity', 'is_active', 'last_activity'),
+        # زوار ومشاهدات يوم معين (فهرس مغطٍّ لمجموع المشاهدات)
+        db.Index('ix_visitor_sessions_first_visit_page_views', 'first_visit', 'page_views'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(255), unique=True, nullable=False)  # معرف الجلسة الفريد
@@ -71,7 +107,8 @@ class VisitorSession(db.Model):
     def update_activity(self):
         """تحديث آخر نشاط وزيادة عدد المشاهدات"""
         self.last_activity = datetime.utcnow()
-        self.page_views += 1
+        # تعبير SQL بدلاً من قيمة محسوبة في بايثون حتى لا تضيع زيادات متزامنة
+        self.page_views = VisitorSession.page_views + 1
         db.session.commit()
     
     def to_dict(self):
@@ -100,6 +137,31 @@ class VisitorStats(db.Model):
     def __repr__(self):
         return f'<VisitorStats {self.date}: {self.unique_visitors} visitors>'
     
+    @classmethod
+    def record_activity(cls, day, new_visitors=0, page_views=0):
+        """إضافة زوار جدد ومشاهدات إلى إحصائيات يوم معين في عبارة واحدة (دون commit)"""
+        if not new_visitors and not page_views:
+            return
+        
+        now = datetime.utcnow()
+        statement = sqlite_insert(cls.__table__).values(
+            date=day,
+            unique_visitors=new_visitors,
+            total_page_views=page_views,
+            displayed_count=0,
+            created_at=now,
+            updated_at=now
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=['date'],
+            set_={
+                'unique_visitors': cls.__table__.c.unique_visitors + statement.excluded.unique_visitors,
+                'total_page_views': cls.__table__.c.total_page_views + statement.excluded.total_page_views,
+                'updated_at': statement.excluded.updated_at
+            }
+        )
+        db.session.execute(statement)
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -110,3 +172,225 @@ class VisitorStats(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
+
+class VisitorStatsSketch(db.Model):
+    """مخطط HyperLogLog يومي للزوار المميزين بجانب إحصائيات اليوم"""
+    __tablename__ = 'visitor_stats_sketches'
+    
+    date = db.Column(db.Date, primary_key=True)
+    sketch = db.Column(db.LargeBinary, nullable=False)  # سجلات المخطط (4 كيلوبايت)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<VisitorStatsSketch {self.date}>'
+    
+    @classmethod
+    def merge_sketch(cls, day, sketch):
+        """دمج مخطط في مخطط اليوم المخزن في عبارة واحدة (دون commit)"""
+        statement = sqlite_insert(cls.__table__).values(
+            date=day,
+            sketch=sketch,
+            updated_at=datetime.utcnow()
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=['date'],
+            set_={
+                'sketch': db.func.hll_merge(cls.__table__.c.sketch, statement.excluded.sketch),
+                'updated_at': statement.excluded.updated_at
+            }
+        )
+        db.session.execute(statement)
+
+class VisitorStatsHourly(db.Model):
+    """تجميع ساعي للزوار الجدد والمشاهدات حسب ساعة أول زيارة (تبنيه مهمة الضغط من الجلسات)"""
+    __tablename__ = 'visitor_stats_hourly'
+    
+    hour = db.Column(db.DateTime, primary_key=True)  # بداية الساعة بتوقيت UTC
+    unique_visitors = db.Column(db.Integer, default=0, nullable=False)
+    total_page_views = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<VisitorStatsHourly {self.hour}: {self.unique_visitors} visitors>'
+    
+    @classmethod
+    def record_activity(cls, hour, new_visitors=0, page_views=0):
+        """إضافة زوار جدد ومشاهدات إلى ساعة معينة في عبارة واحدة (دون commit)"""
+        if not new_visitors and not page_views:
+            return
+        
+        statement = sqlite_insert(cls.__table__).values(
+            hour=hour,
+            unique_visitors=new_visitors,
+            total_page_views=page_views,
+            updated_at=datetime.utcnow()
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=['hour'],
+            set_={
+                'unique_visitors': cls.__table__.c.unique_visitors + statement.excluded.unique_visitors,
+                'total_page_views': cls.__table__.c.total_page_views + statement.excluded.total_page_views,
+                'updated_at': statement.excluded.updated_at
+            }
+        )
+        db.session.execute(statement)
+    
+    def to_dict(self):
+        return {
+            'hour': self.hour.isoformat() if self.hour else None,
+            'unique_visitors': self.unique_visitors,
+            'total_page_views': self.total_page_views,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class VisitorStatsMonthly(db.Model):
+    """تجميع شهري للإحصائيات اليومية (تبنيه مهمة الضغط من visitor_stats)"""
+    __tablename__ = 'visitor_stats_monthly'
+    
+    month = db.Column(db.Date, primary_key=True)  # أول يوم في الشهر
+    unique_visitors = db.Column(db.Integer, default=0, nullable=False)
+    total_page_views = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<VisitorStatsMonthly {self.month}: {self.unique_visitors} visitors>'
+    
+    def to_dict(self):
+        return {
+            'month': self.month.strftime('%Y-%m') if self.month else None,
+            'unique_visitors': self.unique_visitors,
+            'total_page_views': self.total_page_views,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+class StatisticsSnapshot(db.Model):
+    """نتيجة /statistics محسوبة مسبقاً يعيد بناءها المجدول الدوري، فتُقرأ بصف واحد"""
+    __tablename__ = 'statistics_snapshot'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    data = db.Column(db.Text, nullable=False)  # الإحصائيات بصيغة JSON
+    generated_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<StatisticsSnapshot {self.name} {self.generated_at}>'
+    
+    @classmethod
+    def store(cls, name, data, generated_at):
+        """كتابة اللقطة أو استبدالها في عبارة واحدة (دون commit)"""
+        statement = sqlite_insert(cls.__table__).values(name=name, data=data, generated_at=generated_at)
+        statement = statement.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'data': statement.excluded.data, 'generated_at': statement.excluded.generated_at}
+        )
+        db.session.execute(statement)
+
+class BackfillCheckpoint(db.Model):
+    """موضع آخر دفعة ثُبتت من ملف سجل وصول، يُكتب في معاملة الدفعة نفسها لاستئناف الاستيراد"""
+    __tablename__ = 'backfill_checkpoints'
+    
+    source = db.Column(db.String(1024), primary_key=True)  # المسار المطلق لملف السجل
+    offset = db.Column(db.Integer, nullable=False, default=0)  # البايتات المقروءة (بعد فك الضغط)
+    lines = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<BackfillCheckpoint {self.source}: {self.lines}>'
+    
+    @classmethod
+    def store(cls, source, offset, lines):
+        """حفظ الموضع (دون commit) حتى يُثبت مع صفوف الدفعة في المعاملة نفسها"""
+        statement = sqlite_insert(cls.__table__).values(
+            source=source, offset=offset, lines=lines, updated_at=datetime.utcnow()
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=['source'],
+            set_={
+                'offset': statement.excluded.offset,
+                'lines': statement.excluded.lines,
+                'updated_at': statement.excluded.updated_at
+            }
+        )
+        db.session.execute(statement)
+
+class BackfillVisitor(db.Model):
+    """أول زيارة معروفة لكل زائر مستورد من سجلات الوصول، خارج الجلسات التي يحذفها التنظيف.
+
+    الاستيراد يعيد بناء أشهر قديمة يحذف التنظيف الدوري جلساتها (أقدم من SESSION_RETENTION_DAYS)،
+    فيُحفظ هنا معرف الزائر وأول زيارته حتى لا يُحتسب جديداً مرة أخرى في ملف لاحق.
+    """
+    __tablename__ = 'backfill_visitors'
+    
+    session_id = db.Column(db.String(64), primary_key=True)  # log_session_id(IP، المتصفح)
+    first_visit = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<BackfillVisitor {self.session_id}: {self.first_visit}>'
+    
+    @classmethod
+    def first_visits(cls, session_ids, chunk_size=500):
+        """أول زيارة محفوظة لكل معرف معروف من المعرفات المعطاة (استعلامات IN مقسمة لحد متغيرات SQLite)"""
+        session_ids = list(session_ids)
+        known = {}
+        for start in range(0, len(session_ids), chunk_size):
+            rows = db.session.execute(
+                db.select(cls.session_id, cls.first_visit).where(
+                    cls.session_id.in_(session_ids[start:start + chunk_size])
+                )
+            )
+            known.update(tuple(row) for row in rows)
+        return known
+    
+    @classmethod
+    def store(cls, visits):
+        """حفظ أول زيارة لكل زائر (دون commit) مع الإبقاء على الأقدم إن كان معروفاً"""
+        if not visits:
+            return
+        statement = sqlite_insert(cls.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=['session_id'],
+            set_={'first_visit': db.func.min(cls.__table__.c.first_visit, statement.excluded.first_visit)}
+        )
+        db.session.execute(statement, [
+            {'session_id': session_id, 'first_visit': visit['first_visit']}
+            for session_id, visit in visits.items()
+        ])
+
+class ScheduledJob(db.Model):
+    """آخر تشغيل لكل مهمة دورية حتى ينفذها عامل واحد فقط في كل فترة"""
+    __tablename__ = 'scheduled_jobs'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    last_run_at = db.Column(db.DateTime, nullable=False)
+    last_status = db.Column(db.String(255))  # نتيجة آخر تشغيل أو رسالة الخطأ
+    
+    def __repr__(self):
+        return f'<ScheduledJob {self.name}>'
+    
+    @classmethod
+    def claim(cls, name, interval_seconds, now=None):
+        """حجز تشغيل المهمة إذا انقضت فترتها منذ آخر تشغيل؛ عامل واحد فقط ينجح (مع commit)"""
+        now = now or datetime.utcnow()
+        table = cls.__table__
+        db.session.execute(
+            sqlite_insert(table).values(name=name, last_run_at=datetime(1970, 1, 1)).on_conflict_do_nothing()
+        )
+        claimed = db.session.execute(
+            table.update().where(
+                table.c.name == name,
+                table.c.last_run_at <= now - timedelta(seconds=interval_seconds)
+            ).values(last_run_at=now)
+        ).rowcount
+        db.session.commit()
+        return claimed == 1
+    
+    @classmethod
+    def record_status(cls, name, status):
+        cls.query.filter_by(name=name).update({'last_status': status[:255]})
+        db.session.commit()
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'last_run_at': self.last_run_at.isoformat() if self.last_run_at else None,
+            'last_status': self.last_status
+        }
@@ -1,6 +1,17 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, Response, current_app, request, jsonify, session
+from datetime import datetime
+import json
 from src.models.visitor_counter import db
 from src.services.visitor_service import VisitorCounterService
+from src.services.visitor_buffer import visitor_buffer
+from src.services.count_cache import displayed_count_cache
+from src.services.settings_cache import settings_cache
+from src.services.scheduler import scheduler
+from src.services.count_stream import count_broadcaster
+from src.services.counter_store import counter_store
+from src.services.http_cache import build_etag, cached_json, not_modified
+from src.services.rollups import ROLLUPS
+from src.services.export import EXPORT_FORMATS, EXPORT_TABLES, export_filename, iter_export
 import logging
 
 # إعداد السجلات
@@ -9,6 +20,12 @@ logger = logging.getLogger(__name__)
 
 visitor_counter_bp = Blueprint('visitor_counter', __name__)
 
+# منع التخزين المؤقت وتجميع الاستجابة في الوكلاء العكسيين حتى تصل الأحداث فوراً
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+
 @visitor_counter_bp.route('/count', methods=['GET'])
 def get_visitor_count():
     """الحصول على عدد الزوار المعروض"""
@@ -16,14 +33,14 @@ def get_visitor_count():
         # تتبع الزائر الحالي
         VisitorCounterService.track_visitor()
         
-        # الحصول على العدد المعروض
-        displayed_count = VisitorCounterService.get_displayed_visitor_count()
+        # الحصول على العدد المعروض من اللقطة المخزنة مؤقتاً
+        displayed_count = VisitorCounterService.get_cached_visitor_count()
         
-        return jsonify({
+        return cached_json({
             'success': True,
             'count': displayed_count,
             'message': 'تم الحصول على عدد الزوار بنجاح'
-        }), 200
+        }, build_etag('count', displayed_count), 'COUNT')
         
     except Exception as e:
         logger.error(f"خطأ في الحصول على عدد الزوار: {str(e)}")
@@ -33,6 +50,18 @@ def get_visitor_count():
             'details': str(e)
         }), 500
 
+@visitor_counter_bp.route('/stream', methods=['GET'])
+def stream_visitor_count():
+    """بث العدد المعروض عند تغيره فقط (Server-Sent Events) دون تتبع الزائر"""
+    # هنا يُخدم البث عبر WSGI (خيط طلب لكل اتصال)؛ وضع ASGI يخدمه في الحلقة قبل الوصول إلى Flask
+    if count_broadcaster.is_full(wsgi=True):
+        return jsonify({
+            'success': False,
+            'error': 'تم بلوغ الحد الأقصى لعدد المشتركين في البث'
+        }), 503
+    
+    return Response(count_broadcaster.events(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
 @visitor_counter_bp.route('/track', methods=['POST'])
 def track_visitor():
     """تتبع زائر جديد"""
@@ -53,17 +82,80 @@ def track_visitor():
             'details': str(e)
         }), 500
 
+@visitor_counter_bp.route('/track/batch', methods=['POST'])
+def track_visitor_batch():
+    """تتبع دفعة من الزيارات المرسلة من سجلات الحافة/CDN"""
+    try:
+        data = request.get_json(silent=True)
+        events = data.get('events') if isinstance(data, dict) else None
+        
+        if not isinstance(events, list) or not events:
+            return jsonify({
+                'success': False,
+                'error': 'يجب إرسال قائمة events غير فارغة'
+            }), 400
+        
+        max_events = current_app.config.get('VISITOR_BATCH_MAX_EVENTS', 10000)
+        if len(events) > max_events:
+            return jsonify({
+                'success': False,
+                'error': f'الحد الأقصى لحجم الدفعة هو {max_events} زيارة'
+            }), 413
+        
+        result = VisitorCounterService.track_visitor_batch(events)
+        
+        return jsonify({
+            'success': True,
+            **result,
+            'message': f"تم تتبع {result['accepted']} زيارة"
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"خطأ في تتبع دفعة الزيارات: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'حدث خطأ في تتبع دفعة الزيارات',
+            'details': str(e)
+        }), 500
+
+def _statistics_etag(stats):
+    """ETag من وقت توليد اللقطة وتقدير النطاق المخصص (المحسوب عند كل طلب)"""
+    return build_etag(
+        'statistics',
+        stats['generated_at'],
+        json.dumps(stats['unique_visitors'].get('range'), sort_keys=True)
+    )
+
 @visitor_counter_bp.route('/statistics', methods=['GET'])
 def get_statistics():
     """الحصول على إحصائيات شاملة للزوار"""
     try:
-        stats = VisitorCounterService.get_visitor_statistics()
+        # نطاق مخصص اختياري لتقدير الزوار المميزين (?from=YYYY-MM-DD&to=YYYY-MM-DD)
+        start_date = end_date = None
+        if request.args.get('from') or request.args.get('to'):
+            try:
+                start_date = datetime.strptime(request.args.get('from', ''), '%Y-%m-%d').date()
+                end_date = datetime.strptime(request.args.get('to', ''), '%Y-%m-%d').date()
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'error': 'يجب إرسال from و to بصيغة YYYY-MM-DD'
+                }), 400
+            
+            if start_date > end_date:
+                return jsonify({
+                    'success': False,
+                    'error': 'تاريخ البداية يجب أن يسبق تاريخ النهاية'
+                }), 400
         
-        return jsonify({
+        stats = VisitorCounterService.get_visitor_statistics(start_date, end_date)
+        
+        # الإحصائيات لقطة لا تتغير حتى يعيد المجدول بناءها، فوقت توليدها هو Last-Modified
+        return cached_json({
             'success': True,
             'data': stats,
             'message': 'تم الحصول على الإحصائيات بنجاح'
-        }), 200
+        }, _statistics_etag(stats), 'STATISTICS', datetime.fromisoformat(stats['generated_at']))
         
     except Exception as e:
         logger.error(f"خطأ في الحصول على الإحصائيات: {str(e)}")
@@ -73,17 +165,67 @@ def get_statistics():
             'details': str(e)
         }), 500
 
+@visitor_counter_bp.route('/statistics/range', methods=['GET'])
+def get_statistics_range():
+    """إحصائيات نطاق زمني بدقة ساعة أو يوم أو شهر من جداول التجميع"""
+    try:
+        granularity = request.args.get('granularity', 'day')
+        if granularity not in ROLLUPS:
+            return jsonify({
+                'success': False,
+                'error': 'granularity يجب أن تكون hour أو day أو month'
+            }), 400
+        
+        try:
+            start = VisitorCounterService.parse_event_timestamp(request.args.get('from'), None)
+            end = VisitorCounterService.parse_event_timestamp(request.args.get('to'), None)
+        except ValueError:
+            start = end = None
+        if start is None or end is None:
+            return jsonify({
+                'success': False,
+                'error': 'يجب إرسال from و to بصيغة ISO 8601 (YYYY-MM-DD أو YYYY-MM-DDTHH:MM)'
+            }), 400
+        
+        if start > end:
+            return jsonify({
+                'success': False,
+                'error': 'تاريخ البداية يجب أن يسبق تاريخ النهاية'
+            }), 400
+        
+        result = VisitorCounterService.get_statistics_range(start, end, granularity)
+        
+        return cached_json({
+            'success': True,
+            'data': result,
+            'message': 'تم الحصول على إحصائيات النطاق بنجاح'
+        }, build_etag('statistics-range', json.dumps(result, sort_keys=True)), 'STATISTICS')
+        
+    except Exception as e:
+        logger.error(f"خطأ في الحصول على إحصائيات النطاق: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'حدث خطأ في الحصول على إحصائيات النطاق',
+            'details': str(e)
+        }), 500
+
 @visitor_counter_bp.route('/admin/settings', methods=['GET'])
 def get_admin_settings():
     """الحصول على إعدادات العداد للأدمن"""
     try:
         settings = VisitorCounterService.get_or_create_settings()
         
-        return jsonify({
+        # عمود version يتغير مع كل تعديل والرقم الأساسي مع كل فترة، فيُرد بـ 304 دون بناء الجسم
+        etag = build_etag('settings', settings.id, settings.version, settings.base_bucket())
+        cached = not_modified(etag, 'SETTINGS')
+        if cached is not None:
+            return cached
+        
+        return cached_json({
             'success': True,
             'data': settings.to_dict(),
             'message': 'تم الحصول على الإعدادات بنجاح'
-        }), 200
+        }, etag, 'SETTINGS', max(settings.updated_at, settings.base_period_start()))
         
     except Exception as e:
         logger.error(f"خطأ في الحصول على الإعدادات: {str(e)}")
@@ -189,16 +331,37 @@ def toggle_counter():
             'details': str(e)
         }), 500
 
+@visitor_counter_bp.route('/admin/reseed', methods=['POST'])
+def reseed_base_count():
+    """إعادة توليد بذرة الرقم الأساسي"""
+    try:
+        settings = VisitorCounterService.reseed_base_count()
+        
+        return jsonify({
+            'success': True,
+            'data': settings.to_dict(),
+            'message': 'تم إعادة توليد الرقم الأساسي بنجاح'
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"خطأ في إعادة توليد الرقم الأساسي: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'حدث خطأ في إعادة توليد الرقم الأساسي',
+            'details': str(e)
+        }), 500
+
 @visitor_counter_bp.route('/admin/cleanup', methods=['POST'])
 def cleanup_old_sessions():
     """تنظيف الجلسات القديمة"""
     try:
-        cleaned_count = VisitorCounterService.cleanup_old_sessions()
+        result = VisitorCounterService.cleanup_sessions()
         
         return jsonify({
             'success': True,
-            'cleaned_sessions': cleaned_count,
-            'message': f'تم تنظيف {cleaned_count} جلسة قديمة'
+            'cleaned_sessions': result['deactivated'],
+            'deleted_sessions': result['deleted'],
+            'message': f"تم تنظيف {result['deactivated']} جلسة قديمة وحذف {result['deleted']} جلسة منتهية"
         }), 200
         
     except Exception as e:
@@ -209,6 +372,57 @@ def cleanup_old_sessions():
             'details': str(e)
         }), 500
 
+@visitor_counter_bp.route('/admin/export/<table>', methods=['GET'])
+def export_table(table):
+    """تصدير جلسات الزوار أو الإحصائيات اليومية كملف CSV أو NDJSON متدفق"""
+    try:
+        if table not in EXPORT_TABLES:
+            return jsonify({
+                'success': False,
+                'error': 'الجدول يجب أن يكون sessions أو stats'
+            }), 404
+
+        fmt = request.args.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({
+                'success': False,
+                'error': 'format يجب أن تكون csv أو ndjson'
+            }), 400
+
+        try:
+            start = VisitorCounterService.parse_event_timestamp(request.args.get('from'), None)
+            end = VisitorCounterService.parse_event_timestamp(request.args.get('to'), None)
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'from و to يجب أن تكون بصيغة ISO 8601 (YYYY-MM-DD أو YYYY-MM-DDTHH:MM)'
+            }), 400
+
+        compress = request.args.get('gzip', 'false').lower() in ('1', 'true', 'yes')
+        chunks = iter_export(
+            table, fmt, start, end, compress,
+            batch_size=current_app.config.get('EXPORT_BATCH_SIZE', 1000)
+        )
+
+        # بدون Content-Length يُرسل الملف أجزاءً بحجم دفعة الاستعلام مهما كان حجم الجدول
+        return Response(
+            chunks,
+            mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt],
+            headers={
+                'Content-Disposition': f'attachment; filename="{export_filename(table, fmt, compress)}"',
+                'Cache-Control': 'no-store',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+
+    except Exception as e:
+        logger.error(f"خطأ في تصدير البيانات: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'حدث خطأ في تصدير البيانات',
+            'details': str(e)
+        }), 500
+
 @visitor_counter_bp.route('/health', methods=['GET'])
 def health_check():
     """فحص صحة الخدمة"""
@@ -221,6 +435,12 @@ def health_check():
             'service': 'naebak-visitor-counter',
             'status': 'healthy',
             'counter_active': settings.is_active,
+            'pending_writes': visitor_buffer.pending_count(),
+            'count_cache': displayed_count_cache.stats(),
+            'settings_cache': settings_cache.stats(),
+            'scheduler': scheduler.stats(),
+            'count_stream': count_broadcaster.stats(),
+            'counter_store': counter_store.stats(),
             'message': 'الخدمة تعمل بشكل طبيعي'
         }), 200
         
@@ -0,0 +1,100 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from src.models.visitor_counter import db
+from src.models.partitions import session_partitions
+
+
+class ActiveVisitorWindow:
+    """نافذة منزلقة في الذاكرة مقسمة إلى دلاء زمنية تحفظ بصمات الجلسات النشطة"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.window_minutes = 30
+        self.bucket_seconds = 60
+        self._lock = threading.Lock()
+        self._buckets = []
+        self._bucket_ids = []
+        self.warmed = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """قراءة إعدادات النافذة من التطبيق"""
+        self.enabled = app.config.get('ACTIVE_WINDOW_ENABLED', False)
+        self.configure(
+            app.config.get('ACTIVE_WINDOW_MINUTES', 30),
+            app.config.get('ACTIVE_WINDOW_BUCKET_SECONDS', 60)
+        )
+        app.extensions['active_visitor_window'] = self
+
+    def configure(self, window_minutes=30, bucket_seconds=60):
+        """إعادة تهيئة الدلاء بطول النافذة وحجم الدلو المطلوبين"""
+        with self._lock:
+            self.window_minutes = window_minutes
+            self.bucket_seconds = bucket_seconds
+            # دلو إضافي لتغطية الجزء الأقدم من النافذة الذي يقع في منتصف دلو
+            num_buckets = max(1, (window_minutes * 60) // bucket_seconds) + 1
+            self._buckets = [set() for _ in range(num_buckets)]
+            self._bucket_ids = [None] * num_buckets
+            self.warmed = False
+
+    def _bucket_index(self, timestamp):
+        if isinstance(timestamp, datetime):
+            # الطوابع الزمنية في قاعدة البيانات بتوقيت UTC بدون منطقة زمنية
+            timestamp = (timestamp - datetime(1970, 1, 1)).total_seconds()
+        return int(timestamp // self.bucket_seconds)
+
+    def record(self, session_id, timestamp=None):
+        """تسجيل نشاط جلسة في دلو الوقت المناسب"""
+        index = self._bucket_index(timestamp if timestamp is not None else time.time())
+        fingerprint = hash(session_id)
+
+        with self._lock:
+            current = self._bucket_index(time.time())
+            if index <= current - len(self._buckets):
+                return  # النشاط أقدم من النافذة
+            slot = index % len(self._buckets)
+            if self._bucket_ids[slot] != index:
+                self._buckets[slot] = set()
+                self._bucket_ids[slot] = index
+            self._buckets[slot].add(fingerprint)
+
+    def count(self, minutes=None):
+        """عدد الجلسات المميزة النشطة خلال آخر N دقيقة (افتراضياً طول النافذة)"""
+        minutes = self.window_minutes if minutes is None else min(minutes, self.window_minutes)
+        span = max(1, (minutes * 60) // self.bucket_seconds) + 1
+
+        with self._lock:
+            current = self._bucket_index(time.time())
+            active = set()
+            for index in range(current - span + 1, current + 1):
+                slot = index % len(self._buckets)
+                if self._bucket_ids[slot] == index:
+                    active |= self._buckets[slot]
+            return len(active)
+
+    def warm(self):
+        """تعبئة النافذة من قاعدة البيانات باستعلام واحد محدود بطول النافذة"""
+        cutoff = datetime.utcnow() - timedelta(minutes=self.window_minutes)
+        recent = session_partitions.union(lambda sessions: select(
+            sessions.c.session_id, sessions.c.last_activity
+        ).where(
+            sessions.c.is_active == True,
+            sessions.c.last_activity >= cutoff
+        ))
+        rows = db.session.execute(select(recent)).all() if recent is not None else []
+
+        for session_id, last_activity in rows:
+            self.record(session_id, last_activity)
+        self.warmed = True
+
+        return len(rows)
+
+    def reset(self):
+        """تفريغ النافذة (تُعاد تعبئتها من قاعدة البيانات عند أول استخدام)"""
+        self.configure(self.window_minutes, self.bucket_seconds)
+
+
+active_visitor_window = ActiveVisitorWindow()
@@ -0,0 +1,54 @@
+import threading
+import time
+
+
+class DisplayedCountCache:
+    """لقطة في ذاكرة العامل للرقم الأساسي وعدد الزوار النشطين تُحدَّث مرة واحدة على الأكثر لكل فترة صلاحية"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (اللقطة، وقت التحديث) في إسناد واحد حتى يُقرأ الزوج متسقاً دون القفل
+        self._entry = (None, 0.0)
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def get(self, ttl, loader):
+        """إرجاع اللقطة الحالية أو تحديثها عبر loader إذا انتهت صلاحيتها"""
+        snapshot, refreshed_at = self._entry
+        if snapshot is not None and time.monotonic() - refreshed_at < ttl:
+            with self._lock:
+                self.hits += 1
+            return snapshot
+
+        with self._lock:
+            self.misses += 1
+            # خيط آخر ربما حدّث اللقطة أثناء انتظار القفل، فلا يُعاد تشغيل الاستعلامات
+            snapshot, refreshed_at = self._entry
+            if snapshot is not None and time.monotonic() - refreshed_at < ttl:
+                return snapshot
+
+            snapshot = loader()
+            self._entry = (snapshot, time.monotonic())
+            self.refreshes += 1
+            return snapshot
+
+    def invalidate(self):
+        """إلغاء اللقطة الحالية لإجبار التحديث في الطلب التالي"""
+        with self._lock:
+            self._entry = (None, 0.0)
+
+    def stats(self):
+        """عدادات الإصابة والإخفاق (ومنها المنتظرون على تحديث جارٍ) والتحديث الفعلي لضبط فترة الصلاحية"""
+        with self._lock:
+            snapshot, refreshed_at = self._entry
+            age = time.monotonic() - refreshed_at if snapshot is not None else None
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'snapshot_age': round(age, 3) if age is not None else None
+            }
+
+
+displayed_count_cache = DisplayedCountCache()
@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class CountBroadcaster:
+    """منتج واحد لكل عامل يقرأ العدد المعروض دورياً ويبثه لكل المشتركين عند تغيره فقط"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.interval = 2.0
+        self.keepalive = 15.0
+        self.max_subscribers = 1000
+        self.max_wsgi_subscribers = 2
+        self._condition = threading.Condition()
+        self._count = None
+        self._version = 0
+        self._subscribers = 0
+        self._wsgi_subscribers = 0
+        self._async_waiters = {}  # حلقة asyncio -> أحداث مشتركيها
+        self._thread = None
+        self.published = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """قراءة إعدادات البث من التطبيق"""
+        self.app = app
+        self.interval = app.config.get('COUNT_STREAM_INTERVAL', 2.0)
+        self.keepalive = app.config.get('COUNT_STREAM_KEEPALIVE', 15.0)
+        self.max_subscribers = app.config.get('COUNT_STREAM_MAX_SUBSCRIBERS', 1000)
+        self.max_wsgi_subscribers = app.config.get('COUNT_STREAM_MAX_WSGI_SUBSCRIBERS', 2)
+        app.extensions['count_broadcaster'] = self
+
+    def publish(self, count):
+        """نشر العدد لكل المشتركين إذا تغير، وإرجاع True عند النشر"""
+        with self._condition:
+            if count == self._count:
+                return False
+            self._count = count
+            self._version += 1
+            self.published += 1
+            self._condition.notify_all()
+            loops = list(self._async_waiters.items())
+        # إيقاظ مشتركي asyncio باستدعاء واحد لكل حلقة لا لكل مشترك
+        for loop, events in loops:
+            try:
+                loop.call_soon_threadsafe(self._wake, events)
+            except RuntimeError:
+                pass
+        return True
+
+    @staticmethod
+    def _wake(events):
+        for event in list(events):
+            event.set()
+
+    def poll_once(self):
+        """قراءة العدد المعروض الحالي (من لقطة الذاكرة) ونشره إذا تغير"""
+        from src.services.visitor_service import VisitorCounterService
+        with self.app.app_context():
+            return self.publish(VisitorCounterService.get_cached_visitor_count())
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._subscribers == 0:
+                    # يتوقف المنتج عند مغادرة آخر مشترك ويُعاد تشغيله مع المشترك التالي
+                    self._thread = None
+                    return
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.error(f"خطأ في قراءة العدد المعروض للبث: {str(e)}")
+            with self._condition:
+                self._condition.wait_for(lambda: self._subscribers == 0, timeout=self.interval)
+
+    def is_full(self, wsgi=False):
+        """بلوغ حد الاتصالات؛ wsgi=True يطبق أيضاً حد اتصالات WSGI التي يحجز كل منها خيط طلب"""
+        with self._condition:
+            if wsgi and self._wsgi_subscribers >= self.max_wsgi_subscribers:
+                return True
+            return self._subscribers >= self.max_subscribers
+
+    def _subscribe(self, wsgi=False):
+        with self._condition:
+            self._subscribers += 1
+            if wsgi:
+                self._wsgi_subscribers += 1
+            if self._thread is None and self.app is not None:
+                self._thread = threading.Thread(target=self._run, name='count-broadcaster', daemon=True)
+                self._thread.start()
+
+    def _unsubscribe(self, wsgi=False):
+        with self._condition:
+            self._subscribers -= 1
+            if wsgi:
+                self._wsgi_subscribers -= 1
+            self._condition.notify_all()
+
+    def _snapshot(self, seen_version):
+        with self._condition:
+            if self._version == seen_version or self._count is None:
+                return seen_version, None
+            return self._version, self._count
+
+    @staticmethod
+    def format_event(version, count):
+        return f"id: {version}\nevent: count\ndata: {json.dumps({'count': count})}\n\n".encode()
+
+    def events(self):
+        """مولد أحداث SSE لخادم WSGI (يشغل خيطاً واحداً لكل اتصال)"""
+        self._subscribe(wsgi=True)
+        try:
+            yield f'retry: {int(self.interval * 1000)}\n\n'.encode()
+            version = 0
+            while True:
+                version, count = self._snapshot(version)
+                if count is not None:
+                    yield self.format_event(version, count)
+                    continue
+                with self._condition:
+                    changed = self._condition.wait_for(
+                        lambda: self._version != version, timeout=self.keepalive
+                    )
+                if not changed:
+                    yield b': keepalive\n\n'
+        finally:
+            self._unsubscribe(wsgi=True)
+
+    async def async_events(self):
+        """مولد أحداث SSE غير متزامن لوضع ASGI (دون خيط لكل اتصال)"""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        with self._condition:
+            self._async_waiters.setdefault(loop, set()).add(event)
+        self._subscribe()
+        try:
+            yield f'retry: {int(self.interval * 1000)}\n\n'.encode()
+            version = 0
+            while True:
+                version, count = self._snapshot(version)
+                if count is not None:
+                    yield self.format_event(version, count)
+                    continue
+                try:
+                    await asyncio.wait_for(event.wait(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield b': keepalive\n\n'
+                event.clear()
+        finally:
+            with self._condition:
+                events = self._async_waiters.get(loop)
+                if events is not None:
+                    events.discard(event)
+                    if not events:
+                        del self._async_waiters[loop]
+            self._unsubscribe()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'subscribers': self._subscribers,
+                'wsgi_subscribers': self._wsgi_subscribers,
+                'published': self.published,
+                'count': self._count,
+                'producer_running': self._thread is not None
+            }
+
+
+count_broadcaster = CountBroadcaster()
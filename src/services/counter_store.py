@@ -0,0 +1,490 @@
+import socket
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from urllib.parse import unquote, urlparse
+from sqlalchemy import bindparam, select, text
+from src.models.visitor_counter import db, VisitorSession, VisitorStats
+from src.models.partitions import session_partitions
+
+EPOCH = datetime(1970, 1, 1)
+
+# نتيجة تسجيل زيارة: is_new تعني زائراً لم تعرفه الواجهة الخلفية ولا يحمل ملف تعريف زائر عائد
+VisitRecord = namedtuple('VisitRecord', ['id', 'is_new', 'first_visit', 'page_views'])
+
+
+def _to_seconds(when):
+    return (when - EPOCH).total_seconds()
+
+
+def _from_seconds(seconds):
+    return EPOCH + timedelta(seconds=float(seconds))
+
+
+class CounterBackend(ABC):
+    """واجهة تخزين العدادات الساخنة: تتبع الجلسات وعدّ الزوار النشطين والعدادات اليومية"""
+
+    name = None
+
+    def record_visit(self, session_id, first_visit, last_activity, page_views=1, returning=False,
+                     ip_address=None, user_agent=None):
+        """تسجيل مشاهدات جلسة وإضافتها إلى عدادات يوم أول زيارتها (دون commit في SQL)
+
+        first_visit هو وقت أول زيارة المعروف أو المقترح للجلسة الجديدة. returning=True يعني زائراً
+        عائداً بملف تعريف موقّع فلا يُحتسب جديداً حتى لو لم تعد الواجهة تحفظ جلسته، وFalse زائراً
+        جديداً، وNone معرفاً لا يُعرف إن كان جديداً (يُحكم عليه بوجود جلسته).
+        """
+        return self.record_visits([(session_id, first_visit, last_activity, page_views, returning)])[0]
+
+    @abstractmethod
+    def record_visits(self, visits):
+        """تسجيل قائمة زيارات (session_id، first_visit، last_activity، page_views، returning)"""
+
+    @abstractmethod
+    def active_count(self, minutes=30):
+        """عدد الجلسات التي نشطت خلال آخر N دقيقة"""
+
+    @abstractmethod
+    def daily_counts(self, day):
+        """الزوار الجدد والمشاهدات المحتسبة ليوم معين"""
+
+    @abstractmethod
+    def reset(self):
+        """حذف كل العدادات (للاختبارات)"""
+
+
+# عبارات ON CONFLICT المبنية بـ SQLAlchemy لا تدخل ذاكرة العبارات المترجمة وتُترجم مع كل طلب،
+# لذا تُكتب العبارة نصياً مرة واحدة لكل جدول (أسرع بنحو 3 مرات، انظر benchmarks/bench_track_upsert.py)
+_TRACK_SESSION_SQL = """
+    INSERT INTO {table}
+        (session_id, ip_address, user_agent, first_visit, last_activity, page_views, is_active)
+    VALUES (:session_id, :ip_address, :user_agent, :first_visit, :now, 1, 1)
+    ON CONFLICT (session_id) DO UPDATE SET
+        page_views = page_views + 1,
+        last_activity = excluded.last_activity,
+        is_active = 1
+    RETURNING id, session_id, ip_address, user_agent, first_visit, last_activity, page_views, is_active
+"""
+_track_statements = {}
+
+
+def _track_statement(table_name):
+    statement = _track_statements.get(table_name)
+    if statement is None:
+        statement = text(_TRACK_SESSION_SQL.format(table=table_name)).bindparams(
+            bindparam('now', type_=db.DateTime),
+            bindparam('first_visit', type_=db.DateTime)
+        ).columns(*VisitorSession.__table__.c)
+        _track_statements[table_name] = statement
+    return statement
+
+
+class SQLCounterBackend(CounterBackend):
+    """العدادات في جداول visitor_sessions وvisitor_stats نفسها (السلوك الافتراضي)"""
+
+    name = 'sql'
+
+    def record_visit(self, session_id, first_visit, last_activity, page_views=1, returning=False,
+                     ip_address=None, user_agent=None):
+        # عبارة upsert واحدة: إدراج الجلسة أو زيادة مشاهداتها ذرياً داخل قاعدة البيانات
+        table_name = VisitorSession.__tablename__
+        if session_partitions.enabled:
+            table_name = session_partitions.table_for_visit(
+                session_id, last_activity, first_seen=first_visit if returning else None, lookup=returning is None
+            ).name
+
+        row = db.session.execute(_track_statement(table_name), {
+            'session_id': session_id,
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'first_visit': first_visit,
+            'now': last_activity
+        }).one()
+
+        # الصف الجديد يحمل وقت أول الزيارة المرسل، والزائر العائد يُحتسب في يوم أول زيارة يعرفها ملف التعريف
+        is_new = not returning and row.first_visit == first_visit
+        if is_new:
+            VisitorStats.record_activity(row.first_visit.date(), new_visitors=1, page_views=1)
+        else:
+            VisitorStats.record_activity((first_visit if returning else row.first_visit).date(), page_views=1)
+
+        return VisitRecord(row.id, is_new, row.first_visit, row.page_views)
+
+    def record_visits(self, visits):
+        return [
+            self.record_visit(session_id, first_visit, last_activity, page_views, returning)
+            for session_id, first_visit, last_activity, page_views, returning in visits
+        ]
+
+    def active_count(self, minutes=30):
+        cutoff_time = datetime.utcnow() - timedelta(minutes=minutes)
+        # جلسة قديمة البداية قد تكون نشطة الآن، لذا يُسأل كل جدول عبر فهرس (is_active, last_activity)
+        active_sessions = session_partitions.union(lambda sessions: select(sessions.c.id).where(
+            sessions.c.is_active == True,
+            sessions.c.last_activity >= cutoff_time
+        ))
+        if active_sessions is None:
+            return 0
+
+        return db.session.execute(select(db.func.count()).select_from(active_sessions)).scalar()
+
+    def daily_counts(self, day):
+        day_start = datetime.combine(day, datetime.min.time())
+        day_end = day_start + timedelta(days=1)
+
+        day_sessions = session_partitions.union(lambda sessions: select(sessions.c.page_views).where(
+            sessions.c.first_visit >= day_start,
+            sessions.c.first_visit < day_end
+        ), day, day + timedelta(days=1))
+        if day_sessions is None:
+            return {'new_visitors': 0, 'page_views': 0}
+
+        new_visitors, page_views = db.session.execute(select(
+            db.func.count(),
+            db.func.coalesce(db.func.sum(day_sessions.c.page_views), 0)
+        ).select_from(day_sessions)).one()
+        return {'new_visitors': new_visitors, 'page_views': page_views}
+
+    def reset(self):
+        pass
+
+
+class MemoryCounterBackend(CounterBackend):
+    """عدادات في ذاكرة العملية (لعامل واحد أو للاختبارات)؛ تضيع عند إعادة التشغيل"""
+
+    name = 'memory'
+
+    def __init__(self, session_ttl=None):
+        self.session_ttl = session_ttl
+        self._lock = threading.Lock()
+        self._sessions = {}  # session_id -> [أول زيارة، آخر نشاط، المشاهدات]
+        # دقيقة آخر نشاط -> الجلسات التي نشطت فيها، فعدّ النشطين لا يلمس إلا دقائق النافذة
+        self._minutes = defaultdict(set)
+        self._daily = defaultdict(lambda: [0, 0])
+
+    @staticmethod
+    def _minute(when):
+        return int(_to_seconds(when) // 60)
+
+    def record_visits(self, visits):
+        records = []
+        with self._lock:
+            for session_id, first_visit, last_activity, page_views, returning in visits:
+                entry = self._sessions.get(session_id)
+                if entry is None:
+                    entry = self._sessions[session_id] = [first_visit, last_activity, page_views]
+                    is_new = not returning
+                else:
+                    entry[1] = max(entry[1], last_activity)
+                    entry[2] += page_views
+                    is_new = False
+                minute = self._minute(entry[1])
+                if minute not in self._minutes:
+                    self._expire()
+                self._minutes[minute].add(session_id)
+
+                day = self._daily[(first_visit if returning else entry[0]).date()]
+                day[0] += int(is_new)
+                day[1] += page_views
+                records.append(VisitRecord(None, is_new, entry[0], entry[2]))
+        return records
+
+    def _expire(self):
+        # يُستدعى مرة لكل دقيقة جديدة: حذف دقائق ما قبل فترة الاحتفاظ والجلسات التي لم تنشط بعدها
+        if not self.session_ttl:
+            return
+        cutoff = self._minute(datetime.utcnow() - self.session_ttl)
+        for minute in [minute for minute in self._minutes if minute < cutoff]:
+            for session_id in self._minutes.pop(minute):
+                entry = self._sessions.get(session_id)
+                if entry is not None and self._minute(entry[1]) < cutoff:
+                    del self._sessions[session_id]
+
+    def active_count(self, minutes=30):
+        cutoff = datetime.utcnow() - timedelta(minutes=minutes)
+        active = set()
+        with self._lock:
+            for minute in range(self._minute(cutoff), self._minute(datetime.utcnow()) + 1):
+                for session_id in self._minutes.get(minute, ()):
+                    if self._sessions[session_id][1] >= cutoff:
+                        active.add(session_id)
+        return len(active)
+
+    def daily_counts(self, day):
+        with self._lock:
+            new_visitors, page_views = self._daily.get(day, (0, 0))
+        return {'new_visitors': new_visitors, 'page_views': page_views}
+
+    def reset(self):
+        with self._lock:
+            self._sessions.clear()
+            self._minutes.clear()
+            self._daily.clear()
+
+
+class RespError(Exception):
+    """رد خطأ من خادم يتحدث بروتوكول Redis"""
+
+
+class RespConnection:
+    """اتصال بسيط ببروتوكول RESP2 يدعم إرسال عدة أوامر في رحلة واحدة (pipeline)"""
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, timeout=5.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._written = 0
+
+    @classmethod
+    def from_url(cls, url, timeout=5.0):
+        """redis://[:password@]host[:port][/db]"""
+        parsed = urlparse(url)
+        if parsed.scheme != 'redis':
+            raise ValueError(f'رابط Redis غير مدعوم: {url}')
+        return cls(
+            host=parsed.hostname or 'localhost',
+            port=parsed.port or 6379,
+            db=int(parsed.path.lstrip('/') or 0),
+            password=unquote(parsed.password) if parsed.password else None,
+            timeout=timeout
+        )
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile('rb')
+        setup = []
+        if self.password:
+            setup.append(('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        if setup:
+            self._send(setup)
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._reader = None
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def pipeline(self, commands):
+        """إرسال الأوامر دفعة واحدة وقراءة ردودها بالترتيب.
+
+        يُعاد الاتصال والإرسال مرة واحدة فقط إذا انقطع الاتصال قبل إرسال أي بايت من الأوامر:
+        ما وصل منها قد يكون نُفذ، وإعادة إرساله تكرر الزيادات (HINCRBY)، لذا يُرفع الخطأ عندها
+        ويُفتح اتصال جديد في الاستدعاء التالي.
+        """
+        for attempt in range(2):
+            self._written = 0
+            try:
+                if self._sock is None:
+                    self._connect()
+                    self._written = 0
+                return self._send(commands)
+            except (OSError, EOFError):
+                written = self._written
+                self.close()
+                if attempt or written:
+                    raise
+
+    def _send(self, commands):
+        payload = bytearray()
+        for command in commands:
+            payload += b'*%d\r\n' % len(command)
+            for arg in command:
+                if not isinstance(arg, bytes):
+                    arg = str(arg).encode()
+                payload += b'$%d\r\n%s\r\n' % (len(arg), arg)
+        view = memoryview(payload)
+        while self._written < len(payload):
+            self._written += self._sock.send(view[self._written:])
+
+        replies = [self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise EOFError('انقطع الاتصال بخادم Redis')
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+':
+            return body.decode()
+        if kind == b'-':
+            return RespError(body.decode())
+        if kind == b':':
+            return int(body)
+        if kind == b'$':
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode()
+        if kind == b'*':
+            length = int(body)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RespError(f'رد غير متوقع من خادم Redis: {line!r}')
+
+
+class RedisCounterBackend(CounterBackend):
+    """عدادات مشتركة بين العمال في خادم يتحدث بروتوكول Redis
+
+    المفاتيح (بعد البادئة): session:<id> جدول بوقت أول زيارة والمشاهدات بمهلة فترة الاحتفاظ، وactive مجموعة مرتبة
+    بوقت آخر نشاط، وdaily:<YYYY-MM-DD> جدول بعدد الزوار الجدد والمشاهدات.
+    """
+
+    name = 'redis'
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='naebak:visitor-counter:',
+                 session_ttl=None, active_retention=timedelta(hours=24), timeout=5.0):
+        self.url = url
+        self.prefix = prefix
+        self.session_ttl = session_ttl
+        self.active_retention = active_retention
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        # اتصال لكل خيط حتى لا تتداخل ردود الطلبات المتزامنة
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = RespConnection.from_url(self.url, self.timeout)
+        return connection
+
+    def record_visits(self, visits):
+        if not visits:
+            return []
+        active_key = self.prefix + 'active'
+        now = datetime.utcnow()
+
+        # الرحلة الأولى: حجز وقت أول زيارة للجلسات الجديدة وقراءته، وتحديث مجموعة النشاط
+        commands = []
+        for session_id, first_visit, last_activity, page_views, returning in visits:
+            key = f'{self.prefix}session:{session_id}'
+            commands.append(('HSETNX', key, 'first_visit', repr(_to_seconds(first_visit))))
+            commands.append(('HINCRBY', key, 'page_views', page_views))
+            commands.append(('HGET', key, 'first_visit'))
+            if self.session_ttl:
+                commands.append(('EXPIRE', key, int(self.session_ttl.total_seconds())))
+            commands.append(('ZADD', active_key, repr(_to_seconds(last_activity)), session_id))
+        commands.append(('ZREMRANGEBYSCORE', active_key, '-inf', f'({_to_seconds(now - self.active_retention)!r}'))
+        replies = iter(self.connection.pipeline(commands))
+
+        # الرحلة الثانية: العدادات اليومية حسب يوم أول زيارة
+        records = []
+        daily = defaultdict(lambda: [0, 0])
+        for session_id, first_visit, last_activity, page_views, returning in visits:
+            created = next(replies) == 1
+            total_page_views = next(replies)
+            stored_first_visit = _from_seconds(next(replies))
+            if self.session_ttl:
+                next(replies)
+            next(replies)
+            is_new = created and not returning
+            day = daily[(first_visit if returning else stored_first_visit).date()]
+            day[0] += int(is_new)
+            day[1] += page_views
+            records.append(VisitRecord(None, is_new, stored_first_visit, total_page_views))
+
+        commands = []
+        for day, (new_visitors, page_views) in daily.items():
+            key = f'{self.prefix}daily:{day.isoformat()}'
+            if new_visitors:
+                commands.append(('HINCRBY', key, 'new_visitors', new_visitors))
+            commands.append(('HINCRBY', key, 'page_views', page_views))
+            if self.session_ttl:
+                commands.append(('EXPIRE', key, int((self.session_ttl + timedelta(days=1)).total_seconds())))
+        self.connection.pipeline(commands)
+
+        return records
+
+    def active_count(self, minutes=30):
+        cutoff = datetime.utcnow() - timedelta(minutes=minutes)
+        return self.connection.execute('ZCOUNT', self.prefix + 'active', repr(_to_seconds(cutoff)), '+inf')
+
+    def daily_counts(self, day):
+        new_visitors, page_views = self.connection.execute(
+            'HMGET', f'{self.prefix}daily:{day.isoformat()}', 'new_visitors', 'page_views'
+        )
+        return {'new_visitors': int(new_visitors or 0), 'page_views': int(page_views or 0)}
+
+    def reset(self):
+        cursor = '0'
+        while True:
+            cursor, keys = self.connection.execute('SCAN', cursor, 'MATCH', self.prefix + '*', 'COUNT', 1000)
+            if keys:
+                self.connection.execute('DEL', *keys)
+            if cursor == '0':
+                return
+
+
+COUNTER_BACKENDS = ('sql', 'memory', 'redis')
+
+
+class CounterStore:
+    """الواجهة الخلفية للعدادات الساخنة المختارة بالإعداد COUNTER_BACKEND (التاريخ يبقى في SQL دائماً)"""
+
+    def __init__(self, app=None):
+        self.backend = SQLCounterBackend()
+        if app is not None:
+            self.init_app(app)
+
+    @property
+    def is_sql(self):
+        return isinstance(self.backend, SQLCounterBackend)
+
+    def init_app(self, app):
+        """اختيار الواجهة الخلفية من إعدادات التطبيق (sql أو memory أو redis)"""
+        name = app.config.get('COUNTER_BACKEND', 'sql')
+        retention_days = app.config.get('SESSION_RETENTION_DAYS', 30)
+        session_ttl = timedelta(days=retention_days) if retention_days > 0 else None
+
+        if name == 'sql':
+            self.backend = SQLCounterBackend()
+        elif name == 'memory':
+            self.backend = MemoryCounterBackend(session_ttl=session_ttl)
+        elif name == 'redis':
+            self.backend = RedisCounterBackend(
+                url=app.config.get('COUNTER_REDIS_URL', 'redis://localhost:6379/0'),
+                prefix=app.config.get('COUNTER_REDIS_PREFIX', 'naebak:visitor-counter:'),
+                session_ttl=session_ttl,
+                active_retention=timedelta(hours=app.config.get('SESSION_INACTIVE_HOURS', 24))
+            )
+        else:
+            raise ValueError(f'واجهة العدادات الخلفية غير معروفة: {name}')
+        app.extensions['counter_store'] = self
+
+    def record_visit(self, *args, **kwargs):
+        return self.backend.record_visit(*args, **kwargs)
+
+    def record_visits(self, visits):
+        return self.backend.record_visits(visits)
+
+    def active_count(self, minutes=30):
+        return self.backend.active_count(minutes)
+
+    def daily_counts(self, day):
+        return self.backend.daily_counts(day)
+
+    def stats(self):
+        return {'backend': self.backend.name}
+
+
+counter_store = CounterStore()
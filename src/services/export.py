@@ -0,0 +1,123 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime, timedelta
+from sqlalchemy import select
+from src.models.visitor_counter import db, VisitorStats
+from src.models.partitions import session_partitions
+
+# نوع المحتوى لكل صيغة تصدير
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+SESSION_COLUMNS = ('id', 'session_id', 'ip_address', 'user_agent', 'first_visit', 'last_activity', 'page_views', 'is_active')
+STATS_COLUMNS = ('id', 'date', 'unique_visitors', 'total_page_views', 'displayed_count', 'created_at', 'updated_at')
+
+# wbits=31 ينتج ترويسة gzip كاملة يفكها أي عميل (gunzip أو Content-Encoding)
+_GZIP_WBITS = 31
+
+
+def _session_statements(start, end):
+    """استعلام لكل جدول جلسات معني، مرشح على first_visit (العمود الأول في فهرس first_visit/page_views)"""
+    start_day = start.date() if start else None
+    end_day = end.date() + timedelta(days=1) if end else None
+    statements = []
+    for table in session_partitions.tables(start_day, end_day):
+        statement = select(*[table.c[name] for name in SESSION_COLUMNS])
+        if start is not None:
+            statement = statement.where(table.c.first_visit >= start)
+        if end is not None:
+            statement = statement.where(table.c.first_visit < end)
+        statements.append(statement.order_by(table.c.first_visit))
+    return statements
+
+
+def _stats_statements(start, end):
+    """الأيام التي تتقاطع مع [start, end) مرتبة عبر فهرس date الفريد"""
+    statement = select(*[VisitorStats.__table__.c[name] for name in STATS_COLUMNS])
+    if start is not None:
+        statement = statement.where(VisitorStats.date >= start.date())
+    if end is not None:
+        last_day = end.date() if end.time() == datetime.min.time() else end.date() + timedelta(days=1)
+        statement = statement.where(VisitorStats.date < last_day)
+    return [statement.order_by(VisitorStats.date)]
+
+
+EXPORT_TABLES = {
+    'sessions': (SESSION_COLUMNS, _session_statements),
+    'stats': (STATS_COLUMNS, _stats_statements),
+}
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _csv_chunks(columns, batches):
+    """كتابة كل دفعة صفوف في مخزن نصي واحد يُفرَّغ بعد كل جزء"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in batches:
+        for row in rows:
+            writer.writerow([_json_value(value) for value in row])
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson_chunks(columns, batches):
+    for rows in batches:
+        yield ''.join(
+            json.dumps(dict(zip(columns, map(_json_value, row))), ensure_ascii=False) + '\n'
+            for row in rows
+        ).encode('utf-8')
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, _GZIP_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def iter_export(table, fmt='csv', start=None, end=None, compress=False, batch_size=1000):
+    """مولّد أجزاء bytes لتصدير جدول بصيغة csv أو ndjson ضمن [start, end) دون تحميله في الذاكرة.
+
+    الاستعلامات تُبنى هنا (داخل سياق التطبيق) وتُنفذ على اتصال مخصص يبقى مفتوحاً حتى
+    ينتهي المولّد أو يُغلق، لذا يمكن استهلاك الأجزاء بعد انتهاء الطلب أو من خيط آخر.
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f'جدول تصدير غير معروف: {table}')
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'صيغة تصدير غير معروفة: {fmt}')
+
+    columns, build = EXPORT_TABLES[table]
+    statements = build(start, end)
+    engine = db.engine
+
+    def batches():
+        # yield_per: مؤشر من جهة الخادم يجلب batch_size صفاً في كل مرة بدل fetchall
+        with engine.connect() as connection:
+            connection = connection.execution_options(yield_per=batch_size)
+            for statement in statements:
+                for rows in connection.execute(statement).partitions():
+                    yield rows
+
+    formatter = _csv_chunks if fmt == 'csv' else _ndjson_chunks
+    chunks = formatter(columns, batches())
+    return _gzip_chunks(chunks) if compress else chunks
+
+
+def export_filename(table, fmt, compress=False, now=None):
+    now = now or datetime.utcnow()
+    return f"{table}-{now:%Y%m%d%H%M%S}.{fmt}{'.gz' if compress else ''}"
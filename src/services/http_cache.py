@@ -0,0 +1,33 @@
+import hashlib
+from flask import current_app, jsonify, request
+
+
+def build_etag(*parts):
+    """قيمة ETag قصيرة مشتقة من أجزاء حالة المورد (إصدار الإعدادات، العدد، ...)"""
+    return hashlib.blake2b('|'.join(str(part) for part in parts).encode(), digest_size=8).hexdigest()
+
+
+def cache_control_for(endpoint):
+    """قيمة Cache-Control المضبوطة لنقطة النهاية (COUNT أو STATISTICS أو SETTINGS)"""
+    return current_app.config.get(f'{endpoint}_CACHE_CONTROL', 'no-cache')
+
+
+def not_modified(etag, endpoint):
+    """استجابة 304 مبكرة قبل بناء الجسم إذا كان لدى العميل النسخة نفسها، وإلا None"""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = cache_control_for(endpoint)
+    return response
+
+
+def cached_json(payload, etag, endpoint, last_modified=None):
+    """استجابة JSON بترويسات ETag وLast-Modified وCache-Control تتحول إلى 304 عند تطابق شروط الطلب"""
+    response = jsonify(payload)
+    # ETag ضعيف لأن الشبكات الوسيطة قد تضغط الجسم دون أن يتغير معناه
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = cache_control_for(endpoint)
+    return response.make_conditional(request)
@@ -0,0 +1,238 @@
+import gzip
+import hashlib
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+from src.models.visitor_counter import db, BackfillCheckpoint, BackfillVisitor
+from src.services.visit_batch import write_visit_batch
+from src.services.visitor_service import VisitorCounterService
+
+# صيغة combined في nginx وصيغة gunicorn الافتراضية:
+# host ident user [time] "request" status size "referer" "user-agent"
+_COMBINED_LINE = re.compile(
+    r'(?P<ip>\S+) \S+ \S+ \[(?P<time>[^\]]+)\] '
+    r'"(?P<request>(?:[^"\\]|\\.)*)" (?P<status>\d{3}) \S+ '
+    r'"(?:[^"\\]|\\.)*" "(?P<agent>(?:[^"\\]|\\.)*)"'
+)
+_MONTHS = {name: index for index, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1
+)}
+
+# طلبات الملفات الثابتة ليست مشاهدات صفحات (الواجهة تستدعي track_visitor مرة لكل صفحة)
+STATIC_EXTENSIONS = (
+    '.css', '.js', '.map', '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.webp',
+    '.woff', '.woff2', '.ttf', '.eot', '.txt', '.xml', '.json'
+)
+
+
+def parse_log_time(value):
+    """تحويل '10/Oct/2000:13:55:36 -0700' إلى datetime بتوقيت UTC بدون منطقة (أسرع من strptime)"""
+    when = datetime(
+        int(value[7:11]), _MONTHS[value[3:6]], int(value[0:2]),
+        int(value[12:14]), int(value[15:17]), int(value[18:20])
+    )
+    zone = value[21:]
+    if zone:
+        offset = timedelta(hours=int(zone[1:3]), minutes=int(zone[3:5]))
+        when = when - offset if zone[0] == '+' else when + offset
+    return when
+
+
+def log_session_id(ip_address, user_agent):
+    """معرف ثابت للزائر من (IP، المتصفح) بشكل معرف ملف التعريف نفسه (32 حرفاً ست عشرياً)"""
+    return hashlib.blake2b(f'{ip_address}\0{user_agent}'.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def parse_log_line(line, path_pattern=None):
+    """تحليل سطر بصيغة combined وإرجاع (IP، المتصفح، الوقت) لمشاهدة صفحة، أو None للتجاهل"""
+    match = _COMBINED_LINE.match(line)
+    if match is None:
+        return None
+    status = int(match.group('status'))
+    if not (200 <= status < 300 or status == 304):
+        return None
+
+    parts = match.group('request').split(' ')
+    if len(parts) != 3 or parts[0] != 'GET':
+        return None
+    path = parts[1].split('?', 1)[0]
+    if path.lower().endswith(STATIC_EXTENSIONS):
+        return None
+    if path_pattern is not None and not re.search(path_pattern, path):
+        return None
+
+    try:
+        timestamp = parse_log_time(match.group('time'))
+    except (KeyError, ValueError):
+        return None
+    ip_address = match.group('ip')[:45]
+    return ip_address, match.group('agent'), timestamp
+
+
+def parse_log_chunk(lines, path_pattern=None):
+    """تحليل مجموعة أسطر في عملية من المجمع وإرجاع الزيارات مدمجة حسب الجلسة مع عدد المتجاهل.
+
+    الدمج هنا يقلل ما يُنقل بين العمليات إلى صف واحد لكل زائر في المجموعة.
+    """
+    visits = {}
+    skipped = 0
+    for raw in lines:
+        parsed = parse_log_line(raw.decode('utf-8', 'replace').rstrip('\r\n'), path_pattern)
+        if parsed is None:
+            skipped += 1
+            continue
+        ip_address, user_agent, timestamp = parsed
+        session_id = log_session_id(ip_address, user_agent)
+        entry = visits.get(session_id)
+        if entry is None:
+            visits[session_id] = {
+                'ip_address': ip_address,
+                'user_agent': user_agent,
+                'first_visit': timestamp,
+                'last_activity': timestamp,
+                'page_views': 1
+            }
+        else:
+            entry['first_visit'] = min(entry['first_visit'], timestamp)
+            entry['last_activity'] = max(entry['last_activity'], timestamp)
+            entry['page_views'] += 1
+    return visits, skipped
+
+
+def _merge_entries(pending, visits):
+    for session_id, visit in visits.items():
+        entry = pending.get(session_id)
+        if entry is None:
+            pending[session_id] = visit
+        else:
+            entry['first_visit'] = min(entry['first_visit'], visit['first_visit'])
+            entry['last_activity'] = max(entry['last_activity'], visit['last_activity'])
+            entry['page_views'] += visit['page_views']
+
+
+def open_log(path):
+    """فتح ملف سجل للقراءة الثنائية مع فك gzip تلقائياً حسب ترويسة الملف لا امتداده"""
+    with open(path, 'rb') as probe:
+        compressed = probe.read(2) == b'\x1f\x8b'
+    return gzip.open(path, 'rb') if compressed else open(path, 'rb')
+
+
+def _read_chunks(log_file, chunk_lines):
+    """قراءة الملف مجموعات من الأسطر الكاملة مع موضع نهاية كل مجموعة"""
+    offset = log_file.tell()
+    while True:
+        chunk = list(islice(log_file, chunk_lines))
+        if not chunk:
+            return
+        # سطر أخير بلا نهاية (ملف ما زال يُكتب) يُترك للتشغيل التالي
+        if not chunk[-1].endswith(b'\n'):
+            chunk.pop()
+            if not chunk:
+                return
+        offset += sum(len(line) for line in chunk)
+        yield chunk, offset
+        if len(chunk) < chunk_lines:
+            return
+
+
+def _parsed_chunks(chunks, workers, path_pattern):
+    """تحليل المجموعات بالترتيب، في مجمع عمليات عند workers > 1 مع حد لما يُنتظر في الذاكرة"""
+    if workers <= 1:
+        for chunk, offset in chunks:
+            yield parse_log_chunk(chunk, path_pattern), len(chunk), offset
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for chunk, offset in chunks:
+            in_flight.append((pool.submit(parse_log_chunk, chunk, path_pattern), len(chunk), offset))
+            if len(in_flight) >= workers * 2:
+                future, count, end = in_flight.popleft()
+                yield future.result(), count, end
+        while in_flight:
+            future, count, end = in_flight.popleft()
+            yield future.result(), count, end
+
+
+def import_access_log(path, batch_size=20000, chunk_lines=10000, workers=None, path_pattern=None,
+                      reset=False, progress=None):
+    """استيراد ملف سجل وصول إلى visitor_sessions وvisitor_stats واستئنافه من آخر دفعة ثُبتت.
+
+    كل دفعة (حتى batch_size زائر) تُكتب عبر write_visit_batch في معاملة واحدة مع موضعها في
+    backfill_checkpoints وتجميعاتها الساعية والشهرية، فانقطاع الاستيراد لا يكرر أو يفقد أي سطر
+    أو تجميع عند إعادة تشغيله.
+    """
+    source = os.path.abspath(path)
+    workers = workers or os.cpu_count() or 1
+    checkpoint = None if reset else db.session.get(BackfillCheckpoint, source)
+    offset = checkpoint.offset if checkpoint else 0
+    lines = checkpoint.lines if checkpoint else 0
+
+    result = {
+        'source': source,
+        'resumed_from': lines,
+        'lines': lines,
+        'skipped': 0,
+        'new_sessions': 0,
+        'updated_sessions': 0,
+        'lines_per_second': 0.0
+    }
+    started = time.monotonic()
+    read_lines = 0
+    pending = {}
+    written = False
+
+    def flush(end):
+        nonlocal offset, written
+        try:
+            BackfillCheckpoint.store(source, end, result['lines'])
+            if pending:
+                # الزوار المستوردون من قبل يُعرفون من backfill_visitors ولو حذف التنظيف جلساتهم
+                known = BackfillVisitor.first_visits(pending.keys())
+                BackfillVisitor.store(pending)
+                # التجميعات الساعية والشهرية تُبنى من الدفعة نفسها في معاملتها، لا من جلسات قد تُحذف لاحقاً
+                counts = write_visit_batch(pending, known, rollups=True)
+                result['new_sessions'] += counts['new_sessions']
+                result['updated_sessions'] += counts['updated_sessions']
+                written = True
+                pending.clear()
+            else:
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        offset = end
+        elapsed = time.monotonic() - started
+        result['lines_per_second'] = round(read_lines / elapsed, 1) if elapsed > 0 else 0.0
+        if progress is not None:
+            progress(dict(result))
+
+    with open_log(path) as log_file:
+        # ملف غير مضغوط أقصر من موضع الاستئناف يعني أنه استُبدل (تدوير السجلات) لا أنه اكتمل
+        if not isinstance(log_file, gzip.GzipFile) and offset > os.path.getsize(path):
+            raise ValueError(f'الملف {source} أقصر من موضع الاستئناف المحفوظ ({offset} بايت)')
+        log_file.seek(offset)
+        end = offset
+        for (visits, skipped), count, end in _parsed_chunks(
+            _read_chunks(log_file, chunk_lines), workers, path_pattern
+        ):
+            _merge_entries(pending, visits)
+            read_lines += count
+            result['lines'] += count
+            result['skipped'] += skipped
+            if len(pending) >= batch_size:
+                flush(end)
+        if pending or end != offset:
+            flush(end)
+
+    if written:
+        VisitorCounterService.invalidate_statistics_snapshot()
+        db.session.commit()
+
+    elapsed = time.monotonic() - started
+    result['lines_per_second'] = round(read_lines / elapsed, 1) if elapsed > 0 else 0.0
+    return result
@@ -0,0 +1,172 @@
+import logging
+import os
+import re
+import time
+from flask import current_app, g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# عند ضبط PROMETHEUS_MULTIPROC_DIR (قبل استيراد prometheus_client) يكتب كل عامل قيمه في ملفات
+# مشتركة ويجمعها /metrics من كل العمال، وإلا تُعرض قيم العملية الحالية فقط
+_WRITE_STATEMENT = re.compile(r'^\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+_LOCK_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+REQUEST_LATENCY = Histogram(
+    'visitor_counter_request_duration_seconds',
+    'زمن معالجة الطلب لكل مسار',
+    ['method', 'route', 'status']
+)
+REQUEST_QUERIES = Histogram(
+    'visitor_counter_request_db_queries',
+    'عدد استعلامات قاعدة البيانات في الطلب الواحد',
+    ['route'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+)
+REQUEST_DB_TIME = Histogram(
+    'visitor_counter_request_db_seconds',
+    'مجموع زمن استعلامات قاعدة البيانات في الطلب الواحد',
+    ['route'],
+    buckets=_LOCK_BUCKETS
+)
+DB_QUERIES = Counter('visitor_counter_db_queries', 'إجمالي استعلامات قاعدة البيانات المنفذة')
+DB_QUERY_TIME = Counter('visitor_counter_db_query_seconds', 'إجمالي زمن استعلامات قاعدة البيانات')
+DB_COMMITS = Counter('visitor_counter_db_commits', 'إجمالي المعاملات المثبتة')
+SQLITE_LOCK_WAIT = Histogram(
+    'visitor_counter_sqlite_write_lock_wait_seconds',
+    'زمن أول عبارة كتابة في المعاملة (انتظار قفل الكتابة مع تنفيذ العبارة نفسها)',
+    buckets=_LOCK_BUCKETS
+)
+SQLITE_BUSY = Counter('visitor_counter_sqlite_busy_errors', 'أخطاء database is locked بعد انتهاء busy_timeout')
+ACTIVE_VISITORS = Gauge(
+    'visitor_counter_active_visitors',
+    'عدد الزوار النشطين عند آخر قراءة',
+    multiprocess_mode='mostrecent'
+)
+
+
+class ServiceMetrics:
+    """قياسات Prometheus للطلبات واستعلامات قاعدة البيانات، مع تجميع العمال عبر ملفات مشتركة"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, engine=None):
+        """تسجيل خطافات الطلبات وأحداث المحرك، ونقطة النهاية /metrics عند تفعيل القياسات.
+
+        عدّ استعلامات كل طلب (ترويسة X-DB-Queries وتحذير QUERY_LOG_THRESHOLD) يعمل دائماً،
+        وMETRICS_ENABLED يتحكم في قياسات Prometheus فقط.
+        """
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        app.extensions['metrics'] = self
+
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        if engine is not None:
+            self.instrument_engine(engine)
+        if self.enabled:
+            app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def instrument_engine(self, engine):
+        """عدّ الاستعلامات وزمنها لكل طلب، ومع القياسات المعاملات المثبتة وانتظار قفل الكتابة لكل اتصال"""
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+        if self.enabled:
+            event.listen(engine, 'commit', self._end_transaction)
+            event.listen(engine, 'rollback', self._end_transaction)
+            event.listen(engine, 'commit', self._count_commit)
+
+    @staticmethod
+    def _start_request():
+        g.request_started = time.perf_counter()
+        g.db_queries = 0
+        g.db_time = 0.0
+
+    @staticmethod
+    def _route():
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    def _finish_request(self, response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        route = self._route()
+        queries, db_time = g.get('db_queries', 0), g.get('db_time', 0.0)
+        if self.enabled:
+            REQUEST_LATENCY.labels(request.method, route, str(response.status_code)).observe(
+                time.perf_counter() - started
+            )
+            REQUEST_QUERIES.labels(route).observe(queries)
+            REQUEST_DB_TIME.labels(route).observe(db_time)
+
+        config = current_app.config
+        if config.get('QUERY_COUNT_HEADER', False):
+            response.headers['X-DB-Queries'] = str(queries)
+            response.headers['X-DB-Time-Ms'] = f'{db_time * 1000:.2f}'
+        threshold = config.get('QUERY_LOG_THRESHOLD', 0)
+        if threshold and queries > threshold:
+            logger.warning(f"{request.method} {route}: {queries} استعلاماً في {db_time * 1000:.1f}ms (الحد {threshold})")
+        else:
+            logger.debug(f"{request.method} {route}: {queries} استعلاماً في {db_time * 1000:.1f}ms")
+        return response
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started'].pop()
+        if has_request_context() and 'db_queries' in g:
+            g.db_queries += 1
+            g.db_time += elapsed
+        if not self.enabled:
+            return
+
+        DB_QUERIES.inc()
+        DB_QUERY_TIME.inc(elapsed)
+
+        # في SQLite يُطلب قفل الكتابة مع أول عبارة كتابة في المعاملة، وفيها ينتظر busy_timeout
+        if not conn.info.get('write_lock_held') and _WRITE_STATEMENT.match(statement):
+            conn.info['write_lock_held'] = True
+            SQLITE_LOCK_WAIT.observe(elapsed)
+
+    @staticmethod
+    def _end_transaction(conn):
+        conn.info.pop('write_lock_held', None)
+
+    @staticmethod
+    def _count_commit(conn):
+        DB_COMMITS.inc()
+
+    def _handle_error(self, context):
+        if context.connection is not None:
+            # العبارة الفاشلة لا تصل إلى after_cursor_execute
+            started = context.connection.info.get('query_started')
+            if started:
+                started.pop()
+        if self.enabled and 'database is locked' in str(context.original_exception):
+            SQLITE_BUSY.inc()
+
+    @staticmethod
+    def registry():
+        """سجل القياسات: تجميع ملفات كل العمال في الوضع متعدد العمليات، وإلا سجل العملية"""
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            return registry
+        return REGISTRY
+
+    def metrics_view(self):
+        """نقطة النهاية /metrics بصيغة نص Prometheus"""
+        from src.services.visitor_service import VisitorCounterService
+        ACTIVE_VISITORS.set(VisitorCounterService.get_active_visitors_count())
+        return generate_latest(self.registry()), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+
+service_metrics = ServiceMetrics()
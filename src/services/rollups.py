@@ -0,0 +1,133 @@
+from datetime import date, datetime, timedelta
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from src.models.visitor_counter import db, VisitorStats, VisitorStatsHourly, VisitorStatsMonthly
+from src.models.partitions import session_partitions
+
+# كل دقة تُجاب من جدول تجميع واحد: سنة كاملة تكلف 12 صفاً شهرياً أو 365 يومياً أو 8784 ساعياً
+ROLLUPS = {
+    'hour': (VisitorStatsHourly, VisitorStatsHourly.hour),
+    'day': (VisitorStats, VisitorStats.date),
+    'month': (VisitorStatsMonthly, VisitorStatsMonthly.month),
+}
+
+
+def floor_hour(when):
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def _next_month(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def period_start(when, granularity):
+    """بداية الفترة (ساعة أو يوم أو شهر) التي يقع فيها الوقت"""
+    if granularity == 'hour':
+        return floor_hour(when if isinstance(when, datetime) else datetime.combine(when, datetime.min.time()))
+    day = when.date() if isinstance(when, datetime) else when
+    return month_start(day) if granularity == 'month' else day
+
+
+def compact_hourly(start, end):
+    """إعادة بناء صفوف الساعات في [start, end) من الجلسات الخام حسب ساعة أول زيارة (دون commit)"""
+    start, end = floor_hour(start), floor_hour(end - timedelta(microseconds=1)) + timedelta(hours=1)
+    sessions = session_partitions.union(lambda table: select(table.c.first_visit, table.c.page_views).where(
+        table.c.first_visit >= start,
+        table.c.first_visit < end
+    ), start.date(), end.date() + timedelta(days=1))
+
+    rows = []
+    if sessions is not None:
+        hour = func.strftime('%Y-%m-%d %H:00:00', sessions.c.first_visit).label('hour')
+        rows = db.session.execute(
+            select(hour, func.count(), func.sum(sessions.c.page_views)).group_by(hour)
+        ).all()
+
+    # الاستبدال الكامل للنطاق يجعل المهمة متكررة النتيجة ويحذف ساعات لم تعد لها جلسات
+    table = VisitorStatsHourly.__table__
+    db.session.execute(table.delete().where(table.c.hour >= start, table.c.hour < end))
+    now = datetime.utcnow()
+    if rows:
+        db.session.execute(sqlite_insert(table), [
+            {
+                'hour': datetime.strptime(hour_text, '%Y-%m-%d %H:%M:%S'),
+                'unique_visitors': unique_visitors,
+                'total_page_views': total_page_views,
+                'updated_at': now
+            }
+            for hour_text, unique_visitors, total_page_views in rows
+        ])
+    return len(rows)
+
+
+def compact_monthly(start_day, end_day):
+    """إعادة بناء صفوف الأشهر التي يلمسها [start_day, end_day] من الإحصائيات اليومية (دون commit)"""
+    first_month, end_month = month_start(start_day), _next_month(end_day)
+    month = func.strftime('%Y-%m-01', VisitorStats.date).label('month')
+    rows = db.session.execute(
+        select(month, func.sum(VisitorStats.unique_visitors), func.sum(VisitorStats.total_page_views))
+        .where(VisitorStats.date >= first_month, VisitorStats.date < end_month)
+        .group_by(month)
+    ).all()
+
+    if not rows:
+        return 0
+    statement = sqlite_insert(VisitorStatsMonthly.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['month'],
+        set_={
+            'unique_visitors': statement.excluded.unique_visitors,
+            'total_page_views': statement.excluded.total_page_views,
+            'updated_at': statement.excluded.updated_at
+        }
+    )
+    now = datetime.utcnow()
+    db.session.execute(statement, [
+        {
+            'month': datetime.strptime(month_text, '%Y-%m-%d').date(),
+            'unique_visitors': unique_visitors,
+            'total_page_views': total_page_views,
+            'updated_at': now
+        }
+        for month_text, unique_visitors, total_page_views in rows
+    ])
+    return len(rows)
+
+
+def _format_period(value, granularity):
+    if granularity == 'month':
+        return value.strftime('%Y-%m')
+    return value.isoformat()
+
+
+def query_range(start, end, granularity):
+    """صفوف جدول التجميع للفترات من start إلى end (شاملة الطرفين) ومجاميعها"""
+    model, column = ROLLUPS[granularity]
+    rows = db.session.execute(
+        select(column, model.unique_visitors, model.total_page_views)
+        .where(column >= period_start(start, granularity), column <= period_start(end, granularity))
+        .order_by(column)
+    ).all()
+
+    points = [
+        {
+            'period': _format_period(period, granularity),
+            'unique_visitors': unique_visitors,
+            'total_page_views': total_page_views
+        }
+        for period, unique_visitors, total_page_views in rows
+    ]
+    return {
+        'granularity': granularity,
+        'from': _format_period(period_start(start, granularity), granularity),
+        'to': _format_period(period_start(end, granularity), granularity),
+        'points': points,
+        'totals': {
+            'unique_visitors': sum(point['unique_visitors'] for point in points),
+            'total_page_views': sum(point['total_page_views'] for point in points)
+        }
+    }
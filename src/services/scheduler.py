@@ -0,0 +1,94 @@
+import atexit
+import logging
+import threading
+import time
+from src.models.visitor_counter import db, ScheduledJob
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicScheduler:
+    """مجدول مهام دورية داخل العامل؛ جدول scheduled_jobs يضمن تنفيذ كل مهمة مرة واحدة لكل فترة بين كل العمال"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.tick_seconds = 5.0
+        self._jobs = {}  # name -> (الفترة بالثواني، الدالة)
+        self._stopped = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def add_job(self, name, interval_seconds, func):
+        """تسجيل مهمة دورية تُستدعى داخل سياق التطبيق"""
+        self._jobs[name] = (interval_seconds, func)
+
+    def init_app(self, app):
+        """ربط المجدول بالتطبيق وتشغيل خيطه إذا كان مفعلاً"""
+        self.app = app
+        self.enabled = app.config.get('SCHEDULER_ENABLED', False)
+        self.tick_seconds = app.config.get('SCHEDULER_TICK_SECONDS', 5.0)
+        app.extensions['scheduler'] = self
+
+        if self.enabled:
+            self.start()
+
+    def start(self):
+        """تشغيل خيط المجدول وتسجيل إيقافه عند إيقاف العامل"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='periodic-scheduler', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def shutdown(self):
+        """إيقاف خيط المجدول"""
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.tick_seconds + 5)
+        self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.tick_seconds):
+            self.run_pending()
+
+    def run_pending(self):
+        """تنفيذ المهام التي حان وقتها وحجزها هذا العامل، وإرجاع أسمائها"""
+        executed = []
+        for name, (interval_seconds, func) in list(self._jobs.items()):
+            with self.app.app_context():
+                try:
+                    if not ScheduledJob.claim(name, interval_seconds):
+                        continue
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"خطأ في حجز المهمة الدورية {name}: {str(e)}")
+                    continue
+
+                started = time.monotonic()
+                try:
+                    result = func()
+                    status = f'ok {result} ({time.monotonic() - started:.2f}s)'
+                except Exception as e:
+                    db.session.rollback()
+                    status = f'error: {str(e)}'
+                    logger.error(f"خطأ في تنفيذ المهمة الدورية {name}: {str(e)}")
+
+                try:
+                    ScheduledJob.record_status(name, status)
+                except Exception:
+                    db.session.rollback()
+                executed.append(name)
+        return executed
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'jobs': sorted(self._jobs)
+        }
+
+
+scheduler = PeriodicScheduler()
@@ -0,0 +1,76 @@
+import threading
+from flask import g
+from sqlalchemy import select
+from sqlalchemy.orm import make_transient_to_detached
+from src.models.visitor_counter import db, VisitorCounterSettings
+
+
+class SettingsCache:
+    """نسخة من صف الإعدادات في ذاكرة العامل يُتحقق من صلاحيتها بقراءة عمود version فقط"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = None
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self):
+        """إرجاع الإعدادات مرتبطة بجلسة قاعدة البيانات الحالية أو None إذا لم يوجد صف"""
+        # داخل الطلب الواحد يُعاد الكائن نفسه دون أي استعلام
+        settings = g.get('visitor_counter_settings')
+        if settings is not None and settings in db.session:
+            return settings
+
+        version = db.session.execute(
+            select(VisitorCounterSettings.version).order_by(VisitorCounterSettings.id).limit(1)
+        ).scalar()
+        if version is None:
+            return None
+
+        with self._lock:
+            values = self._values if self._version == version else None
+            if values is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if values is None:
+            settings = VisitorCounterSettings.query.order_by(VisitorCounterSettings.id).first()
+            self.store(settings)
+        else:
+            # كائن منفصل بالقيم المخزنة يُدمج في الجلسة دون تحميله من قاعدة البيانات
+            cached = VisitorCounterSettings(**values)
+            make_transient_to_detached(cached)
+            settings = db.session.merge(cached, load=False)
+
+        g.visitor_counter_settings = settings
+        return settings
+
+    def store(self, settings):
+        """تخزين نسخة من قيم الإعدادات بعد تحميلها أو كتابتها"""
+        values = {
+            attribute.key: getattr(settings, attribute.key)
+            for attribute in db.inspect(VisitorCounterSettings).column_attrs
+        }
+        with self._lock:
+            self._values = values
+            self._version = values['version']
+
+    def invalidate(self):
+        """إسقاط النسخة المخزنة (تُحمَّل من قاعدة البيانات عند الطلب التالي)"""
+        with self._lock:
+            self._values = None
+            self._version = None
+        g.pop('visitor_counter_settings', None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'version': self._version
+            }
+
+
+settings_cache = SettingsCache()
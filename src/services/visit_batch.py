@@ -0,0 +1,185 @@
+from collections import defaultdict
+from sqlalchemy import bindparam, delete, func, literal, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from src.models.visitor_counter import db, VisitorSession, VisitorStats, VisitorStatsHourly, VisitorStatsSketch
+from src.models.partitions import session_partitions
+from src.services.hyperloglog import HyperLogLog
+from src.services.rollups import compact_monthly, floor_hour
+
+
+def _update_statement(sessions):
+    # الزيادة تُحسب داخل قاعدة البيانات حتى لا تضيع زيادات عامل آخر كتب الجلسة نفسها
+    return update(sessions).where(
+        sessions.c.id == bindparam('b_id')
+    ).values(
+        page_views=sessions.c.page_views + bindparam('b_page_views'),
+        first_visit=func.min(sessions.c.first_visit, bindparam('b_first_visit')),
+        last_activity=func.max(sessions.c.last_activity, bindparam('b_last_activity')),
+        is_active=True
+    )
+
+
+def _insert_statement(sessions):
+    # جلسة أدرجها عامل آخر بعد البحث تُدمج بدلاً من فشل الدفعة كاملة
+    statement = sqlite_insert(sessions)
+    return statement.on_conflict_do_update(
+        index_elements=[sessions.c.session_id],
+        set_={
+            'page_views': sessions.c.page_views + statement.excluded.page_views,
+            'first_visit': func.min(sessions.c.first_visit, statement.excluded.first_visit),
+            'last_activity': func.max(sessions.c.last_activity, statement.excluded.last_activity),
+            'is_active': True
+        }
+    )
+
+
+# حد المتغيرات في عبارة SQLite واحدة يفرض تقسيم استعلامات IN
+LOOKUP_CHUNK_SIZE = 500
+
+
+def merge_visit(pending, session_id, ip_address, user_agent, timestamp):
+    """دمج زيارة واحدة في قاموس الزيارات المجمعة حسب معرف الجلسة"""
+    entry = pending.get(session_id)
+    if entry is None:
+        pending[session_id] = {
+            'ip_address': ip_address,
+            'user_agent': user_agent,
+            'first_visit': timestamp,
+            'last_activity': timestamp,
+            'page_views': 1
+        }
+    else:
+        entry['first_visit'] = min(entry['first_visit'], timestamp)
+        entry['last_activity'] = max(entry['last_activity'], timestamp)
+        entry['page_views'] += 1
+
+
+def write_visit_batch(pending, known_first_visits=None, rollups=False):
+    """كتابة الزيارات المجمعة في معاملة واحدة بإدراج وتحديث جماعيين وإرجاع عدد الجلسات الجديدة والمحدثة.
+
+    known_first_visits (session_id -> أول زيارة) لزوار احتُسبوا من قبل وربما حذف التنظيف جلساتهم:
+    من لا جلسة له منهم يُعاد إدراجه بأول زيارته المعروفة ولا يُحتسب جديداً.
+    rollups=True يضيف زيادات الدفعة إلى التجميعات الساعية ويعيد بناء أشهرها في المعاملة نفسها
+    (للتاريخ المستورد الذي لا تغطيه مهمة الضغط الدورية وقد تُحذف جلساته قبل أن تُضغط).
+    """
+    pending = dict(pending)
+    known_first_visits = known_first_visits or {}
+    try:
+        session_ids = list(pending.keys())
+        existing = []
+        for start in range(0, len(session_ids), LOOKUP_CHUNK_SIZE):
+            chunk = session_ids[start:start + LOOKUP_CHUNK_SIZE]
+            found = session_partitions.union(lambda sessions: select(
+                literal(sessions.name).label('table_name'),
+                sessions.c.id,
+                sessions.c.session_id,
+                sessions.c.first_visit,
+                sessions.c.last_activity,
+                sessions.c.page_views
+            ).where(sessions.c.session_id.in_(chunk)))
+            if found is not None:
+                existing.extend(db.session.execute(select(found)).all())
+
+        # الزيادات حسب ساعة أول زيارة ومخططات الزوار المميزين لكل يوم نشاط
+        activity = defaultdict(lambda: [0, 0])
+        sketches = defaultdict(HyperLogLog)
+        for session_id, entry in pending.items():
+            sketches[entry['first_visit'].date()].add(session_id)
+            sketches[entry['last_activity'].date()].add(session_id)
+
+        tables = {}
+        updates = defaultdict(list)
+        moves = defaultdict(list)
+        inserts = defaultdict(list)
+        for row in existing:
+            entry = pending.pop(row.session_id, None)
+            if entry is None:
+                continue
+            tables.setdefault(row.table_name, session_partitions.table_named(row.table_name))
+            first_visit = min(row.first_visit, entry['first_visit'])
+            if first_visit < row.first_visit:
+                # زيارة أقدم وصلت متأخرة: الزائر ومشاهداته السابقة ينتقلون إلى يوم أول زيارته الجديد
+                previous_hour = activity[floor_hour(row.first_visit)]
+                previous_hour[0] -= 1
+                previous_hour[1] -= row.page_views
+                hour = activity[floor_hour(first_visit)]
+                hour[0] += 1
+                hour[1] += row.page_views
+            activity[floor_hour(first_visit)][1] += entry['page_views']
+
+            if (session_partitions.enabled
+                    and session_partitions.partition_key(first_visit) != session_partitions.partition_key(row.first_visit)):
+                # الجلسة تُنقل إلى جدول فترة أول زيارتها حتى تجدها استعلامات النطاق
+                sessions = session_partitions.ensure_table(first_visit)
+                tables[sessions.name] = sessions
+                moves[row.table_name].append(row.id)
+                inserts[sessions.name].append(dict(
+                    entry,
+                    session_id=row.session_id,
+                    first_visit=first_visit,
+                    last_activity=max(row.last_activity, entry['last_activity']),
+                    page_views=row.page_views + entry['page_views'],
+                    is_active=True
+                ))
+                continue
+
+            updates[row.table_name].append({
+                'b_id': row.id,
+                'b_page_views': entry['page_views'],
+                'b_first_visit': entry['first_visit'],
+                'b_last_activity': entry['last_activity']
+            })
+
+        returning = 0
+        for session_id, entry in pending.items():
+            known_first = known_first_visits.get(session_id)
+            first_visit = entry['first_visit'] if known_first is None else min(known_first, entry['first_visit'])
+            # الجلسات الجديدة تُكتب في جدول فترة أول زيارتها
+            sessions = (
+                session_partitions.ensure_table(first_visit)
+                if session_partitions.enabled else VisitorSession.__table__
+            )
+            tables[sessions.name] = sessions
+            inserts[sessions.name].append(dict(entry, session_id=session_id, first_visit=first_visit, is_active=True))
+            hour = activity[floor_hour(first_visit)]
+            hour[1] += entry['page_views']
+            if known_first is None:
+                hour[0] += 1
+                continue
+            returning += 1
+            if first_visit < known_first:
+                # زائر معروف ظهرت له زيارة أقدم: يُنقل من يوم أول زيارته السابق
+                activity[floor_hour(known_first)][0] -= 1
+                hour[0] += 1
+
+        for table_name, ids in moves.items():
+            sessions = tables[table_name]
+            for start in range(0, len(ids), LOOKUP_CHUNK_SIZE):
+                db.session.execute(delete(sessions).where(sessions.c.id.in_(ids[start:start + LOOKUP_CHUNK_SIZE])))
+        for table_name, rows in updates.items():
+            db.session.execute(_update_statement(tables[table_name]), rows)
+        for table_name, rows in inserts.items():
+            db.session.execute(_insert_statement(tables[table_name]), rows)
+        daily = defaultdict(lambda: [0, 0])
+        for hour, (new_visitors, page_views) in activity.items():
+            day = daily[hour.date()]
+            day[0] += new_visitors
+            day[1] += page_views
+            if rollups:
+                VisitorStatsHourly.record_activity(hour, new_visitors=new_visitors, page_views=page_views)
+        for day, (new_visitors, page_views) in daily.items():
+            VisitorStats.record_activity(day, new_visitors=new_visitors, page_views=page_views)
+        if rollups and daily:
+            compact_monthly(min(daily), max(daily))
+        for day, sketch in sketches.items():
+            VisitorStatsSketch.merge_sketch(day, sketch.to_bytes())
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    moved = sum(len(ids) for ids in moves.values()) + returning
+    return {
+        'new_sessions': sum(len(rows) for rows in inserts.values()) - moved,
+        'updated_sessions': sum(len(rows) for rows in updates.values()) + moved
+    }
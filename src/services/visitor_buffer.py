@@ -0,0 +1,160 @@
+import atexit
+import logging
+import threading
+from datetime import datetime
+from src.services.visit_batch import merge_visit, write_visit_batch
+
+logger = logging.getLogger(__name__)
+
+
+class VisitorWriteBuffer:
+    """مخزن مؤقت في الذاكرة يجمع عمليات تتبع الزوار ويكتبها على دفعات (write-behind)"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self.max_size = 500
+        self.flush_interval = 2.0
+        self.max_pending = 10000
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}  # session_id -> بيانات الجلسة المتراكمة
+        self._pending_events = 0
+        self._known_first_visits = {}  # session_id -> أول زيارة من ملف تعريف الزائر العائد
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """ربط المخزن المؤقت بالتطبيق وتشغيل خيط الكتابة إذا كان مفعلاً"""
+        self.app = app
+        self.enabled = app.config.get('VISITOR_BUFFER_ENABLED', False)
+        self.max_size = app.config.get('VISITOR_BUFFER_MAX_SIZE', 500)
+        self.flush_interval = app.config.get('VISITOR_BUFFER_FLUSH_INTERVAL', 2.0)
+        self.max_pending = app.config.get('VISITOR_BUFFER_MAX_PENDING', 10000)
+        app.extensions['visitor_buffer'] = self
+
+        if self.enabled:
+            self.start()
+
+    def start(self):
+        """تشغيل خيط الكتابة الدورية وتسجيل التفريغ عند إيقاف العامل"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='visitor-write-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def shutdown(self):
+        """إيقاف خيط الكتابة وتفريغ ما تبقى من أحداث"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.flush_interval + 5)
+        self._thread = None
+        return self.flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"خطأ في تفريغ مخزن تتبع الزوار: {str(e)}")
+
+    def add(self, session_id, ip_address, user_agent, timestamp=None, first_seen=None):
+        """إضافة مشاهدة صفحة إلى المخزن المؤقت دون الكتابة في قاعدة البيانات.
+
+        first_seen هو وقت أول زيارة الزائر العائد من ملف التعريف: إن حُذفت جلسته تُعاد بهذا الوقت
+        ولا يُحتسب جديداً، كما في مسار الكتابة الفورية.
+        """
+        timestamp = timestamp or datetime.utcnow()
+
+        with self._lock:
+            if session_id not in self._pending and len(self._pending) >= self.max_pending:
+                # قاعدة البيانات لا تستقبل الكتابات منذ مدة: حد للذاكرة بدل النمو بلا نهاية
+                self.dropped += 1
+                if self.dropped == 1 or self.dropped % self.max_size == 0:
+                    logger.error(f"مخزن تتبع الزوار ممتلئ ({self.max_pending} جلسة)، أُسقط {self.dropped} حدثاً")
+                return
+            merge_visit(self._pending, session_id, ip_address, user_agent, timestamp)
+            if first_seen is not None:
+                known = self._known_first_visits.get(session_id)
+                self._known_first_visits[session_id] = first_seen if known is None else min(known, first_seen)
+            self._pending_events += 1
+            should_flush = self._pending_events >= self.max_size
+
+        if should_flush:
+            if self._thread is not None and self._thread.is_alive():
+                self._wakeup.set()
+            else:
+                # الأحداث تُعاد إلى المخزن عند الفشل، فلا يتحول خطأ الكتابة إلى خطأ في طلب التتبع
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"خطأ في تفريغ مخزن تتبع الزوار: {str(e)}")
+
+    def pending_count(self):
+        """عدد أحداث التتبع التي تنتظر الكتابة في قاعدة البيانات"""
+        with self._lock:
+            return self._pending_events
+
+    def flush(self):
+        """كتابة جميع الأحداث المعلقة في معاملة واحدة وإرجاع عددها"""
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                events = self._pending_events
+                known = self._known_first_visits
+                self._pending = {}
+                self._pending_events = 0
+                self._known_first_visits = {}
+
+            if not pending:
+                return 0
+
+            try:
+                if self.app is not None:
+                    with self.app.app_context():
+                        write_visit_batch(pending, known)
+                else:
+                    write_visit_batch(pending, known)
+            except Exception:
+                # إعادة الأحداث إلى المخزن حتى لا تضيع عند فشل الكتابة
+                self._restore(pending, events, known)
+                raise
+
+            return events
+
+    def _restore(self, pending, events, known=None):
+        dropped = 0
+        with self._lock:
+            for session_id, entry in pending.items():
+                current = self._pending.get(session_id)
+                if current is None:
+                    if len(self._pending) >= self.max_pending:
+                        dropped += entry['page_views']
+                        continue
+                    self._pending[session_id] = entry
+                else:
+                    current['first_visit'] = min(current['first_visit'], entry['first_visit'])
+                    current['last_activity'] = max(current['last_activity'], entry['last_activity'])
+                    current['page_views'] += entry['page_views']
+                first_seen = (known or {}).get(session_id)
+                if first_seen is not None:
+                    current_first = self._known_first_visits.get(session_id)
+                    self._known_first_visits[session_id] = (
+                        first_seen if current_first is None else min(current_first, first_seen)
+                    )
+            self._pending_events += events - dropped
+            self.dropped += dropped
+        if dropped:
+            logger.error(f"مخزن تتبع الزوار ممتلئ ({self.max_pending} جلسة)، أُسقط {dropped} حدثاً لم تُكتب")
+
+
+visitor_buffer = VisitorWriteBuffer()
@@ -0,0 +1,102 @@
+import base64
+import hashlib
+import hmac
+import secrets
+import struct
+from collections import namedtuple
+from datetime import datetime
+from flask import g
+
+VisitorId = namedtuple('VisitorId', ['session_id', 'first_seen'])
+
+# محتوى ملف التعريف: 16 بايت معرف عشوائي + 4 بايت وقت أول زيارة (ثوانٍ منذ 1970)
+# + 16 بايت توقيع HMAC-SHA256 مقتطع = 36 بايت = 48 حرفاً بترميز base64 للروابط دون حشو
+_ID_SIZE = 16
+_PAYLOAD = struct.Struct('>16sI')
+_SIGNATURE_SIZE = 16
+TOKEN_LENGTH = (_PAYLOAD.size + _SIGNATURE_SIZE) * 4 // 3
+
+
+class VisitorIdCookie:
+    """ملف تعريف موقّع بطول ثابت يحمل معرف الزائر ووقت أول زيارة بدلاً من جلسة Flask"""
+
+    def __init__(self, app=None):
+        self.cookie_name = 'visitor_id'
+        self.max_age = 365 * 24 * 3600
+        self.secure = False
+        self._key = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """قراءة الإعدادات واشتقاق مفتاح التوقيع وتسجيل إضافة ملف التعريف إلى الاستجابة"""
+        self.cookie_name = app.config.get('VISITOR_COOKIE_NAME', 'visitor_id')
+        self.max_age = app.config.get('VISITOR_COOKIE_MAX_AGE', 365 * 24 * 3600)
+        self.secure = app.config.get('VISITOR_COOKIE_SECURE', False)
+        # مفتاح مشتق خاص بهذا الملف حتى لا يُستخدم SECRET_KEY نفسه لتوقيع محتويين مختلفين
+        self._key = hmac.new(app.secret_key.encode(), b'visitor-id-cookie', hashlib.sha256).digest()
+        app.after_request(self._set_cookie)
+        app.extensions['visitor_id_cookie'] = self
+
+    def _sign(self, payload):
+        return hmac.new(self._key, payload, hashlib.sha256).digest()[:_SIGNATURE_SIZE]
+
+    def encode(self, visitor_id):
+        """ترميز معرف الزائر وتوقيعه"""
+        first_seen = int((visitor_id.first_seen - datetime(1970, 1, 1)).total_seconds())
+        payload = _PAYLOAD.pack(bytes.fromhex(visitor_id.session_id), first_seen)
+        return base64.urlsafe_b64encode(payload + self._sign(payload)).decode()
+
+    def decode(self, token):
+        """التحقق من ملف التعريف وإرجاع VisitorId أو None إذا كان غير صالح"""
+        if not isinstance(token, str) or len(token) != TOKEN_LENGTH:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(token)
+        except ValueError:
+            return None
+        payload, signature = raw[:_PAYLOAD.size], raw[_PAYLOAD.size:]
+        if not hmac.compare_digest(signature, self._sign(payload)):
+            return None
+        session_id, first_seen = _PAYLOAD.unpack(payload)
+        return VisitorId(session_id.hex(), datetime.utcfromtimestamp(first_seen))
+
+    @staticmethod
+    def can_encode(session_id):
+        """معرفات الجلسات السداسية بطول 32 حرفاً فقط (ومنها معرفات md5 القديمة) تُنقل إلى ملف التعريف"""
+        return isinstance(session_id, str) and len(session_id) == _ID_SIZE * 2 and all(
+            char in '0123456789abcdef' for char in session_id
+        )
+
+    @staticmethod
+    def new_id(now=None):
+        """إنشاء معرف زائر جديد عشوائي"""
+        now = now or datetime.utcnow()
+        return VisitorId(secrets.token_hex(_ID_SIZE), now.replace(microsecond=0))
+
+    def from_request(self, request):
+        """قراءة معرف الزائر من ملف التعريف في الطلب الحالي"""
+        return self.decode(request.cookies.get(self.cookie_name))
+
+    def attach(self, visitor_id):
+        """جدولة إرسال ملف التعريف مع الاستجابة الحالية"""
+        g.visitor_id_cookie = self.encode(visitor_id)
+
+    def _set_cookie(self, response):
+        token = g.pop('visitor_id_cookie', None)
+        if token is not None:
+            response.set_cookie(
+                self.cookie_name,
+                token,
+                max_age=self.max_age,
+                secure=self.secure,
+                httponly=True,
+                samesite='Lax'
+            )
+            # استجابة تحمل ملف تعريف زائر بعينه لا يجوز أن تخزنها ذاكرة مشتركة (CDN)
+            response.cache_control.public = False
+            response.cache_control.private = True
+        return response
+
+
+visitor_id_cookie = VisitorIdCookie()
@@ -1,8 +1,59 @@
-import uuid
-import hashlib
-from datetime import datetime, timedelta
-from flask import request, session
-from src.models.visitor_counter import db, VisitorCounterSettings, VisitorSession, VisitorStats
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from flask import current_app, request, session
+from sqlalchemy import select
+from sqlalchemy.orm.exc import StaleDataError
+from src.models.visitor_counter import (
+    db, StatisticsSnapshot, VisitorCounterSettings, VisitorSession, VisitorStats, VisitorStatsSketch
+)
+from src.models.partitions import session_partitions
+from src.services.visitor_buffer import visitor_buffer
+from src.services.count_cache import displayed_count_cache
+from src.services.settings_cache import settings_cache
+from src.services.active_window import active_visitor_window
+from src.services.hyperloglog import HyperLogLog, STANDARD_ERROR
+from src.services.visit_batch import merge_visit, write_visit_batch
+from src.services.visitor_id import VisitorId, visitor_id_cookie
+from src.services.counter_store import SQLCounterBackend, counter_store
+from src.services.rollups import compact_hourly, compact_monthly, query_range
+
+
+class _SketchedSessions:
+    """الجلسات التي أضيفت إلى مخطط اليوم الحالي من هذه العملية لتجنب دمج المخطط مع كل مشاهدة"""
+
+    MAX_SIZE = 100000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._day = None
+        self._session_ids = set()
+
+    def add(self, day, session_id):
+        """إرجاع True إذا لم تُسجل الجلسة لهذا اليوم من قبل"""
+        with self._lock:
+            if day != self._day or len(self._session_ids) >= self.MAX_SIZE:
+                # الدمج في المخطط متكرر النتيجة، لذا يكفي تفريغ المجموعة عند امتلائها
+                self._day = day
+                self._session_ids = set()
+            if session_id in self._session_ids:
+                return False
+            self._session_ids.add(session_id)
+            return True
+
+
+_sketched_sessions = _SketchedSessions()
+
+STATISTICS_SNAPSHOT_NAME = 'default'
+# لقطة أقدم من ضعف فترة إعادة البناء تعني أن المجدول متوقف أو يفشل، فتُبنى عند القراءة
+STATISTICS_SNAPSHOT_MAX_AGE_INTERVALS = 2
+
+# عدد محاولات تعديل الإعدادات عند تعارض version مع تعديل متزامن
+SETTINGS_WRITE_ATTEMPTS = 8
+SETTINGS_RETRY_DELAY = 0.01
+
 
 class VisitorCounterService:
     """خدمة إدارة عداد الزوار"""
@@ -10,7 +61,7 @@ class VisitorCounterService:
     @staticmethod
     def get_or_create_settings():
         """الحصول على إعدادات العداد أو إنشاؤها إذا لم تكن موجودة"""
-        settings = VisitorCounterSettings.query.first()
+        settings = settings_cache.get()
         if not settings:
             settings = VisitorCounterSettings(
                 min_base_count=1000,
@@ -23,101 +74,324 @@ class VisitorCounterService:
             db.session.commit()
         return settings
     
+    @staticmethod
+    def _write_settings(apply):
+        """تطبيق تعديل أدمن على صف الإعدادات وتثبيته، مع إعادة المحاولة إذا عدّله عامل آخر بعد قراءته.
+        
+        عمود version يجعل التعديل المتزامن يفشل بـ StaleDataError بدلاً من الكتابة فوق تعديل آخر،
+        فتُلغى المعاملة ويُعاد تحميل الصف ثم يُطبق التعديل على أحدث نسخة.
+        """
+        for attempt in range(SETTINGS_WRITE_ATTEMPTS):
+            try:
+                # نسخة الصف المخزنة قد تكون أحدث أو أقدم من نسخة الجلسة، فالقراءة داخل المحاولة
+                settings = VisitorCounterService.get_or_create_settings()
+                apply(settings)
+                VisitorCounterService.invalidate_statistics_snapshot()
+                db.session.commit()
+            except StaleDataError:
+                db.session.rollback()
+                db.session.expunge_all()
+                settings_cache.invalidate()
+                if attempt == SETTINGS_WRITE_ATTEMPTS - 1:
+                    raise
+                # انتظار عشوائي متزايد حتى لا تتعارض المحاولات المتزامنة نفسها مجدداً
+                time.sleep(random.uniform(0, SETTINGS_RETRY_DELAY * 2 ** attempt))
+                continue
+            except Exception:
+                db.session.rollback()
+                settings_cache.invalidate()
+                raise
+            settings_cache.invalidate()
+            displayed_count_cache.invalidate()
+            return settings
+    
     @staticmethod
     def update_settings(min_count, max_count, interval=30):
         """تحديث إعدادات العداد من قبل الأدمن"""
-        settings = VisitorCounterService.get_or_create_settings()
-        settings.min_base_count = min_count
-        settings.max_base_count = max_count
-        settings.update_interval = interval
-        settings.updated_at = datetime.utcnow()
-        
-        # تحديث الرقم العشوائي فوراً بالإعدادات الجديدة
-        settings.update_base_count()
+        def apply(settings):
+            settings.min_base_count = min_count
+            settings.max_base_count = max_count
+            settings.update_interval = interval
+            settings.updated_at = datetime.utcnow()
+            # تحديث الرقم العشوائي فوراً بالإعدادات الجديدة
+            settings.update_base_count()
         
-        db.session.commit()
-        return settings
+        return VisitorCounterService._write_settings(apply)
+    
+    @staticmethod
+    def reseed_base_count():
+        """إعادة توليد بذرة الرقم الأساسي من قبل الأدمن"""
+        return VisitorCounterService._write_settings(lambda settings: settings.update_base_count())
     
     @staticmethod
     def get_current_base_count():
-        """الحصول على الرقم العشوائي الحالي مع التحديث إذا لزم الأمر"""
+        """الحصول على الرقم الأساسي للفترة الزمنية الحالية"""
         settings = VisitorCounterService.get_or_create_settings()
         
         if not settings.is_active:
             return 0
         
-        # فحص ما إذا كان يجب تحديث الرقم العشوائي
-        if settings.should_update():
-            settings.update_base_count()
-        
-        return settings.current_base_count
+        # الرقم محسوب من البذرة والفترة الزمنية فلا يحتاج أي كتابة في مسار القراءة
+        return settings.compute_base_count()
     
     @staticmethod
     def generate_session_id():
-        """إنشاء معرف جلسة فريد"""
-        # استخدام IP + User Agent + timestamp لإنشاء معرف فريد
-        ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR', ''))
-        user_agent = request.headers.get('User-Agent', '')
-        timestamp = str(datetime.utcnow().timestamp())
-        
-        unique_string = f"{ip}_{user_agent}_{timestamp}_{uuid.uuid4()}"
-        return hashlib.md5(unique_string.encode()).hexdigest()
+        """إنشاء معرف جلسة فريد (128 بت عشوائية بترميز سداسي)"""
+        return visitor_id_cookie.new_id().session_id
     
     @staticmethod
     def track_visitor():
         """تتبع زائر جديد أو تحديث زائر موجود"""
-        # الحصول على معرف الجلسة من session أو إنشاء واحد جديد
-        if 'visitor_session_id' not in session:
-            session['visitor_session_id'] = VisitorCounterService.generate_session_id()
+        now = datetime.utcnow()
+        
+        # معرف الزائر من ملف التعريف الموقّع؛ وجوده يعني زائراً عائداً دون الرجوع لقاعدة البيانات
+        visitor_id = visitor_id_cookie.from_request(request)
+        if visitor_id is not None:
+            session_id = visitor_id.session_id
+            is_new = False
+        elif 'visitor_session_id' in session:
+            # معرف قديم من جلسة Flask: يُعرف إن كان جديداً من نتيجة upsert ويُنقل إلى ملف التعريف
+            session_id = session['visitor_session_id']
+            is_new = None
+        else:
+            visitor_id = visitor_id_cookie.new_id(now)
+            visitor_id_cookie.attach(visitor_id)
+            session_id = visitor_id.session_id
+            is_new = True
         
-        session_id = session['visitor_session_id']
         ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR', ''))
         user_agent = request.headers.get('User-Agent', '')
         
-        # البحث عن الجلسة الموجودة
-        visitor_session = VisitorSession.query.filter_by(session_id=session_id).first()
+        if active_visitor_window.enabled:
+            active_visitor_window.record(session_id)
         
-        if visitor_session:
-            # تحديث الجلسة الموجودة
-            visitor_session.update_activity()
-        else:
-            # إنشاء جلسة جديدة
-            visitor_session = VisitorSession(
+        # وقت أول زيارة معروف من ملف التعريف للزائر العائد فقط
+        known_first_seen = visitor_id.first_seen if is_new is False else None
+        returning = None if is_new is None else not is_new
+        
+        if not counter_store.is_sql:
+            return VisitorCounterService._track_outside_sql(
+                session_id, returning, known_first_seen, ip_address, user_agent, now
+            )
+        
+        # في وضع الكتابة المؤجلة تُجمع الزيارة في الذاكرة وتُكتب لاحقاً على دفعات
+        if visitor_buffer.enabled:
+            visitor_buffer.add(session_id, ip_address, user_agent, now, first_seen=known_first_seen)
+            return VisitorSession(
                 session_id=session_id,
                 ip_address=ip_address,
                 user_agent=user_agent,
-                first_visit=datetime.utcnow(),
-                last_activity=datetime.utcnow(),
+                first_visit=visitor_id.first_seen if visitor_id is not None else now,
+                last_activity=now,
                 page_views=1,
                 is_active=True
             )
-            db.session.add(visitor_session)
+        
+        try:
+            record = counter_store.record_visit(
+                session_id, known_first_seen or now, now,
+                returning=returning, ip_address=ip_address, user_agent=user_agent
+            )
+            visitor_session = VisitorSession(
+                id=record.id,
+                session_id=session_id,
+                ip_address=ip_address,
+                user_agent=user_agent,
+                first_visit=record.first_visit,
+                last_activity=now,
+                page_views=record.page_views,
+                is_active=True
+            )
+            
+            if returning is None:
+                VisitorCounterService._migrate_legacy_session(session_id, record.first_visit)
+            
+            # إضافة الجلسة لمخطط اليوم مرة واحدة لكل عملية
+            today = now.date()
+            if _sketched_sessions.add(today, session_id) or record.is_new:
+                VisitorCounterService.record_unique_visitor(today, session_id)
             db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
         
         return visitor_session
     
     @staticmethod
-    def get_active_visitors_count():
-        """الحصول على عدد الزوار النشطين (خلال آخر 30 دقيقة)"""
-        cutoff_time = datetime.utcnow() - timedelta(minutes=30)
-        active_count = VisitorSession.query.filter(
-            VisitorSession.last_activity >= cutoff_time,
-            VisitorSession.is_active == True
-        ).count()
+    def _migrate_legacy_session(session_id, first_visit):
+        """نقل معرف جلسة Flask القديم إلى ملف التعريف الموقّع"""
+        if visitor_id_cookie.can_encode(session_id):
+            visitor_id_cookie.attach(VisitorId(session_id, first_visit))
+            session.pop('visitor_session_id', None)
+    
+    @staticmethod
+    def _track_outside_sql(session_id, returning, known_first_seen, ip_address, user_agent, now):
+        """تتبع زيارة في واجهة عدادات خارج SQL، وكتابة تاريخها في SQL عبر المخزن المؤقت أو دفعة فورية"""
+        record = counter_store.record_visit(session_id, known_first_seen or now, now, returning=returning)
+        if returning is None:
+            VisitorCounterService._migrate_legacy_session(session_id, record.first_visit)
         
-        return active_count
+        if visitor_buffer.enabled:
+            visitor_buffer.add(session_id, ip_address, user_agent, now)
+        else:
+            pending = {}
+            merge_visit(pending, session_id, ip_address, user_agent, now)
+            pending[session_id]['first_visit'] = record.first_visit
+            write_visit_batch(pending)
+        
+        return VisitorSession(
+            session_id=session_id,
+            ip_address=ip_address,
+            user_agent=user_agent,
+            first_visit=record.first_visit,
+            last_activity=now,
+            page_views=record.page_views,
+            is_active=True
+        )
     
     @staticmethod
-    def get_total_visitors_today():
-        """الحصول على إجمالي الزوار اليوم"""
+    def parse_event_timestamp(value, default):
+        """تحويل طابع زمني (ISO 8601 أو ثوانٍ منذ 1970) إلى datetime بتوقيت UTC بدون منطقة زمنية"""
+        if value is None:
+            return default
+        if isinstance(value, bool):
+            raise ValueError('طابع زمني غير صحيح')
+        if isinstance(value, (int, float)):
+            return datetime.utcfromtimestamp(value)
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    
+    @staticmethod
+    def parse_timestamp_column(values, default):
+        """تحويل عمود طوابع زمنية دفعة واحدة؛ القيم غير الصحيحة تصبح None والمكرر منها يُحلل مرة واحدة"""
+        parsed = {}
+        column = []
+        for value in values:
+            # النوع جزء من المفتاح حتى لا تتطابق True مع 1
+            key = (type(value), value) if isinstance(value, (str, int, float)) else None
+            if key is not None and key in parsed:
+                column.append(parsed[key])
+                continue
+            try:
+                timestamp = VisitorCounterService.parse_event_timestamp(value, default)
+            except (TypeError, ValueError, OverflowError, OSError, AttributeError):
+                timestamp = None
+            if key is not None:
+                parsed[key] = timestamp
+            column.append(timestamp)
+        return column
+    
+    @staticmethod
+    def track_visitor_batch(events):
+        """تتبع دفعة من الزيارات في معاملة واحدة وإرجاع أعداد المقبول والمرفوض"""
+        now = datetime.utcnow()
+        
+        # الأحداث تُحوّل إلى أعمدة ويُتحقق من كل عمود كاملاً، ثم يُدمج المقبول منها حسب الجلسة
+        records = [event if isinstance(event, dict) else {} for event in events]
+        session_ids = [record.get('session_id') for record in records]
+        ip_addresses = [record.get('ip_address') for record in records]
+        user_agents = [record.get('user_agent') for record in records]
+        timestamps = VisitorCounterService.parse_timestamp_column(
+            [record.get('timestamp') for record in records], now
+        )
+        valid = [
+            isinstance(session_id, str) and 0 < len(session_id) <= 255
+            and (ip_address is None or isinstance(ip_address, str) and len(ip_address) <= 45)
+            and (user_agent is None or isinstance(user_agent, str))
+            and timestamp is not None
+            for session_id, ip_address, user_agent, timestamp
+            in zip(session_ids, ip_addresses, user_agents, timestamps)
+        ]
+        
+        pending = {}
+        for is_valid, session_id, ip_address, user_agent, timestamp in zip(
+            valid, session_ids, ip_addresses, user_agents, timestamps
+        ):
+            if is_valid:
+                merge_visit(pending, session_id, ip_address, user_agent, timestamp)
+        accepted = sum(valid)
+        rejected = len(valid) - accepted
+        
+        result = {'accepted': accepted, 'rejected': rejected, 'new_sessions': 0, 'updated_sessions': 0}
+        if pending:
+            result.update(write_visit_batch(pending))
+            
+            if active_visitor_window.enabled:
+                for session_id, entry in pending.items():
+                    active_visitor_window.record(session_id, entry['last_activity'])
+            
+            if not counter_store.is_sql:
+                counter_store.record_visits([
+                    (session_id, entry['first_visit'], entry['last_activity'], entry['page_views'], None)
+                    for session_id, entry in pending.items()
+                ])
+        
+        return result
+    
+    @staticmethod
+    def record_unique_visitor(day, *session_ids):
+        """إضافة جلسات إلى مخطط HyperLogLog ليوم معين (دون commit)"""
+        sketch = HyperLogLog()
+        for session_id in session_ids:
+            sketch.add(session_id)
+        VisitorStatsSketch.merge_sketch(day, sketch.to_bytes())
+    
+    @staticmethod
+    def get_unique_visitors(start_date, end_date):
+        """تقدير الزوار المميزين في نطاق أيام (شامل الطرفين) بدمج المخططات اليومية"""
+        sketches = db.session.query(VisitorStatsSketch.sketch).filter(
+            VisitorStatsSketch.date >= start_date,
+            VisitorStatsSketch.date <= end_date
+        ).all()
+        
+        merged = HyperLogLog()
+        for (sketch,) in sketches:
+            merged.merge(sketch)
+        
+        return merged.count()
+    
+    @staticmethod
+    def get_unique_visitors_summary(start_date=None, end_date=None):
+        """تقديرات الزوار المميزين لليوم والأسبوع والشهر ولنطاق مخصص اختياري"""
         today = datetime.utcnow().date()
-        today_start = datetime.combine(today, datetime.min.time())
+        summary = {
+            'today': VisitorCounterService.get_unique_visitors(today, today),
+            'week': VisitorCounterService.get_unique_visitors(today - timedelta(days=6), today),
+            'month': VisitorCounterService.get_unique_visitors(today - timedelta(days=29), today),
+            'standard_error': round(STANDARD_ERROR, 4)
+        }
+        
+        if start_date and end_date:
+            summary['range'] = VisitorCounterService.get_unique_visitors_range(start_date, end_date)
         
-        today_count = VisitorSession.query.filter(
-            VisitorSession.first_visit >= today_start
-        ).count()
+        return summary
+    
+    @staticmethod
+    def get_unique_visitors_range(start_date, end_date):
+        """تقدير الزوار المميزين لنطاق مخصص بصيغة الاستجابة"""
+        return {
+            'from': start_date.isoformat(),
+            'to': end_date.isoformat(),
+            'unique_visitors': VisitorCounterService.get_unique_visitors(start_date, end_date)
+        }
+    
+    @staticmethod
+    def get_active_visitors_count(minutes=30):
+        """الحصول على عدد الزوار النشطين (خلال آخر 30 دقيقة افتراضياً)"""
+        # النافذة المنزلقة في الذاكرة تجيب دون استعلام بعد تعبئتها مرة واحدة
+        if active_visitor_window.enabled and minutes <= active_visitor_window.window_minutes:
+            if not active_visitor_window.warmed:
+                active_visitor_window.warm()
+            return active_visitor_window.count(minutes)
         
-        return today_count
+        return counter_store.active_count(minutes)
+    
+    @staticmethod
+    def get_total_visitors_today():
+        """الحصول على إجمالي الزوار اليوم"""
+        return counter_store.daily_counts(datetime.utcnow().date())['new_visitors']
     
     @staticmethod
     def get_displayed_visitor_count():
@@ -132,42 +406,120 @@ class VisitorCounterService:
         
         return displayed_count
     
+    @staticmethod
+    def get_cached_visitor_count():
+        """الحصول على العدد المعروض من لقطة الذاكرة دون الرجوع لقاعدة البيانات ما دامت صالحة"""
+        ttl = current_app.config.get('VISITOR_COUNT_CACHE_TTL', 0)
+        if ttl <= 0:
+            return VisitorCounterService.get_displayed_visitor_count()
+        
+        snapshot = displayed_count_cache.get(ttl, VisitorCounterService._load_count_snapshot)
+        return snapshot['base_count'] + snapshot['active_visitors']
+    
+    @staticmethod
+    def _load_count_snapshot():
+        """قراءة الرقم الأساسي وعدد الزوار النشطين من قاعدة البيانات لتخزينهما في اللقطة"""
+        base_count = VisitorCounterService.get_current_base_count()
+        active_visitors = VisitorCounterService.get_active_visitors_count()
+        
+        # تحديث إحصائيات اليوم مرة واحدة لكل تحديث للقطة بدلاً من كل طلب
+        VisitorCounterService.update_daily_stats(base_count + active_visitors)
+        
+        return {
+            'base_count': base_count,
+            'active_visitors': active_visitors
+        }
+    
     @staticmethod
     def update_daily_stats(displayed_count):
-        """تحديث إحصائيات اليوم"""
+        """تحديث العدد المعروض في إحصائيات اليوم (الزوار والمشاهدات تُحدَّث تراكمياً عند التتبع)"""
         today = datetime.utcnow().date()
         
         stats = VisitorStats.query.filter_by(date=today).first()
         if not stats:
             stats = VisitorStats(
                 date=today,
-                unique_visitors=VisitorCounterService.get_total_visitors_today(),
+                unique_visitors=0,
                 total_page_views=0,
                 displayed_count=displayed_count
             )
             db.session.add(stats)
         else:
-            stats.unique_visitors = VisitorCounterService.get_total_visitors_today()
             stats.displayed_count = displayed_count
             stats.updated_at = datetime.utcnow()
         
-        # حساب إجمالي المشاهدات
-        total_views = db.session.query(db.func.sum(VisitorSession.page_views)).filter(
-            db.func.date(VisitorSession.first_visit) == today
-        ).scalar() or 0
+        db.session.commit()
+        
+        return stats
+    
+    @staticmethod
+    def retention_cutoff_day(retention_days=None):
+        """أول يوم ما زالت جلساته كاملة في قاعدة البيانات، أو None إذا كان الحذف معطلاً"""
+        if retention_days is None:
+            retention_days = current_app.config.get('SESSION_RETENTION_DAYS', 30)
+        if retention_days <= 0:
+            return None
+        return (datetime.utcnow() - timedelta(days=retention_days)).date()
+    
+    @staticmethod
+    def rebuild_daily_stats(day):
+        """إعادة حساب إحصائيات يوم معين بدقة من جلسات الزوار"""
+        # جلسات الأيام الأقدم من فترة الاحتفاظ حُذف بعضها أو كلها، وإعادة حسابها تمحو إحصائياتها المحفوظة
+        cutoff_day = VisitorCounterService.retention_cutoff_day()
+        if cutoff_day is not None and day < cutoff_day:
+            raise ValueError(f'لا يمكن إعادة حساب {day.isoformat()}: جلساته أقدم من فترة الاحتفاظ (قبل {cutoff_day.isoformat()})')
+        
+        # إعادة الحساب تقرأ جلسات SQL دائماً مهما كانت واجهة العدادات الساخنة
+        counts = SQLCounterBackend().daily_counts(day)
+        unique_visitors, total_page_views = counts['new_visitors'], counts['page_views']
+        
+        stats = VisitorStats.query.filter_by(date=day).first()
+        if not stats:
+            if not unique_visitors:
+                return None
+            stats = VisitorStats(date=day, displayed_count=0)
+            db.session.add(stats)
         
-        stats.total_page_views = total_views
+        stats.unique_visitors = unique_visitors
+        stats.total_page_views = total_page_views
+        stats.updated_at = datetime.utcnow()
         db.session.commit()
         
         return stats
     
     @staticmethod
-    def get_visitor_statistics():
-        """الحصول على إحصائيات شاملة للزوار"""
+    def compact_rollups(hours=None):
+        """إعادة بناء التجميعات الساعية من الجلسات والشهرية من الإحصائيات اليومية لآخر N ساعة"""
+        hours = hours or current_app.config.get('ROLLUP_COMPACTION_HOURS', 48)
+        end = datetime.utcnow()
+        start = end - timedelta(hours=hours)
+        
+        try:
+            result = {
+                'hours': compact_hourly(start, end),
+                'months': compact_monthly(start.date(), end.date())
+            }
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        
+        return result
+    
+    @staticmethod
+    def get_statistics_range(start, end, granularity='day'):
+        """إحصائيات نطاق زمني بدقة ساعة أو يوم أو شهر من جداول التجميع فقط"""
+        return query_range(start, end, granularity)
+    
+    @staticmethod
+    def build_visitor_statistics():
+        """حساب الإحصائيات الشاملة من الجداول مباشرة (مصدر لقطة /statistics)"""
         settings = VisitorCounterService.get_or_create_settings()
         active_visitors = VisitorCounterService.get_active_visitors_count()
         today_visitors = VisitorCounterService.get_total_visitors_today()
-        displayed_count = VisitorCounterService.get_displayed_visitor_count()
+        # القراءة لا تكتب العدد المعروض في إحصائيات اليوم (تفعل ذلك /count عند تحديث لقطتها)، فلا
+        # يُعاد عدّ الزوار النشطين ولا تُثبَّت معاملة تُبطل كائن الإعدادات المحمّل
+        displayed_count = VisitorCounterService.get_current_base_count() + active_visitors
         
         # إحصائيات آخر 7 أيام
         week_ago = datetime.utcnow().date() - timedelta(days=7)
@@ -180,32 +532,131 @@ class VisitorCounterService:
             'current_display_count': displayed_count,
             'active_visitors': active_visitors,
             'today_visitors': today_visitors,
-            'base_count': settings.current_base_count,
-            'weekly_stats': [stat.to_dict() for stat in weekly_stats]
+            'base_count': settings.compute_base_count(),
+            'weekly_stats': [stat.to_dict() for stat in weekly_stats],
+            'unique_visitors': VisitorCounterService.get_unique_visitors_summary()
         }
     
     @staticmethod
-    def cleanup_old_sessions():
-        """تنظيف الجلسات القديمة (أكثر من 24 ساعة)"""
-        cutoff_time = datetime.utcnow() - timedelta(hours=24)
+    def refresh_statistics_snapshot():
+        """إعادة بناء لقطة الإحصائيات وتخزينها، وإرجاع الإحصائيات مع وقت توليدها"""
+        generated_at = datetime.utcnow()
+        statistics = VisitorCounterService.build_visitor_statistics()
+        statistics['generated_at'] = generated_at.isoformat()
         
-        old_sessions = VisitorSession.query.filter(
-            VisitorSession.last_activity < cutoff_time
-        ).all()
+        StatisticsSnapshot.store(STATISTICS_SNAPSHOT_NAME, json.dumps(statistics), generated_at)
+        db.session.commit()
+        return statistics
+    
+    @staticmethod
+    def invalidate_statistics_snapshot():
+        """حذف اللقطة بعد تعديل الإعدادات حتى تُبنى من جديد عند القراءة التالية (دون commit)"""
+        StatisticsSnapshot.query.filter_by(name=STATISTICS_SNAPSHOT_NAME).delete()
+    
+    @staticmethod
+    def get_visitor_statistics(start_date=None, end_date=None):
+        """الحصول على إحصائيات شاملة للزوار من اللقطة المحسوبة مسبقاً (أو مباشرة إذا عُطلت اللقطات)"""
+        interval = current_app.config.get('STATISTICS_SNAPSHOT_INTERVAL', 0)
+        if interval <= 0:
+            statistics = VisitorCounterService.build_visitor_statistics()
+            statistics['generated_at'] = datetime.utcnow().isoformat()
+        else:
+            snapshot = db.session.get(StatisticsSnapshot, STATISTICS_SNAPSHOT_NAME)
+            max_age = timedelta(seconds=interval * STATISTICS_SNAPSHOT_MAX_AGE_INTERVALS)
+            if snapshot is not None and datetime.utcnow() - snapshot.generated_at <= max_age:
+                statistics = json.loads(snapshot.data)
+            else:
+                # أول قراءة قبل أن يبني المجدول اللقطة، أو لقطة قديمة لأن المجدول معطل أو متعثر
+                statistics = VisitorCounterService.refresh_statistics_snapshot()
         
-        for session_obj in old_sessions:
-            session_obj.is_active = False
+        # النطاق المخصص يُقدَّر من المخططات اليومية دون لمس جدول الجلسات
+        if start_date and end_date:
+            statistics['unique_visitors']['range'] = VisitorCounterService.get_unique_visitors_range(start_date, end_date)
         
-        db.session.commit()
+        return statistics
+    
+    @staticmethod
+    def _run_in_chunks(build_statement, batch_size, pause_seconds=0):
+        """تنفيذ عبارة UPDATE/DELETE محدودة بدفعة مع commit لكل دفعة حتى لا يُحجز قفل الكتابة طويلاً"""
+        total = 0
+        while True:
+            affected = db.session.execute(build_statement(batch_size)).rowcount
+            db.session.commit()
+            total += affected
+            if affected < batch_size:
+                return total
+            if pause_seconds:
+                # إتاحة قفل الكتابة لطلبات التتبع بين الدفعات
+                time.sleep(pause_seconds)
+    
+    @staticmethod
+    def cleanup_old_sessions(inactive_hours=None, batch_size=None):
+        """إلغاء تفعيل الجلسات غير النشطة (أكثر من 24 ساعة افتراضياً) على دفعات وإرجاع عددها"""
+        config = current_app.config
+        inactive_hours = inactive_hours or config.get('SESSION_INACTIVE_HOURS', 24)
+        batch_size = batch_size or config.get('CLEANUP_BATCH_SIZE', 1000)
+        cutoff_time = datetime.utcnow() - timedelta(hours=inactive_hours)
         
-        return len(old_sessions)
+        def build_statement(sessions):
+            def limited(limit):
+                stale_ids = select(sessions.c.id).where(
+                    sessions.c.is_active == True,
+                    sessions.c.last_activity < cutoff_time
+                ).limit(limit)
+                return sessions.update().where(sessions.c.id.in_(stale_ids)).values(is_active=False)
+            return limited
+        
+        # الجلسات التي بدأت بعد الحد لا يمكن أن تكون قديمة
+        return sum(
+            VisitorCounterService._run_in_chunks(
+                build_statement(sessions), batch_size, config.get('CLEANUP_BATCH_PAUSE', 0)
+            )
+            for sessions in session_partitions.tables(end_day=cutoff_time.date() + timedelta(days=1))
+        )
+    
+    @staticmethod
+    def purge_expired_sessions(retention_days=None, batch_size=None):
+        """حذف الجلسات غير النشطة الأقدم من فترة الاحتفاظ على دفعات وإرجاع عددها (0 أيام = بلا حذف)"""
+        config = current_app.config
+        if retention_days is None:
+            retention_days = config.get('SESSION_RETENTION_DAYS', 30)
+        if retention_days <= 0:
+            return 0
+        batch_size = batch_size or config.get('CLEANUP_BATCH_SIZE', 1000)
+        cutoff_time = datetime.utcnow() - timedelta(days=retention_days)
+        
+        if session_partitions.enabled:
+            # في وضع التقسيم يُحسب الاحتفاظ من أول زيارة ويُحذف الجدول كاملاً بدلاً من صفوفه،
+            # ويُرجع عدد الجداول المحذوفة
+            return session_partitions.drop_before(cutoff_time.date())
+        
+        sessions = VisitorSession.__table__
+        
+        def build_statement(limit):
+            # الإحصائيات اليومية ومخططاتها مخزنة مستقلة عن الجلسات فلا تتأثر بالحذف
+            expired_ids = select(sessions.c.id).where(
+                sessions.c.is_active == False,
+                sessions.c.last_activity < cutoff_time
+            ).limit(limit)
+            return sessions.delete().where(sessions.c.id.in_(expired_ids))
+        
+        return VisitorCounterService._run_in_chunks(
+            build_statement, batch_size, config.get('CLEANUP_BATCH_PAUSE', 0)
+        )
+    
+    @staticmethod
+    def cleanup_sessions():
+        """صيانة جدول الجلسات: إلغاء تفعيل غير النشطة ثم حذف المنتهية"""
+        return {
+            'deactivated': VisitorCounterService.cleanup_old_sessions(),
+            'deleted': VisitorCounterService.purge_expired_sessions()
+        }
     
     @staticmethod
     def toggle_counter_status(is_active):
         """تفعيل أو إلغاء تفعيل العداد"""
-        settings = VisitorCounterService.get_or_create_settings()
-        settings.is_active = is_active
-        settings.updated_at = datetime.utcnow()
-        db.session.commit()
+        def apply(settings):
+            settings.is_active = is_active
+            settings.updated_at = datetime.utcnow()
         
-        return settings
+        return VisitorCounterService._write_settings(apply)
@@ -1,14 +1,34 @@
 import pytest
 import os
+import socketserver
 import sys
 import tempfile
+import threading
 from datetime import datetime, timedelta
 
 # إضافة مسار المشروع
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
+# قاعدة بيانات مؤقتة لجلسة الاختبار حتى لا تُعدَّل قاعدة بيانات الخدمة الحقيقية
+# (يجب ضبطها قبل استيراد التطبيق لأن المحرك يُنشأ عند الاستيراد)
+_session_db_fd, _session_db_path = tempfile.mkstemp(suffix='.db')
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_session_db_path}')
+# المهام الدورية تُشغَّل يدوياً في الاختبارات
+os.environ.setdefault('SCHEDULER_ENABLED', 'false')
+
+from flask import g, request as flask_request, request_finished
 from src.main import app
-from src.models.visitor_counter import db, VisitorCounterSettings, VisitorSession, VisitorStats
+from src.models.visitor_counter import db, StatisticsSnapshot, VisitorCounterSettings, VisitorSession, VisitorStats
+from src.services.count_cache import displayed_count_cache
+
+@pytest.fixture(scope='session', autouse=True)
+def session_database():
+    """حذف قاعدة بيانات جلسة الاختبار بعد انتهاء جميع الاختبارات"""
+    yield
+    os.close(_session_db_fd)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(_session_db_path + suffix):
+            os.unlink(_session_db_path + suffix)
 
 @pytest.fixture
 def client():
@@ -19,6 +39,9 @@ def client():
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
     app.config['WTF_CSRF_ENABLED'] = False
     
+    # عدم مشاركة لقطة العدد المعروض بين الاختبارات
+    displayed_count_cache.invalidate()
+    
     with app.test_client() as client:
         with app.app_context():
             db.create_all()
@@ -31,6 +54,8 @@ def client():
                 is_active=True
             )
             db.session.add(settings)
+            # عدم مشاركة لقطة الإحصائيات بين الاختبارات
+            StatisticsSnapshot.query.delete()
             db.session.commit()
             
         yield client
@@ -38,6 +63,27 @@ def client():
     os.close(db_fd)
     os.unlink(app.config['DATABASE'])
 
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'query_budget(n): fail the test when any request runs more than n SQL statements')
+
+@pytest.fixture(autouse=True)
+def query_budget(request):
+    """تسجيل عدد استعلامات كل طلب، وإفشال الاختبار المعلَّم بـ query_budget(n) إذا تجاوزه أي طلب"""
+    recorded = []
+    
+    def record(sender, response, **extra):
+        recorded.append((flask_request.method, flask_request.path, g.get('db_queries', 0)))
+    
+    with request_finished.connected_to(record, app):
+        yield recorded
+    
+    marker = request.node.get_closest_marker('query_budget')
+    if marker is not None:
+        budget = marker.args[0]
+        over = [f'{method} {path}: {queries}' for method, path, queries in recorded if queries > budget]
+        if over:
+            pytest.fail(f'تجاوز حد الاستعلامات ({budget}) لكل طلب: ' + '، '.join(over))
+
 @pytest.fixture
 def sample_settings():
     """إعدادات عينة للاختبار"""
@@ -90,3 +136,106 @@ def create_test_sessions(client, sample_visitor_sessions):
         db.session.commit()
         
         return len(sample_visitor_sessions)
+
+class _RespStandIn(socketserver.ThreadingTCPServer):
+    """خادم بديل يتحدث بروتوكول Redis (RESP2) في الذاكرة بالأوامر التي تستخدمها واجهة العدادات فقط"""
+    
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _RespHandler)
+        self.lock = threading.Lock()
+        self.data = {}
+        self.commands = 0
+    
+    def run(self, name, args):
+        data = self.data
+        if name in ('PING', 'AUTH', 'SELECT'):
+            return 'PONG' if name == 'PING' else 'OK'
+        if name == 'HSETNX':
+            fields = data.setdefault(args[0], {})
+            if args[1] in fields:
+                return 0
+            fields[args[1]] = args[2]
+            return 1
+        if name == 'HINCRBY':
+            fields = data.setdefault(args[0], {})
+            fields[args[1]] = str(int(fields.get(args[1], 0)) + int(args[2]))
+            return int(fields[args[1]])
+        if name == 'HGET':
+            return data.get(args[0], {}).get(args[1])
+        if name == 'HMGET':
+            return [data.get(args[0], {}).get(field) for field in args[1:]]
+        if name == 'EXPIRE':
+            return int(args[0] in data)
+        if name == 'ZADD':
+            members = data.setdefault(args[0], {})
+            added = int(args[2] not in members)
+            members[args[2]] = float(args[1])
+            return added
+        if name in ('ZCOUNT', 'ZREMRANGEBYSCORE'):
+            def bound(text):
+                return (float(text[1:]), False) if text.startswith('(') else (float(text), True)
+            (low, low_inclusive), (high, high_inclusive) = bound(args[1]), bound(args[2])
+            members = data.get(args[0], {})
+            matched = [
+                member for member, score in members.items()
+                if (score >= low if low_inclusive else score > low)
+                and (score <= high if high_inclusive else score < high)
+            ]
+            if name == 'ZREMRANGEBYSCORE':
+                for member in matched:
+                    del members[member]
+            return len(matched)
+        if name == 'SCAN':
+            prefix = args[args.index('MATCH') + 1].rstrip('*')
+            return ['0', [key for key in data if key.startswith(prefix)]]
+        if name == 'DEL':
+            return sum(data.pop(key, None) is not None for key in args)
+        return RuntimeError(f'ERR unknown command {name}')
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    def _read_command(self):
+        header = self.rfile.readline()
+        if not header:
+            return None
+        args = []
+        for _ in range(int(header[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode())
+        return args
+    
+    def _encode(self, reply):
+        if reply is None:
+            return b'$-1\r\n'
+        if isinstance(reply, Exception):
+            return b'-%s\r\n' % str(reply).encode()
+        if isinstance(reply, int):
+            return b':%d\r\n' % reply
+        if isinstance(reply, list):
+            return b'*%d\r\n' % len(reply) + b''.join(self._encode(item) for item in reply)
+        data = reply.encode()
+        return b'$%d\r\n%s\r\n' % (len(data), data)
+    
+    def handle(self):
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            with self.server.lock:
+                self.server.commands += 1
+                reply = self.server.run(args[0].upper(), args[1:])
+            self.wfile.write(self._encode(reply))
+
+@pytest.fixture
+def resp_server():
+    """خادم محلي بديل لـ Redis يُرجع رابطه"""
+    server = _RespStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f'redis://127.0.0.1:{server.server_address[1]}/0'
+    yield server
+    server.shutdown()
+    server.server_close()
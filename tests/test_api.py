@@ -1,6 +1,8 @@
 import pytest
+import asyncio
 import json
 from datetime import datetime, timedelta
+from unittest.mock import patch
 from src.models.visitor_counter import VisitorCounterSettings, VisitorSession, db
 from src.main import app
 
@@ -18,6 +20,40 @@ class TestVisitorCounterAPI:
         assert isinstance(data['count'], int)
         assert data['count'] >= 0
     
+    def test_stream_sends_count_events(self, client):
+        """اختبار أن البث يعيد text/event-stream ويرسل العدد دون تتبع الزائر"""
+        from src.services.count_stream import count_broadcaster
+        count_broadcaster.publish(-1)
+        response = client.get('/api/visitor-counter/stream', buffered=False)
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        assert response.headers['Cache-Control'] == 'no-cache'
+        assert not any(cookie.startswith('visitor_id=') for cookie in response.headers.getlist('Set-Cookie'))
+        chunks = iter(response.response)
+        assert next(chunks).startswith(b'retry:')
+        assert b'event: count' in next(chunks)
+        response.close()
+    
+    def test_stream_rejects_wsgi_subscribers_over_thread_budget(self, client):
+        """اختبار رفض اتصالات البث عبر WSGI بعد حدها حتى تبقى خيوط الطلبات لـ /count و/track"""
+        from src.services.count_stream import count_broadcaster
+        count_broadcaster.publish(-2)
+        with patch.object(count_broadcaster, 'max_wsgi_subscribers', 1):
+            first = client.get('/api/visitor-counter/stream', buffered=False)
+            next(iter(first.response))
+            
+            second = client.get('/api/visitor-counter/stream', buffered=False)
+            assert first.status_code == 200
+            assert second.status_code == 503
+            assert client.get('/api/visitor-counter/count').status_code == 200
+            
+            first.close()
+            assert count_broadcaster.stats()['wsgi_subscribers'] == 0
+            third = client.get('/api/visitor-counter/stream', buffered=False)
+            assert third.status_code == 200
+            third.close()
+    
     def test_track_visitor_success(self, client):
         """اختبار تتبع زائر بنجاح"""
         with client.session_transaction() as sess:
@@ -30,6 +66,19 @@ class TestVisitorCounterAPI:
         assert data['success'] == True
         assert 'session_id' in data
     
+    def test_track_visitor_sets_signed_cookie(self, client):
+        """اختبار أن الزائر الجديد يحصل على ملف تعريف موقّع يُعاد استخدامه دون جلسة Flask"""
+        first = client.post('/api/visitor-counter/track')
+        cookies = first.headers.getlist('Set-Cookie')
+        
+        assert any(cookie.startswith('visitor_id=') for cookie in cookies)
+        assert not any(cookie.startswith('session=') for cookie in cookies)
+        
+        second = client.post('/api/visitor-counter/track')
+        
+        assert json.loads(second.data)['session_id'] == json.loads(first.data)['session_id']
+        assert second.headers.getlist('Set-Cookie') == []
+    
     def test_get_statistics_success(self, client):
         """اختبار الحصول على الإحصائيات بنجاح"""
         response = client.get('/api/visitor-counter/statistics')
@@ -46,6 +95,49 @@ class TestVisitorCounterAPI:
         assert 'base_count' in stats_data
         assert 'settings' in stats_data
         assert 'weekly_stats' in stats_data
+        assert 'generated_at' in stats_data
+        assert response.headers['Last-Modified']
+    
+    def test_get_statistics_unique_visitors_range(self, client):
+        """اختبار تقدير الزوار المميزين لنطاق أيام مخصص"""
+        response = client.get('/api/visitor-counter/statistics?from=2024-01-01&to=2024-01-31')
+        
+        assert response.status_code == 200
+        unique_visitors = json.loads(response.data)['data']['unique_visitors']
+        assert 'today' in unique_visitors
+        assert 'week' in unique_visitors
+        assert 'month' in unique_visitors
+        assert unique_visitors['range']['from'] == '2024-01-01'
+        assert unique_visitors['standard_error'] < 0.02
+    
+    def test_get_statistics_invalid_range(self, client):
+        """اختبار رفض نطاق تواريخ غير صحيح"""
+        response = client.get('/api/visitor-counter/statistics?from=2024-02-01&to=2024-01-01')
+        assert response.status_code == 400
+        
+        response = client.get('/api/visitor-counter/statistics?from=yesterday')
+        assert response.status_code == 400
+        assert json.loads(response.data)['success'] == False
+    
+    def test_get_statistics_range(self, client):
+        """اختبار إحصائيات النطاق من جداول التجميع"""
+        client.post('/api/visitor-counter/track')
+        today = datetime.utcnow().date().isoformat()
+        
+        response = client.get(f'/api/visitor-counter/statistics/range?from={today}&to={today}&granularity=day')
+        
+        assert response.status_code == 200
+        data = json.loads(response.data)['data']
+        assert data['granularity'] == 'day'
+        assert data['points'][0]['period'] == today
+        assert data['totals']['unique_visitors'] >= 1
+    
+    def test_get_statistics_range_validation(self, client):
+        """اختبار رفض دقة أو نطاق غير صحيح"""
+        assert client.get('/api/visitor-counter/statistics/range?from=2024-01-01&to=2024-01-31&granularity=week').status_code == 400
+        assert client.get('/api/visitor-counter/statistics/range?from=2024-01-01').status_code == 400
+        assert client.get('/api/visitor-counter/statistics/range?from=2024-02-01&to=2024-01-01').status_code == 400
+        assert client.get('/api/visitor-counter/statistics/range?from=yesterday&to=today').status_code == 400
     
     def test_get_admin_settings_success(self, client):
         """اختبار الحصول على إعدادات الأدمن بنجاح"""
@@ -216,6 +308,15 @@ class TestVisitorCounterAPI:
         assert data['success'] == False
         assert 'error' in data
     
+    def test_reseed_base_count_success(self, client):
+        """اختبار إعادة توليد الرقم الأساسي من لوحة الأدمن"""
+        response = client.post('/api/visitor-counter/admin/reseed')
+        
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['success'] == True
+        assert 'current_base_count' in data['data']
+    
     def test_cleanup_old_sessions_success(self, client):
         """اختبار تنظيف الجلسات القديمة بنجاح"""
         # إنشاء جلسة قديمة للاختبار
@@ -237,6 +338,7 @@ class TestVisitorCounterAPI:
         assert data['success'] == True
         assert 'cleaned_sessions' in data
         assert isinstance(data['cleaned_sessions'], int)
+        assert isinstance(data['deleted_sessions'], int)
     
     def test_health_check_success(self, client):
         """اختبار فحص صحة الخدمة"""
@@ -258,6 +360,386 @@ class TestVisitorCounterAPI:
         assert data['service'] == 'naebak-visitor-counter'
         assert data['status'] == 'healthy'
 
+class TestBatchTrackingAPI:
+    """اختبارات تتبع دفعات الزيارات"""
+    
+    def test_track_batch_success(self, client):
+        """اختبار تتبع دفعة زيارات جديدة ومتكررة"""
+        events = [
+            {'session_id': f'batch_session_{i % 40}', 'ip_address': f'10.3.0.{i % 40}',
+             'user_agent': 'Edge Forwarder', 'timestamp': '2024-03-01T10:00:00Z'}
+            for i in range(100)
+        ]
+        
+        response = client.post('/api/visitor-counter/track/batch', json={'events': events})
+        
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['success'] == True
+        assert data['accepted'] == 100
+        assert data['rejected'] == 0
+        assert data['new_sessions'] == 40
+        assert data['updated_sessions'] == 0
+        
+        with app.app_context():
+            visitor_session = VisitorSession.query.filter_by(session_id='batch_session_7').first()
+            assert visitor_session.page_views == 3
+            assert visitor_session.first_visit == datetime(2024, 3, 1, 10, 0, 0)
+    
+    def test_track_batch_updates_existing_sessions(self, client):
+        """اختبار أن الدفعة تزيد مشاهدات الجلسات الموجودة"""
+        with app.app_context():
+            db.session.add(VisitorSession(session_id='batch_existing', page_views=5))
+            db.session.commit()
+        
+        response = client.post('/api/visitor-counter/track/batch', json={'events': [
+            {'session_id': 'batch_existing'},
+            {'session_id': 'batch_existing', 'timestamp': 1709287200}
+        ]})
+        
+        data = json.loads(response.data)
+        assert data['updated_sessions'] == 1
+        assert data['new_sessions'] == 0
+        with app.app_context():
+            assert VisitorSession.query.filter_by(session_id='batch_existing').first().page_views == 7
+    
+    def test_track_batch_rejects_invalid_events(self, client):
+        """اختبار رفض الأحداث غير الصحيحة مع قبول الباقي"""
+        response = client.post('/api/visitor-counter/track/batch', json={'events': [
+            {'session_id': 'batch_valid'},
+            {'session_id': ''},
+            {'ip_address': '10.3.1.1'},
+            {'session_id': 'batch_bad_time', 'timestamp': 'yesterday'},
+            'not an object'
+        ]})
+        
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        assert data['accepted'] == 1
+        assert data['rejected'] == 4
+    
+    def test_track_batch_requires_events(self, client):
+        """اختبار رفض الطلب بدون قائمة أحداث"""
+        response = client.post('/api/visitor-counter/track/batch', json={'events': []})
+        assert response.status_code == 400
+        
+        response = client.post('/api/visitor-counter/track/batch', data='not json')
+        assert response.status_code == 400
+    
+    def test_track_batch_size_limit(self, client):
+        """اختبار رفض الدفعات التي تتجاوز الحد الأقصى"""
+        app.config['VISITOR_BATCH_MAX_EVENTS'] = 2
+        try:
+            response = client.post('/api/visitor-counter/track/batch', json={
+                'events': [{'session_id': f'batch_limit_{i}'} for i in range(3)]
+            })
+        finally:
+            app.config['VISITOR_BATCH_MAX_EVENTS'] = 10000
+        
+        assert response.status_code == 413
+
+class TestConditionalCaching:
+    """اختبارات ترويسات ETag وCache-Control وردود 304"""
+    
+    def test_count_revalidates_with_etag(self, client):
+        """اختبار أن /count يعيد 304 لنفس ETag مع تتبع الزائر"""
+        first = client.get('/api/visitor-counter/count')
+        etag = first.headers['ETag']
+        
+        assert etag.startswith('W/"')
+        assert 'max-age' in first.headers['Cache-Control']
+        
+        second = client.get('/api/visitor-counter/count', headers={'If-None-Match': etag})
+        assert second.status_code in (200, 304)
+        if second.status_code == 304:
+            assert second.data == b''
+            assert second.headers['ETag'] == etag
+    
+    def test_new_visitor_response_is_private(self, client):
+        """اختبار أن الاستجابة التي تحمل ملف تعريف زائر جديد لا تُخزن في ذاكرة مشتركة"""
+        response = client.get('/api/visitor-counter/count')
+        
+        assert any(cookie.startswith('visitor_id=') for cookie in response.headers.getlist('Set-Cookie'))
+        assert 'private' in response.headers['Cache-Control']
+        assert 'public' not in response.headers['Cache-Control']
+    
+    def test_settings_not_modified_until_changed(self, client):
+        """اختبار أن ETag الإعدادات يتغير بعد تعديلها"""
+        first = client.get('/api/visitor-counter/admin/settings')
+        etag = first.headers['ETag']
+        
+        assert first.headers['Cache-Control'] == app.config['SETTINGS_CACHE_CONTROL']
+        assert 'Last-Modified' in first.headers
+        assert client.get('/api/visitor-counter/admin/settings', headers={'If-None-Match': etag}).status_code == 304
+        
+        client.put(
+            '/api/visitor-counter/admin/settings',
+            data=json.dumps({'min_base_count': 1100, 'max_base_count': 1600, 'update_interval': 45}),
+            content_type='application/json'
+        )
+        assert client.get('/api/visitor-counter/admin/settings', headers={'If-None-Match': etag}).status_code == 200
+    
+    def test_statistics_not_modified(self, client):
+        """اختبار إعادة التحقق من الإحصائيات دون تغير القيم"""
+        first = client.get('/api/visitor-counter/statistics')
+        
+        assert first.headers['Cache-Control'] == app.config['STATISTICS_CACHE_CONTROL']
+        second = client.get('/api/visitor-counter/statistics', headers={'If-None-Match': first.headers['ETag']})
+        assert second.status_code == 304
+
+
+class TestMetricsEndpoint:
+    """اختبارات نقطة نهاية قياسات Prometheus"""
+    
+    def _sample(self, name, labels=None):
+        from prometheus_client import REGISTRY
+        return REGISTRY.get_sample_value(name, labels or {}) or 0
+    
+    def test_metrics_text_format(self, client):
+        """اختبار أن /metrics يعيد نص Prometheus مع الزوار النشطين"""
+        client.get('/api/visitor-counter/count')
+        response = client.get('/metrics')
+        
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/plain')
+        body = response.data.decode()
+        assert 'visitor_counter_request_duration_seconds_bucket' in body
+        assert 'visitor_counter_active_visitors' in body
+    
+    def test_request_and_query_metrics(self, client):
+        """اختبار تسجيل زمن المسار وعدد استعلاماته والمعاملات المثبتة"""
+        labels = {'method': 'POST', 'route': '/api/visitor-counter/track', 'status': '200'}
+        requests_before = self._sample('visitor_counter_request_duration_seconds_count', labels)
+        queries_before = self._sample(
+            'visitor_counter_request_db_queries_sum', {'route': '/api/visitor-counter/track'}
+        )
+        commits_before = self._sample('visitor_counter_db_commits_total')
+        lock_waits_before = self._sample('visitor_counter_sqlite_write_lock_wait_seconds_count')
+        
+        assert client.post('/api/visitor-counter/track').status_code == 200
+        
+        assert self._sample('visitor_counter_request_duration_seconds_count', labels) == requests_before + 1
+        assert self._sample(
+            'visitor_counter_request_db_queries_sum', {'route': '/api/visitor-counter/track'}
+        ) > queries_before
+        assert self._sample('visitor_counter_db_commits_total') > commits_before
+        assert self._sample('visitor_counter_sqlite_write_lock_wait_seconds_count') > lock_waits_before
+    
+    def test_query_count_without_metrics(self):
+        """اختبار أن عدّ استعلامات الطلب يعمل مع METRICS_ENABLED=false دون تسجيل /metrics"""
+        from flask import Flask
+        from sqlalchemy import create_engine, text
+        from src.services.metrics import ServiceMetrics
+        engine = create_engine('sqlite://')
+        test_app = Flask(__name__)
+        test_app.config.update(METRICS_ENABLED=False, QUERY_COUNT_HEADER=True)
+        metrics = ServiceMetrics()
+        metrics.init_app(test_app, engine)
+        
+        @test_app.route('/query')
+        def query():
+            with engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+                conn.execute(text('SELECT 2'))
+            return 'ok'
+        
+        queries_before = self._sample('visitor_counter_db_queries_total')
+        test_client = test_app.test_client()
+        response = test_client.get('/query')
+        
+        assert metrics.enabled is False
+        assert response.headers['X-DB-Queries'] == '2'
+        assert float(response.headers['X-DB-Time-Ms']) >= 0
+        assert self._sample('visitor_counter_db_queries_total') == queries_before
+        assert test_client.get('/metrics').status_code == 404
+
+
+class TestASGIApp:
+    """اختبارات وضع ASGI الذي يخدم المسارات نفسها عبر مجمع خيوط محدود"""
+    
+    def _call(self, method, path, body_parts=(b'',)):
+        from src.asgi import ExecutorASGIApp
+        asgi_app = ExecutorASGIApp(app, max_workers=2)
+        messages = [
+            {'type': 'http.request', 'body': part, 'more_body': index < len(body_parts) - 1}
+            for index, part in enumerate(body_parts)
+        ]
+        sent = []
+        
+        async def receive():
+            return messages.pop(0)
+        
+        async def send(message):
+            sent.append(message)
+        
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': b'',
+            'headers': [(b'content-type', b'application/json'), (b'user-agent', b'asgi-test')],
+            'client': ('127.0.0.1', 5000),
+            'server': ('testserver', 80),
+        }
+        asyncio.run(asgi_app(scope, receive, send))
+        body = b''.join(message.get('body', b'') for message in sent[1:])
+        return sent[0], body, asgi_app
+    
+    def test_count_endpoint(self, client):
+        """اختبار خدمة /count عبر ASGI مع إرسال ملف تعريف الزائر"""
+        start, body, asgi_app = self._call('GET', '/api/visitor-counter/count')
+        
+        assert start['status'] == 200
+        assert any(name == b'set-cookie' and value.startswith(b'visitor_id=') for name, value in start['headers'])
+        assert json.loads(body)['success'] == True
+        assert asgi_app.stats()['in_flight'] == 0
+    
+    def test_stream_served_without_executor(self, client):
+        """اختبار أن البث يُخدم في حلقة asyncio وينتهي عند قطع العميل للاتصال"""
+        from src.asgi import ExecutorASGIApp
+        from src.services.count_stream import CountBroadcaster
+        broadcaster = CountBroadcaster()
+        broadcaster.publish(1500)
+        asgi_app = ExecutorASGIApp(app, max_workers=1, streams={'/stream': broadcaster})
+        sent = []
+        
+        async def receive():
+            await asyncio.sleep(0.05)
+            return {'type': 'http.disconnect'}
+        
+        async def send(message):
+            sent.append(message)
+        
+        scope = {'type': 'http', 'method': 'GET', 'path': '/stream', 'headers': []}
+        asyncio.run(asgi_app(scope, receive, send))
+        
+        assert sent[0]['status'] == 200
+        assert (b'content-type', b'text/event-stream; charset=utf-8') in sent[0]['headers']
+        assert any(b'"count": 1500' in message.get('body', b'') for message in sent[1:])
+        assert broadcaster.stats()['subscribers'] == 0
+    
+    def test_stream_sends_cors_headers(self, client):
+        """اختبار أن البث المباشر من الحلقة يرسل ترويسات CORS نفسها التي يرسلها Flask لأصل الطلب"""
+        from src.asgi import ExecutorASGIApp
+        from src.services.count_stream import CountBroadcaster
+        broadcaster = CountBroadcaster()
+        asgi_app = ExecutorASGIApp(app, max_workers=1, streams={'/stream': broadcaster})
+        origin = b'https://frontend.naebak.example'
+        sent = []
+        
+        async def receive():
+            await asyncio.sleep(0.01)
+            return {'type': 'http.disconnect'}
+        
+        async def send(message):
+            sent.append(message)
+        
+        scope = {'type': 'http', 'method': 'GET', 'path': '/stream', 'headers': [(b'origin', origin)]}
+        asyncio.run(asgi_app(scope, receive, send))
+        flask_headers = client.get('/health', headers={'Origin': origin.decode()}).headers
+        
+        headers = dict(sent[0]['headers'])
+        assert headers[b'access-control-allow-origin'] == origin
+        assert headers[b'access-control-allow-origin'].decode() == flask_headers['Access-Control-Allow-Origin']
+        assert headers[b'access-control-allow-credentials'].decode() == flask_headers['Access-Control-Allow-Credentials']
+        assert headers[b'vary'] == b'Origin'
+    
+    def test_body_received_in_parts(self, client):
+        """اختبار تجميع جسم الطلب المرسل على عدة رسائل قبل تنفيذه"""
+        payload = json.dumps({'events': [{'session_id': 'asgi_batch_session'}]}).encode()
+        start, body, _ = self._call('POST', '/api/visitor-counter/track/batch', (payload[:10], payload[10:]))
+        
+        assert start['status'] == 200
+        assert json.loads(body)['accepted'] == 1
+
+
+class TestExportAPI:
+    """اختبارات تصدير الجلسات والإحصائيات كملفات متدفقة"""
+    
+    def _add_sessions(self, prefix, month):
+        with app.app_context():
+            for index in range(5):
+                db.session.add(VisitorSession(
+                    session_id=f'{prefix}_{index}',
+                    first_visit=datetime(2001, month, 1 + index, 12),
+                    last_activity=datetime(2001, month, 1 + index, 13),
+                    page_views=index + 1
+                ))
+            db.session.commit()
+    
+    def test_export_sessions_csv_in_range(self, client):
+        """اختبار تصدير CSV مرشح على first_visit ضمن [from, to)"""
+        self._add_sessions('export_csv', 5)
+        response = client.get('/api/visitor-counter/admin/export/sessions?from=2001-05-02&to=2001-05-04')
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'text/csv'
+        assert response.headers['Content-Disposition'].startswith('attachment; filename="sessions-')
+        assert 'Content-Length' not in response.headers
+        lines = response.data.decode('utf-8').splitlines()
+        assert lines[0] == 'id,session_id,ip_address,user_agent,first_visit,last_activity,page_views,is_active'
+        assert [line.split(',')[1] for line in lines[1:]] == ['export_csv_1', 'export_csv_2']
+        assert lines[1].split(',')[4] == '2001-05-02T12:00:00'
+    
+    def test_export_stats_ndjson_gzip(self, client):
+        """اختبار تصدير NDJSON مضغوط بصيغة gzip"""
+        import gzip
+        from src.models.visitor_counter import VisitorStats
+        with app.app_context():
+            db.session.add(VisitorStats(date=datetime(2001, 6, 1).date(), unique_visitors=7, total_page_views=9))
+            db.session.commit()
+        
+        response = client.get('/api/visitor-counter/admin/export/stats?format=ndjson&from=2001-06-01&to=2001-06-02&gzip=true')
+        
+        assert response.status_code == 200
+        assert response.mimetype == 'application/gzip'
+        assert response.headers['Content-Disposition'].endswith('.ndjson.gz"')
+        rows = [json.loads(line) for line in gzip.decompress(response.data).decode('utf-8').splitlines()]
+        assert len(rows) == 1
+        assert rows[0]['date'] == '2001-06-01'
+        assert rows[0]['unique_visitors'] == 7
+        assert rows[0]['total_page_views'] == 9
+    
+    def test_export_validation(self, client):
+        """اختبار رفض الجدول أو الصيغة أو التاريخ غير الصحيح"""
+        assert client.get('/api/visitor-counter/admin/export/settings').status_code == 404
+        assert client.get('/api/visitor-counter/admin/export/sessions?format=xml').status_code == 400
+        assert client.get('/api/visitor-counter/admin/export/sessions?from=yesterday').status_code == 400
+    
+    def test_export_streamed_over_asgi(self, client):
+        """اختبار أن التصدير يُرسل عبر ASGI على أجزاء بحجم الدفعة بدلاً من جمعه كاملاً"""
+        from src.asgi import ExecutorASGIApp
+        self._add_sessions('export_asgi', 7)
+        asgi_app = ExecutorASGIApp(app, max_workers=1)
+        sent = []
+        
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        
+        async def send(message):
+            sent.append(message)
+        
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/api/visitor-counter/admin/export/sessions',
+            'query_string': b'format=ndjson&from=2001-07-01&to=2001-07-06',
+            'headers': []
+        }
+        previous = app.config['EXPORT_BATCH_SIZE']
+        app.config['EXPORT_BATCH_SIZE'] = 2
+        try:
+            asyncio.run(asgi_app(scope, receive, send))
+        finally:
+            app.config['EXPORT_BATCH_SIZE'] = previous
+        
+        assert sent[0]['status'] == 200
+        parts = [message['body'] for message in sent[1:] if message['body']]
+        assert len(parts) == 3
+        assert all(message['more_body'] for message in sent[1:-1])
+        assert len(b''.join(parts).splitlines()) == 5
+
+
 class TestAPIErrorHandling:
     """اختبارات معالجة الأخطاء في API"""
     
@@ -1,6 +1,8 @@
 import pytest
 from datetime import datetime, timedelta
 from src.models.visitor_counter import VisitorCounterSettings, VisitorSession, VisitorStats, db
+from src.models.migrations import run_migrations
+from src.models.sqlite_profile import build_engine_options
 from src.main import app
 
 class TestVisitorCounterSettings:
@@ -36,27 +38,19 @@ class TestVisitorCounterSettings:
             assert settings.min_base_count <= new_count <= settings.max_base_count
             assert settings.last_update > old_update_time
     
-    def test_should_update_true(self, client):
-        """اختبار أن العداد يحتاج للتحديث"""
-        with app.app_context():
-            settings = VisitorCounterSettings.query.first()
-            # تعديل وقت آخر تحديث ليكون قديماً
-            settings.last_update = datetime.utcnow() - timedelta(seconds=35)
-            settings.update_interval = 30
-            db.session.commit()
-            
-            assert settings.should_update() == True
-    
-    def test_should_update_false(self, client):
-        """اختبار أن العداد لا يحتاج للتحديث"""
-        with app.app_context():
-            settings = VisitorCounterSettings.query.first()
-            # تعديل وقت آخر تحديث ليكون حديثاً
-            settings.last_update = datetime.utcnow() - timedelta(seconds=10)
-            settings.update_interval = 30
-            db.session.commit()
-            
-            assert settings.should_update() == False
+    def test_compute_base_count_is_deterministic(self, client):
+        """اختبار أن الرقم الأساسي دالة بحتة في البذرة والفترة الزمنية"""
+        when = datetime(2024, 6, 1, 12, 0, 10)
+        first = VisitorCounterSettings(min_base_count=1000, max_base_count=1500, update_interval=30, base_seed=42)
+        second = VisitorCounterSettings(min_base_count=1000, max_base_count=1500, update_interval=30, base_seed=42)
+        
+        assert first.compute_base_count(when) == second.compute_base_count(when)
+        # نفس الفترة الزمنية تعطي نفس الرقم
+        assert first.compute_base_count(when) == first.compute_base_count(when + timedelta(seconds=15))
+        
+        values = {first.compute_base_count(when + timedelta(seconds=30 * i)) for i in range(50)}
+        assert len(values) > 1
+        assert all(1000 <= value <= 1500 for value in values)
     
     def test_to_dict(self, client):
         """اختبار تحويل الإعدادات إلى قاموس"""
@@ -172,3 +166,75 @@ class TestVisitorStats:
             assert 'unique_visitors' in data
             assert 'total_page_views' in data
             assert 'displayed_count' in data
+
+class TestSchemaMigrations:
+    """اختبارات ترحيلات مخطط قاعدة البيانات"""
+    
+    def test_visitor_sessions_indexes_exist(self, client):
+        """اختبار وجود فهارس الاستعلامات الساخنة على جدول الجلسات"""
+        with app.app_context():
+            index_names = {index['name'] for index in db.inspect(db.engine).get_indexes('visitor_sessions')}
+            
+            assert 'ix_visitor_sessions_active_last_activity' in index_names
+            assert 'ix_visitor_sessions_first_visit_page_views' in index_names
+    
+    def test_run_migrations_is_idempotent(self, client):
+        """اختبار أن إعادة تشغيل الترحيلات لا تطبق شيئاً جديداً"""
+        with app.app_context():
+            assert run_migrations() == []
+    
+    def test_settings_version_increments_on_update(self, client):
+        """اختبار أن عمود version يزداد مع كل تعديل للإعدادات"""
+        with app.app_context():
+            settings = VisitorCounterSettings.query.first()
+            version = settings.version
+            settings.update_interval = settings.update_interval
+            settings.updated_at = datetime.utcnow()
+            db.session.commit()
+            
+            assert settings.version == version + 1
+    
+    def test_active_visitors_query_uses_index(self, client):
+        """اختبار أن استعلام الزوار النشطين يستخدم الفهرس بدلاً من مسح الجدول"""
+        with app.app_context():
+            plan = db.session.execute(db.text(
+                'EXPLAIN QUERY PLAN SELECT count(id) FROM visitor_sessions '
+                'WHERE is_active = 1 AND last_activity >= :cutoff'
+            ), {'cutoff': datetime.utcnow()}).fetchall()
+            
+            details = ' '.join(str(row[-1]) for row in plan)
+            assert 'ix_visitor_sessions_active_last_activity' in details
+
+class TestSQLiteProfile:
+    """اختبارات ملف تعريف محرك SQLite"""
+    
+    def test_production_profile_pragmas(self, client):
+        """اختبار تطبيق pragmas ملف production على الاتصالات"""
+        with app.app_context():
+            if app.config['SQLITE_PROFILE'] != 'production':
+                pytest.skip('ملف التعريف المستخدم ليس production')
+            
+            journal_mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+            busy_timeout = db.session.execute(db.text('PRAGMA busy_timeout')).scalar()
+            synchronous = db.session.execute(db.text('PRAGMA synchronous')).scalar()
+            
+            assert journal_mode == 'wal'
+            assert busy_timeout == 5000
+            assert synchronous == 1  # NORMAL
+    
+    def test_build_engine_options(self):
+        """اختبار بناء خيارات المحرك حسب ملف التعريف ونوع قاعدة البيانات"""
+        options = build_engine_options('sqlite:////tmp/visitor.db', 'production', pool_size=16)
+        assert options['pool_size'] == 16
+        assert options['connect_args']['timeout'] == 5
+        
+        memory_options = build_engine_options('sqlite:///:memory:', 'production')
+        assert 'pool_size' not in memory_options
+        
+        assert build_engine_options('sqlite:////tmp/visitor.db', 'default') == {}
+        assert build_engine_options('postgresql://localhost/visitors', 'production') == {}
+    
+    def test_unknown_profile_rejected(self):
+        """اختبار رفض ملف تعريف غير معروف"""
+        with pytest.raises(ValueError):
+            build_engine_options('sqlite:////tmp/visitor.db', 'turbo')
@@ -289,3 +289,52 @@ class TestScalability:
         assert stats_time < 3.0  # أقل من 3 ثوان
         assert 'data' in data
         assert data['data']['active_visitors'] > 0
+
+class TestQueryBudgets:
+    """حدود عدد استعلامات SQL لكل نقطة نهاية (يفشل الاختبار عند تجاوزها)"""
+    
+    @pytest.mark.query_budget(8)
+    def test_count_budget(self, client, query_budget):
+        """اختبار /count: تتبع الزائر وتحديث اللقطة في الطلب الأول، ثم التتبع فقط"""
+        client.get('/api/visitor-counter/count')
+        client.get('/api/visitor-counter/count')
+        
+        assert query_budget[-1][2] <= 2
+    
+    @pytest.mark.query_budget(3)
+    def test_track_budget(self, client):
+        """اختبار /track: عبارة upsert واحدة وتحديث إحصائيات اليوم ومخطط الزوار المميزين للزائر الجديد"""
+        client.post('/api/visitor-counter/track')
+        client.post('/api/visitor-counter/track')
+    
+    @pytest.mark.query_budget(10)
+    def test_statistics_budget(self, client, query_budget):
+        """اختبار /statistics: بناء اللقطة في الطلب الأول، ثم قراءة صف اللقطة فقط"""
+        client.get('/api/visitor-counter/statistics')
+        client.get('/api/visitor-counter/statistics')
+        
+        assert query_budget[-1][2] <= 1
+    
+    @pytest.mark.query_budget(1)
+    def test_admin_settings_budget(self, client):
+        """اختبار /admin/settings: قراءة عمود version فقط من نسخة الإعدادات المخزنة"""
+        client.get('/api/visitor-counter/admin/settings')
+        client.get('/api/visitor-counter/health')
+    
+    @pytest.mark.query_budget(4)
+    def test_batch_budget(self, client):
+        """اختبار أن دفعة الزيارات لا يزيد عدد استعلاماتها مع عدد الأحداث"""
+        events = [{'session_id': f'budget_batch_{i}'} for i in range(200)]
+        client.post('/api/visitor-counter/track/batch', data=json.dumps({'events': events}), content_type='application/json')
+    
+    def test_query_count_header(self, client):
+        """اختبار ترويسات عدد الاستعلامات وزمنها عند تفعيلها"""
+        app.config['QUERY_COUNT_HEADER'] = True
+        try:
+            response = client.post('/api/visitor-counter/track')
+        finally:
+            app.config['QUERY_COUNT_HEADER'] = False
+        
+        assert int(response.headers['X-DB-Queries']) >= 1
+        assert float(response.headers['X-DB-Time-Ms']) >= 0
+        assert 'X-DB-Queries' not in client.post('/api/visitor-counter/track').headers
@@ -1,7 +1,21 @@
 import pytest
+import asyncio
+import socket
+import json
 from datetime import datetime, timedelta
 from unittest.mock import patch, MagicMock
 from src.services.visitor_service import VisitorCounterService
+from src.services.visitor_buffer import VisitorWriteBuffer, visitor_buffer
+from src.services.count_cache import DisplayedCountCache, displayed_count_cache
+from src.services.settings_cache import settings_cache
+from src.services.scheduler import PeriodicScheduler
+from src.services.count_stream import CountBroadcaster
+from src.services.active_window import ActiveVisitorWindow, active_visitor_window
+from src.services.hyperloglog import HyperLogLog, STANDARD_ERROR
+from src.models.partitions import SessionPartitions, session_partitions
+from src.services.visitor_id import TOKEN_LENGTH, VisitorId, visitor_id_cookie
+from src.services.rollups import compact_hourly, compact_monthly
+from src.services.counter_store import CounterStore, MemoryCounterBackend, RedisCounterBackend, counter_store
 from src.models.visitor_counter import VisitorCounterSettings, VisitorSession, VisitorStats, db
 from src.main import app
 
@@ -46,6 +60,25 @@ class TestVisitorCounterService:
             assert updated_settings.update_interval == 60
             assert 2000 <= updated_settings.current_base_count <= 3000
     
+    def test_update_settings_retries_concurrent_change(self, client):
+        """اختبار إعادة تطبيق التعديل على أحدث نسخة إذا عدّل عامل آخر الإعدادات بعد قراءتها"""
+        with app.app_context():
+            version = VisitorCounterService.get_or_create_settings().version
+            with db.engine.begin() as connection:
+                connection.execute(
+                    VisitorCounterSettings.__table__.update().values(
+                        version=VisitorCounterSettings.__table__.c.version + 1
+                    )
+                )
+            
+            with patch.object(settings_cache, 'invalidate', wraps=settings_cache.invalidate) as invalidate:
+                updated = VisitorCounterService.update_settings(min_count=2100, max_count=3100, interval=45)
+            
+            assert invalidate.call_count == 2
+            assert updated.version == version + 2
+            assert updated.min_base_count == 2100
+            assert VisitorCounterService.toggle_counter_status(True).is_active == True
+    
     def test_get_current_base_count_active(self, client):
         """اختبار الحصول على الرقم الأساسي عندما يكون العداد مفعلاً"""
         with app.app_context():
@@ -54,6 +87,33 @@ class TestVisitorCounterService:
             assert isinstance(base_count, int)
             assert base_count > 0
     
+    def test_get_current_base_count_is_write_free(self, client):
+        """اختبار أن قراءة الرقم الأساسي لا تكتب في قاعدة البيانات"""
+        with app.app_context():
+            VisitorCounterService.toggle_counter_status(True)
+            version = VisitorCounterSettings.query.first().version
+        
+        for _ in range(3):
+            with app.app_context():
+                base_count = VisitorCounterService.get_current_base_count()
+        
+        with app.app_context():
+            settings = VisitorCounterSettings.query.first()
+            
+            assert settings.version == version
+            assert settings.min_base_count <= base_count <= settings.max_base_count
+    
+    def test_reseed_base_count(self, client):
+        """اختبار أن إعادة التوليد تغيّر البذرة والرقم الظاهر"""
+        with app.app_context():
+            settings = VisitorCounterService.get_or_create_settings()
+            old_seed, old_count = settings.base_seed, settings.compute_base_count()
+            
+            settings = VisitorCounterService.reseed_base_count()
+            
+            assert settings.base_seed != old_seed
+            assert settings.compute_base_count() != old_count
+    
     def test_get_current_base_count_inactive(self, client):
         """اختبار الحصول على الرقم الأساسي عندما يكون العداد معطلاً"""
         with app.app_context():
@@ -81,7 +141,7 @@ class TestVisitorCounterService:
             session_id = VisitorCounterService.generate_session_id()
             
             assert isinstance(session_id, str)
-            assert len(session_id) == 32  # MD5 hash length
+            assert len(session_id) == 32  # 128 بت بترميز سداسي
     
     @patch('src.services.visitor_service.session')
     @patch('src.services.visitor_service.request')
@@ -230,3 +290,1201 @@ class TestVisitorCounterServiceEdgeCases:
             assert statistics['active_visitors'] == 0
             assert statistics['today_visitors'] == 0
             assert len(statistics['weekly_stats']) == 0
+
+class TestStatisticsSnapshot:
+    """اختبارات لقطة الإحصائيات المحسوبة مسبقاً"""
+    
+    def test_statistics_read_from_snapshot(self, client):
+        """اختبار أن الإحصائيات لا تتغير حتى يعيد المجدول بناء اللقطة"""
+        with app.app_context():
+            first = VisitorCounterService.get_visitor_statistics()
+            now = datetime.utcnow()
+            db.session.add(VisitorSession(session_id='snapshot_new_session', first_visit=now, last_activity=now))
+            db.session.commit()
+            
+            with patch.object(VisitorCounterService, 'get_active_visitors_count') as active_count:
+                cached = VisitorCounterService.get_visitor_statistics()
+                active_count.assert_not_called()
+            assert cached['generated_at'] == first['generated_at']
+            assert cached['today_visitors'] == first['today_visitors']
+            
+            refreshed = VisitorCounterService.refresh_statistics_snapshot()
+            assert refreshed['today_visitors'] == first['today_visitors'] + 1
+            assert VisitorCounterService.get_visitor_statistics()['generated_at'] == refreshed['generated_at']
+    
+    def test_stale_snapshot_rebuilt_without_scheduler(self, client):
+        """اختبار أن لقطة أقدم من ضعف فترة إعادة البناء لا تُعاد كما هي عندما لا يعمل المجدول"""
+        from src.models.visitor_counter import StatisticsSnapshot
+        from src.services.scheduler import scheduler
+        with app.app_context(), patch.dict(app.config, {'STATISTICS_SNAPSHOT_INTERVAL': 60}), \
+                patch.object(scheduler, 'enabled', False):
+            fresh = VisitorCounterService.refresh_statistics_snapshot()
+            old = datetime.utcnow() - timedelta(hours=3)
+            StatisticsSnapshot.store('default', json.dumps(dict(fresh, generated_at=old.isoformat())), old)
+            db.session.commit()
+            
+            statistics = VisitorCounterService.get_visitor_statistics()
+            
+            assert datetime.fromisoformat(statistics['generated_at']) > old + timedelta(hours=2)
+            stored = db.session.get(StatisticsSnapshot, 'default')
+            db.session.refresh(stored)
+            assert stored.generated_at > old + timedelta(hours=2)
+            assert VisitorCounterService.get_visitor_statistics()['generated_at'] == statistics['generated_at']
+    
+    def test_settings_change_invalidates_snapshot(self, client):
+        """اختبار أن تعديل الإعدادات يفرض إعادة بناء اللقطة"""
+        with app.app_context():
+            VisitorCounterService.get_visitor_statistics()
+            VisitorCounterService.update_settings(5000, 6000, 60)
+            
+            statistics = VisitorCounterService.get_visitor_statistics()
+            assert statistics['settings']['min_base_count'] == 5000
+            assert 5000 <= statistics['base_count'] <= 6000
+
+class TestRollups:
+    """اختبارات جداول التجميع الساعية والشهرية"""
+    
+    def _add_sessions(self):
+        db.session.add_all([
+            VisitorSession(session_id='rollup_a', first_visit=datetime(2003, 3, 1, 10, 5), last_activity=datetime(2003, 3, 1, 10, 5), page_views=2),
+            VisitorSession(session_id='rollup_b', first_visit=datetime(2003, 3, 1, 10, 40), last_activity=datetime(2003, 3, 1, 11, 0), page_views=3),
+            VisitorSession(session_id='rollup_c', first_visit=datetime(2003, 3, 1, 12, 15), last_activity=datetime(2003, 3, 1, 12, 15), page_views=1),
+        ])
+        db.session.commit()
+    
+    def test_compact_hourly_from_sessions(self, client):
+        """اختبار تجميع الجلسات حسب ساعة أول زيارة، وأن إعادة التجميع متكررة النتيجة"""
+        with app.app_context():
+            self._add_sessions()
+            for _ in range(2):
+                compact_hourly(datetime(2003, 3, 1), datetime(2003, 3, 2))
+                db.session.commit()
+            
+            result = VisitorCounterService.get_statistics_range(datetime(2003, 3, 1), datetime(2003, 3, 1, 23), 'hour')
+            assert [(point['period'], point['unique_visitors'], point['total_page_views']) for point in result['points']] == [
+                ('2003-03-01T10:00:00', 2, 5),
+                ('2003-03-01T12:00:00', 1, 1),
+            ]
+            assert result['totals'] == {'unique_visitors': 3, 'total_page_views': 6}
+    
+    def test_compact_monthly_from_daily_stats(self, client):
+        """اختبار تجميع الإحصائيات اليومية في صفوف شهرية"""
+        with app.app_context():
+            VisitorStats.record_activity(datetime(2003, 4, 2).date(), new_visitors=4, page_views=10)
+            VisitorStats.record_activity(datetime(2003, 4, 20).date(), new_visitors=1, page_views=2)
+            VisitorStats.record_activity(datetime(2003, 5, 1).date(), new_visitors=7, page_views=7)
+            compact_monthly(datetime(2003, 4, 1).date(), datetime(2003, 5, 31).date())
+            db.session.commit()
+            
+            result = VisitorCounterService.get_statistics_range(datetime(2003, 1, 1), datetime(2003, 12, 31), 'month')
+            assert [(point['period'], point['unique_visitors']) for point in result['points']] == [
+                ('2003-04', 5), ('2003-05', 7)
+            ]
+            
+            daily = VisitorCounterService.get_statistics_range(datetime(2003, 4, 1), datetime(2003, 4, 30), 'day')
+            assert [point['period'] for point in daily['points']] == ['2003-04-02', '2003-04-20']
+    
+    def test_compact_rollups_job(self, client):
+        """اختبار أن المهمة الدورية تجمع الساعات الأخيرة"""
+        with app.test_request_context('/api/visitor-counter/track'):
+            VisitorCounterService.track_visitor()
+            result = VisitorCounterService.compact_rollups(hours=2)
+            
+            assert result['hours'] >= 1
+            now = datetime.utcnow()
+            points = VisitorCounterService.get_statistics_range(now, now, 'hour')['points']
+            assert points and points[0]['unique_visitors'] >= 1
+
+class TestSessionCleanup:
+    """اختبارات تنظيف الجلسات على دفعات والمجدول الدوري"""
+    
+    def _add_sessions(self, prefix, count, last_activity, is_active=True):
+        db.session.add_all([
+            VisitorSession(
+                session_id=f'{prefix}_{i}',
+                first_visit=last_activity,
+                last_activity=last_activity,
+                is_active=is_active
+            )
+            for i in range(count)
+        ])
+        db.session.commit()
+    
+    def test_cleanup_in_chunks(self, client):
+        """اختبار إلغاء تفعيل كل الجلسات القديمة عبر عدة دفعات"""
+        with app.app_context():
+            self._add_sessions('chunked_stale', 5, datetime.utcnow() - timedelta(hours=30))
+            self._add_sessions('chunked_fresh', 2, datetime.utcnow())
+            
+            cleaned = VisitorCounterService.cleanup_old_sessions(batch_size=2)
+            
+            assert cleaned >= 5
+            assert VisitorSession.query.filter(
+                VisitorSession.session_id.like('chunked_stale_%'),
+                VisitorSession.is_active == True
+            ).count() == 0
+            assert VisitorSession.query.filter(
+                VisitorSession.session_id.like('chunked_fresh_%'),
+                VisitorSession.is_active == True
+            ).count() == 2
+    
+    def test_purge_respects_retention(self, client):
+        """اختبار حذف الجلسات غير النشطة الأقدم من فترة الاحتفاظ فقط"""
+        with app.app_context():
+            self._add_sessions('purge_expired', 3, datetime.utcnow() - timedelta(days=40), is_active=False)
+            self._add_sessions('purge_recent', 2, datetime.utcnow() - timedelta(days=5), is_active=False)
+            
+            assert VisitorCounterService.purge_expired_sessions(retention_days=0) == 0
+            deleted = VisitorCounterService.purge_expired_sessions(retention_days=30, batch_size=2)
+            
+            assert deleted >= 3
+            assert VisitorSession.query.filter(VisitorSession.session_id.like('purge_expired_%')).count() == 0
+            assert VisitorSession.query.filter(VisitorSession.session_id.like('purge_recent_%')).count() == 2
+    
+    def test_scheduler_runs_job_once_per_interval(self, client):
+        """اختبار أن عاملين لا ينفذان المهمة نفسها في الفترة نفسها"""
+        calls = []
+        first_worker, second_worker = PeriodicScheduler(), PeriodicScheduler()
+        for worker in (first_worker, second_worker):
+            worker.app = app
+            worker.add_job('test-scheduler-job', 3600, lambda: calls.append(1))
+        
+        assert first_worker.run_pending() == ['test-scheduler-job']
+        assert second_worker.run_pending() == []
+        assert len(calls) == 1
+    
+    def test_cleanup_sessions_command(self, client):
+        """اختبار أمر سطر الأوامر لتنظيف الجلسات"""
+        result = app.test_cli_runner().invoke(args=['cleanup-sessions', '--batch-size', '100'])
+        
+        assert result.exit_code == 0
+        assert 'جلسة' in result.output
+
+class TestSessionPartitions:
+    """اختبارات تقسيم جدول الجلسات إلى جداول يومية"""
+    
+    @pytest.fixture
+    def daily_partitions(self):
+        with patch.object(session_partitions, 'granularity', 'day'):
+            yield session_partitions
+            with app.app_context():
+                session_partitions.drop_before(datetime.utcnow().date() + timedelta(days=2))
+    
+    def test_init_app_rejects_unknown_mode(self):
+        """اختبار رفض نمط تقسيم غير معروف"""
+        fake_app = MagicMock(config={'SESSION_PARTITIONING': 'hourly'}, extensions={})
+        with pytest.raises(ValueError):
+            SessionPartitions().init_app(fake_app)
+    
+    def test_week_partition_key(self):
+        """اختبار أن مفتاح الفترة الأسبوعية هو يوم الاثنين"""
+        partitions = SessionPartitions()
+        partitions.granularity = 'week'
+        
+        assert partitions.partition_key(datetime(2024, 1, 18, 15)) == datetime(2024, 1, 15).date()
+    
+    def test_track_visitor_writes_to_current_partition(self, client, daily_partitions):
+        """اختبار تسجيل الزيارة في جدول اليوم وعدّها في الإحصائيات"""
+        with app.test_request_context(headers={'User-Agent': 'partition-test'}):
+            before = VisitorCounterService.get_total_visitors_today()
+            result = VisitorCounterService.track_visitor()
+            table = daily_partitions.ensure_table(datetime.utcnow())
+            
+            row = db.session.execute(
+                table.select().where(table.c.session_id == result.session_id)
+            ).one()
+            assert row.page_views == 1
+            assert VisitorSession.query.filter_by(session_id=result.session_id).count() == 0
+            assert VisitorCounterService.get_total_visitors_today() == before + 1
+    
+    def test_tables_only_cover_range(self, client, daily_partitions):
+        """اختبار توجيه الاستعلام إلى جداول الفترات التي يلمسها النطاق فقط"""
+        with app.app_context():
+            today = datetime.utcnow().date()
+            old = daily_partitions.ensure_table(datetime.utcnow() - timedelta(days=3))
+            current = daily_partitions.ensure_table(datetime.utcnow())
+            db.session.commit()
+            
+            names = [table.name for table in daily_partitions.tables(today, today + timedelta(days=1))]
+            assert current.name in names
+            assert old.name not in names
+    
+    def test_out_of_order_batch_moves_partition(self, client, daily_partitions):
+        """اختبار نقل الجلسة إلى جدول فترة أول زيارتها عندما تصل زيارة أقدم لاحقاً"""
+        now = datetime.utcnow().replace(microsecond=0)
+        earlier = now - timedelta(days=2)
+        with app.app_context():
+            VisitorCounterService.track_visitor_batch([{'session_id': 'partition_move', 'timestamp': now.isoformat()}])
+            result = VisitorCounterService.track_visitor_batch([{'session_id': 'partition_move', 'timestamp': earlier.isoformat()}])
+            
+            assert result['updated_sessions'] == 1
+            assert result['new_sessions'] == 0
+            current = daily_partitions.ensure_table(now)
+            old = daily_partitions.ensure_table(earlier)
+            assert db.session.execute(current.select().where(current.c.session_id == 'partition_move')).first() is None
+            row = db.session.execute(old.select().where(old.c.session_id == 'partition_move')).one()
+            assert row.first_visit == earlier
+            assert row.page_views == 2
+    
+    def test_retention_drops_partitions(self, client, daily_partitions):
+        """اختبار أن الاحتفاظ يحذف جداول الفترات القديمة كاملة"""
+        with app.app_context():
+            old = daily_partitions.ensure_table(datetime.utcnow() - timedelta(days=40))
+            current = daily_partitions.ensure_table(datetime.utcnow())
+            db.session.commit()
+            
+            dropped = VisitorCounterService.purge_expired_sessions(retention_days=30)
+            
+            keys = daily_partitions.keys()
+            assert dropped >= 1
+            assert daily_partitions.partition_key(datetime.utcnow() - timedelta(days=40)) not in keys
+            assert daily_partitions.partition_key(datetime.utcnow()) in keys
+
+    def test_partition_keys_cached_between_visits(self, client, daily_partitions):
+        """اختبار أن قائمة الجداول تُقرأ من sqlite_master مرة واحدة وتُعاد قراءتها بعد إلغاء معاملة أنشأت جدولاً أو بعد الحذف"""
+        from sqlalchemy import event
+        statements = []
+        
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        with app.app_context():
+            daily_partitions.ensure_table(datetime.utcnow())
+            db.session.commit()
+            daily_partitions.keys()
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            for _ in range(3):
+                with app.app_context():
+                    daily_partitions.ensure_table(datetime.utcnow())
+                    daily_partitions.table_for_visit('partition_cache', datetime.utcnow(), datetime.utcnow())
+            assert not [statement for statement in statements if 'sqlite_master' in statement]
+            assert len([statement for statement in statements if 'schema_version' in statement]) == 3
+            
+            with app.app_context():
+                old_day = datetime.utcnow() - timedelta(days=50)
+                daily_partitions.ensure_table(old_day)
+                assert daily_partitions.partition_key(old_day) in daily_partitions.keys()
+                db.session.rollback()
+                statements.clear()
+                daily_partitions.keys()
+                assert [statement for statement in statements if 'sqlite_master' in statement]
+                
+                daily_partitions.ensure_table(old_day)
+                db.session.commit()
+                daily_partitions.drop_before((old_day + timedelta(days=1)).date())
+                assert daily_partitions.partition_key(old_day) not in daily_partitions.keys()
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+    
+    def test_partition_dropped_by_another_worker(self, client, daily_partitions):
+        """اختبار أن حذف جدول فترة من اتصال آخر لا يترك قائمة الجداول المخزنة تشير إليه"""
+        from sqlalchemy import text
+        old_day = datetime.utcnow() - timedelta(days=45)
+        with app.app_context():
+            old = daily_partitions.ensure_table(old_day)
+            db.session.commit()
+        with app.app_context():
+            assert daily_partitions.partition_key(old_day) in daily_partitions.keys()
+            VisitorCounterService.get_active_visitors_count()
+        
+        # عامل آخر يحذف الجدول على اتصاله الخاص بينما قائمة هذا العامل مخزنة
+        with app.app_context(), db.engine.begin() as connection:
+            connection.execute(text(f'DROP TABLE {old.name}'))
+        
+        with app.app_context():
+            assert daily_partitions.partition_key(old_day) not in daily_partitions.keys()
+            assert VisitorCounterService.get_active_visitors_count() >= 0
+    
+    def test_export_reads_all_partitions(self, client, daily_partitions):
+        """اختبار أن تصدير الجلسات يمر على جداول الفترات ضمن النطاق بترتيب أول زيارة"""
+        from src.services.export import iter_export
+        now = datetime.utcnow().replace(microsecond=0)
+        with app.app_context():
+            for offset, session_id in ((3, 'export_part_old'), (0, 'export_part_new')):
+                visit = now - timedelta(days=offset)
+                table = daily_partitions.ensure_table(visit)
+                db.session.execute(table.insert().values(
+                    session_id=session_id, first_visit=visit, last_activity=visit, page_views=1, is_active=True
+                ))
+            db.session.commit()
+            
+            body = b''.join(iter_export('sessions', 'csv', now - timedelta(days=4), now + timedelta(seconds=1)))
+        
+        session_ids = [line.split(',')[1] for line in body.decode('utf-8').splitlines()[1:]]
+        assert session_ids == ['export_part_old', 'export_part_new']
+
+
+class TestVisitorWriteBuffer:
+    """اختبارات المخزن المؤقت للكتابة المؤجلة"""
+    
+    def test_add_does_not_write_until_flush(self, client):
+        """اختبار أن الأحداث تبقى في الذاكرة حتى التفريغ"""
+        buffer = VisitorWriteBuffer()
+        buffer.app = app
+        
+        buffer.add('buffer_session_a', '10.1.0.1', 'Buffer Browser')
+        buffer.add('buffer_session_a', '10.1.0.1', 'Buffer Browser')
+        buffer.add('buffer_session_b', '10.1.0.2', 'Buffer Browser')
+        
+        assert buffer.pending_count() == 3
+        with app.app_context():
+            assert VisitorSession.query.filter_by(session_id='buffer_session_a').first() is None
+        
+        written = buffer.flush()
+        
+        assert written == 3
+        assert buffer.pending_count() == 0
+        with app.app_context():
+            session_a = VisitorSession.query.filter_by(session_id='buffer_session_a').first()
+            session_b = VisitorSession.query.filter_by(session_id='buffer_session_b').first()
+            assert session_a.page_views == 2
+            assert session_b.page_views == 1
+    
+    def test_flush_merges_into_existing_session(self, client):
+        """اختبار دمج المشاهدات المؤجلة مع جلسة موجودة"""
+        with app.app_context():
+            db.session.add(VisitorSession(session_id='buffer_existing', page_views=4))
+            db.session.commit()
+        
+        buffer = VisitorWriteBuffer()
+        buffer.app = app
+        buffer.add('buffer_existing', '10.1.0.3', 'Buffer Browser')
+        buffer.add('buffer_existing', '10.1.0.3', 'Buffer Browser')
+        buffer.flush()
+        
+        with app.app_context():
+            visitor_session = VisitorSession.query.filter_by(session_id='buffer_existing').first()
+            assert visitor_session.page_views == 6
+    
+    def test_size_trigger_flushes(self, client):
+        """اختبار التفريغ التلقائي عند بلوغ الحجم الأقصى"""
+        buffer = VisitorWriteBuffer()
+        buffer.app = app
+        buffer.max_size = 2
+        
+        buffer.add('buffer_size_1', '10.1.0.4', 'Buffer Browser')
+        assert buffer.pending_count() == 1
+        buffer.add('buffer_size_2', '10.1.0.5', 'Buffer Browser')
+        
+        assert buffer.pending_count() == 0
+        with app.app_context():
+            assert VisitorSession.query.filter_by(session_id='buffer_size_2').first() is not None
+    
+    def test_failed_flushes_are_capped(self, client):
+        """اختبار أن فشل الكتابة المتكرر لا ينمي المخزن بلا حد ولا يصل خطؤه إلى طلب التتبع"""
+        buffer = VisitorWriteBuffer()
+        buffer.app = app
+        buffer.max_size = 3
+        buffer.max_pending = 3
+        
+        with patch('src.services.visitor_buffer.write_visit_batch', side_effect=RuntimeError('database is locked')):
+            for index in range(3):
+                buffer.add(f'buffer_capped_{index}', '10.1.0.7', 'Buffer Browser')
+            buffer.add('buffer_capped_0', '10.1.0.7', 'Buffer Browser')
+            buffer.add('buffer_capped_4', '10.1.0.7', 'Buffer Browser')
+        
+        assert buffer.pending_count() == 4
+        assert buffer.dropped == 1
+        assert buffer.flush() == 4
+        with app.app_context():
+            assert VisitorSession.query.filter_by(session_id='buffer_capped_0').one().page_views == 2
+            assert VisitorSession.query.filter_by(session_id='buffer_capped_4').first() is None
+    
+    def test_buffered_returning_visitor_keeps_first_seen(self, client):
+        """اختبار أن الزائر العائد الذي حُذفت جلسته يُكتب بوقت أول زيارته ولا يُحتسب جديداً كما في الكتابة الفورية"""
+        first_seen = datetime(2004, 2, 3, 10)
+        now = datetime.utcnow()
+        buffer = VisitorWriteBuffer()
+        buffer.app = app
+        with app.app_context():
+            before = VisitorStats.query.filter_by(date=now.date()).first()
+            before = before.unique_visitors if before else 0
+        
+        buffer.add('buffer_returning', '10.1.0.8', 'Buffer Browser', now, first_seen=first_seen)
+        buffer.flush()
+        
+        with app.app_context():
+            stored = VisitorSession.query.filter_by(session_id='buffer_returning').one()
+            assert stored.first_visit == first_seen
+            today = VisitorStats.query.filter_by(date=now.date()).first()
+            assert (today.unique_visitors if today else 0) == before
+    
+    def test_track_visitor_buffered_passes_first_seen(self, client):
+        """اختبار أن التتبع المؤجل يمرر وقت أول زيارة الزائر العائد من ملف التعريف"""
+        first_seen = datetime(2004, 2, 4, 10)
+        with patch.object(visitor_buffer, 'enabled', True), patch.object(visitor_buffer, 'add') as add:
+            token = visitor_id_cookie.encode(visitor_id_cookie.new_id(first_seen))
+            with app.test_request_context(
+                '/api/visitor-counter/track', headers={'Cookie': f'visitor_id={token}'}
+            ):
+                VisitorCounterService.track_visitor()
+        
+        assert add.call_args.kwargs['first_seen'] == first_seen
+    
+    def test_track_visitor_buffered_mode(self, client):
+        """اختبار أن تتبع الزائر في الوضع المؤجل لا يكتب في قاعدة البيانات"""
+        with patch.object(visitor_buffer, 'enabled', True), patch.object(visitor_buffer, 'app', app):
+            with app.test_request_context('/api/visitor-counter/track', environ_base={'REMOTE_ADDR': '10.1.0.6'}):
+                from flask import session
+                session['visitor_session_id'] = 'buffer_tracked'
+                visitor_session = VisitorCounterService.track_visitor()
+                
+                assert visitor_session.session_id == 'buffer_tracked'
+                assert visitor_buffer.pending_count() == 1
+                assert VisitorSession.query.filter_by(session_id='buffer_tracked').first() is None
+            
+            visitor_buffer.flush()
+        
+        with app.app_context():
+            assert VisitorSession.query.filter_by(session_id='buffer_tracked').first() is not None
+
+class TestDisplayedCountCache:
+    """اختبارات لقطة العدد المعروض المخزنة مؤقتاً"""
+    
+    def test_snapshot_refreshed_once_per_ttl(self):
+        """اختبار أن اللقطة لا تُحدَّث إلا بعد انتهاء صلاحيتها"""
+        cache = DisplayedCountCache()
+        loader = MagicMock(return_value={'base_count': 1000, 'active_visitors': 5})
+        
+        for _ in range(5):
+            snapshot = cache.get(60, loader)
+        
+        assert snapshot['base_count'] == 1000
+        assert loader.call_count == 1
+        stats = cache.stats()
+        assert stats['hits'] == 4
+        assert stats['misses'] == 1
+        assert stats['refreshes'] == 1
+    
+    def test_expired_snapshot_is_reloaded(self):
+        """اختبار إعادة التحميل عند انتهاء الصلاحية"""
+        cache = DisplayedCountCache()
+        loader = MagicMock(return_value={'base_count': 1000, 'active_visitors': 0})
+        
+        cache.get(0, loader)
+        cache.get(0, loader)
+        
+        assert loader.call_count == 2
+    
+    def test_concurrent_waiters_share_one_refresh(self):
+        """اختبار أن الخيوط المنتظرة أثناء التحديث تُحتسب إخفاقات دون تحديث إضافي"""
+        import threading
+        import time
+        cache = DisplayedCountCache()
+        started = threading.Event()
+        
+        def loader():
+            started.set()
+            time.sleep(0.1)
+            return {'base_count': 1000, 'active_visitors': 0}
+        
+        first = threading.Thread(target=cache.get, args=(60, loader))
+        first.start()
+        started.wait()
+        second = threading.Thread(target=cache.get, args=(60, loader))
+        second.start()
+        first.join()
+        second.join()
+        
+        stats = cache.stats()
+        assert stats['misses'] == 2
+        assert stats['refreshes'] == 1
+    
+    def test_update_settings_invalidates_snapshot(self, client):
+        """اختبار أن تحديث الإعدادات يلغي اللقطة الحالية"""
+        with app.app_context(), patch.dict(app.config, {'VISITOR_COUNT_CACHE_TTL': 60}):
+            VisitorCounterService.toggle_counter_status(True)
+            VisitorCounterService.get_cached_visitor_count()
+            refreshes = displayed_count_cache.stats()['refreshes']
+            
+            VisitorCounterService.update_settings(min_count=5000, max_count=6000, interval=30)
+            count = VisitorCounterService.get_cached_visitor_count()
+            
+            assert count >= 5000
+            assert displayed_count_cache.stats()['refreshes'] == refreshes + 1
+
+class TestCountBroadcaster:
+    """اختبارات بث العدد المعروض للمشتركين"""
+    
+    def test_publish_only_on_change(self):
+        """اختبار أن العدد نفسه لا يُنشر مرتين"""
+        broadcaster = CountBroadcaster()
+        
+        assert broadcaster.publish(1200) == True
+        assert broadcaster.publish(1200) == False
+        assert broadcaster.publish(1201) == True
+        assert broadcaster.stats()['published'] == 2
+    
+    def test_sync_subscriber_receives_latest_count(self):
+        """اختبار أن المشترك يتلقى آخر عدد ثم رسالة إبقاء الاتصال عند عدم التغير"""
+        broadcaster = CountBroadcaster()
+        broadcaster.keepalive = 0.01
+        broadcaster.publish(1300)
+        events = broadcaster.events()
+        
+        assert next(events).startswith(b'retry:')
+        assert b'"count": 1300' in next(events)
+        assert next(events) == b': keepalive\n\n'
+        assert broadcaster.stats()['subscribers'] == 1
+        events.close()
+        assert broadcaster.stats()['subscribers'] == 0
+    
+    def test_async_subscribers_share_one_publish(self):
+        """اختبار أن نشراً واحداً يصل إلى كل مشتركي asyncio"""
+        broadcaster = CountBroadcaster()
+        
+        async def scenario():
+            streams = [broadcaster.async_events() for _ in range(3)]
+            for stream in streams:
+                await stream.__anext__()
+            pending = [asyncio.ensure_future(stream.__anext__()) for stream in streams]
+            await asyncio.sleep(0)
+            broadcaster.publish(1400)
+            received = await asyncio.gather(*pending)
+            for stream in streams:
+                await stream.aclose()
+            return received
+        
+        received = asyncio.run(scenario())
+        
+        assert all(b'"count": 1400' in chunk for chunk in received)
+        assert broadcaster.stats()['subscribers'] == 0
+    
+    def test_poll_once_reads_displayed_count(self, client):
+        """اختبار أن المنتج يقرأ العدد المعروض من الخدمة"""
+        broadcaster = CountBroadcaster()
+        broadcaster.app = app
+        
+        assert broadcaster.poll_once() == True
+        assert broadcaster.stats()['count'] >= 1000
+
+
+class TestSettingsCache:
+    """اختبارات نسخة الإعدادات المخزنة في ذاكرة العامل"""
+    
+    def test_repeated_reads_use_cached_row(self, client):
+        """اختبار أن القراءات المتكررة بنفس الإصدار لا تعيد تحميل الصف"""
+        with app.app_context():
+            VisitorCounterService.get_or_create_settings()
+        
+        hits_before = settings_cache.stats()['hits']
+        for _ in range(3):
+            with app.app_context():
+                VisitorCounterService.get_or_create_settings()
+        
+        assert settings_cache.stats()['hits'] == hits_before + 3
+    
+    def test_same_request_reuses_settings(self, client):
+        """اختبار أن الطلب الواحد يحصل على الكائن نفسه دون استعلامات إضافية"""
+        with app.app_context():
+            first = VisitorCounterService.get_or_create_settings()
+            second = VisitorCounterService.get_or_create_settings()
+            
+            assert first is second
+    
+    def test_write_from_other_worker_is_picked_up(self, client):
+        """اختبار أن تعديلاً من عامل آخر يُكتشف عبر تغير الإصدار"""
+        with app.app_context():
+            settings = VisitorCounterService.get_or_create_settings()
+            interval = settings.update_interval + 7
+            # محاكاة عامل آخر يكتب مباشرة في قاعدة البيانات
+            db.session.execute(db.text(
+                'UPDATE visitor_counter_settings SET update_interval = :interval, version = version + 1'
+            ), {'interval': interval})
+            db.session.commit()
+        
+        with app.app_context():
+            assert VisitorCounterService.get_or_create_settings().update_interval == interval
+    
+    def test_update_settings_invalidates_cache(self, client):
+        """اختبار أن تحديث الإعدادات من الخدمة يظهر فوراً"""
+        with app.app_context():
+            VisitorCounterService.update_settings(1200, 1300, 45)
+        
+        with app.app_context():
+            settings = VisitorCounterService.get_or_create_settings()
+            
+            assert settings.min_base_count == 1200
+            assert settings.update_interval == 45
+
+class TestIncrementalDailyStats:
+    """اختبارات التحديث التراكمي للإحصائيات اليومية"""
+    
+    def _today_stats(self):
+        stats = VisitorStats.query.filter_by(date=datetime.utcnow().date()).first()
+        return (stats.unique_visitors, stats.total_page_views) if stats else (0, 0)
+    
+    def test_track_visitor_updates_daily_stats(self, client):
+        """اختبار أن تتبع زائر جديد ثم عودته يحدّث إحصائيات اليوم دون إعادة حساب"""
+        with app.test_request_context('/api/visitor-counter/track'):
+            from flask import session
+            session['visitor_session_id'] = 'incremental_stats_session'
+            visitors_before, views_before = self._today_stats()
+            
+            VisitorCounterService.track_visitor()
+            VisitorCounterService.track_visitor()
+            
+            visitors_after, views_after = self._today_stats()
+            assert visitors_after == visitors_before + 1
+            assert views_after == views_before + 2
+    
+    def test_buffer_flush_updates_daily_stats(self, client):
+        """اختبار أن تفريغ المخزن المؤقت يحدّث الإحصائيات اليومية"""
+        with app.app_context():
+            visitors_before, views_before = self._today_stats()
+        
+        buffer = VisitorWriteBuffer()
+        buffer.app = app
+        buffer.add('incremental_buffer_1', '10.2.0.1', 'Stats Browser')
+        buffer.add('incremental_buffer_1', '10.2.0.1', 'Stats Browser')
+        buffer.add('incremental_buffer_2', '10.2.0.2', 'Stats Browser')
+        buffer.flush()
+        
+        with app.app_context():
+            visitors_after, views_after = self._today_stats()
+            assert visitors_after == visitors_before + 2
+            assert views_after == views_before + 3
+    
+    def test_out_of_order_batch_moves_first_visit(self, client):
+        """اختبار أن زيارة أقدم تصل لاحقاً تنقل أول زيارة الجلسة وعدّها إلى يومها"""
+        later, earlier = datetime(2004, 5, 10, 12), datetime(2004, 5, 8, 9)
+        with app.app_context():
+            VisitorCounterService.track_visitor_batch([{'session_id': 'out_of_order', 'timestamp': later.isoformat()}])
+            VisitorCounterService.track_visitor_batch([{'session_id': 'out_of_order', 'timestamp': earlier.isoformat()}])
+            
+            session = VisitorSession.query.filter_by(session_id='out_of_order').one()
+            assert session.first_visit == earlier
+            assert session.last_activity == later
+            assert session.page_views == 2
+            later_stats = VisitorStats.query.filter_by(date=later.date()).one()
+            earlier_stats = VisitorStats.query.filter_by(date=earlier.date()).one()
+            assert (later_stats.unique_visitors, later_stats.total_page_views) == (0, 0)
+            assert (earlier_stats.unique_visitors, earlier_stats.total_page_views) == (1, 2)
+    
+    def test_batch_timestamp_column_validation(self, client):
+        """اختبار تحليل عمود الطوابع الزمنية مرة واحدة لكل قيمة مع رفض القيم غير الصحيحة"""
+        now = datetime(2004, 1, 1)
+        column = VisitorCounterService.parse_timestamp_column(
+            ['2004-01-02T00:00:00Z', True, 1, None, 'yesterday', '2004-01-02T00:00:00Z'], now
+        )
+        
+        assert column == [datetime(2004, 1, 2), None, datetime(1970, 1, 1, 0, 0, 1), now, None, datetime(2004, 1, 2)]
+    
+    def test_rebuild_daily_stats(self, client):
+        """اختبار إعادة حساب إحصائيات يوم سابق بدقة"""
+        day = datetime(2001, 3, 15)
+        with app.app_context(), patch.dict(app.config, {'SESSION_RETENTION_DAYS': 0}):
+            db.session.add_all([
+                VisitorSession(session_id='rebuild_session_1', first_visit=day, last_activity=day, page_views=3),
+                VisitorSession(session_id='rebuild_session_2', first_visit=day + timedelta(hours=23), last_activity=day, page_views=2),
+                VisitorSession(session_id='rebuild_session_3', first_visit=day + timedelta(days=1), last_activity=day, page_views=7)
+            ])
+            db.session.commit()
+            
+            stats = VisitorCounterService.rebuild_daily_stats(day.date())
+            
+            assert stats.unique_visitors == 2
+            assert stats.total_page_views == 5
+    
+    def test_rebuild_refuses_days_past_retention(self, client):
+        """اختبار أن إعادة حساب يوم حُذفت جلساته لا تمحو إحصائياته المحفوظة"""
+        day = datetime(2001, 4, 20).date()
+        with app.app_context(), patch.dict(app.config, {'SESSION_RETENTION_DAYS': 30}):
+            VisitorStats.record_activity(day, new_visitors=12, page_views=40)
+            db.session.commit()
+            
+            with pytest.raises(ValueError):
+                VisitorCounterService.rebuild_daily_stats(day)
+            result = app.test_cli_runner().invoke(args=['rebuild-stats', '--date', day.isoformat()])
+            
+            assert result.exit_code == 0
+            assert 'تم التخطي' in result.output
+            stats = VisitorStats.query.filter_by(date=day).one()
+            assert (stats.unique_visitors, stats.total_page_views) == (12, 40)
+    
+    def test_rebuild_stats_command(self, client):
+        """اختبار أمر سطر الأوامر لإعادة حساب الإحصائيات"""
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['rebuild-stats', '--date', '2001-03-10', '--days', '2'])
+        
+        assert result.exit_code == 0
+        assert '2001-03-09' in result.output
+        assert '2001-03-10' in result.output
+    
+    def test_export_data_command(self, client, tmp_path):
+        """اختبار أمر تصدير الإحصائيات اليومية إلى ملف"""
+        with app.app_context():
+            db.session.add(VisitorStats(date=datetime(2001, 8, 1).date(), unique_visitors=4, total_page_views=6))
+            db.session.commit()
+        output = tmp_path / 'stats.csv'
+        
+        result = app.test_cli_runner().invoke(args=[
+            'export-data', 'stats', '--from', '2001-08-01', '--to', '2001-08-02', '--output', str(output)
+        ])
+        
+        assert result.exit_code == 0
+        lines = output.read_text(encoding='utf-8').splitlines()
+        assert lines[0].startswith('id,date,unique_visitors,total_page_views')
+        assert len(lines) == 2
+        assert ',2001-08-01,4,6,' in lines[1]
+    
+    def test_rebuild_stats_command_invalid_date(self, client):
+        """اختبار رفض تاريخ بصيغة غير صحيحة"""
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=['rebuild-stats', '--date', '10-03-2001'])
+        
+        assert result.exit_code != 0
+
+class TestAtomicSessionTracking:
+    """اختبارات تتبع الجلسة بعبارة upsert واحدة"""
+    
+    def _track(self, session_id, hits):
+        with app.test_request_context('/api/visitor-counter/track', environ_base={'REMOTE_ADDR': '10.4.0.1'}):
+            from flask import session
+            session['visitor_session_id'] = session_id
+            for _ in range(hits):
+                VisitorCounterService.track_visitor()
+    
+    def test_track_visitor_returns_persisted_session(self, client):
+        """اختبار أن الجلسة المعادة تعكس القيم المخزنة بعد كل زيارة"""
+        with app.test_request_context('/api/visitor-counter/track'):
+            from flask import session
+            session['visitor_session_id'] = 'upsert_returned_session'
+            first = VisitorCounterService.track_visitor()
+            second = VisitorCounterService.track_visitor()
+            
+            assert first.id is not None
+            assert second.id == first.id
+            assert second.page_views == 2
+    
+    def test_concurrent_tracking_loses_no_increments(self, client):
+        """اختبار أن الزيارات المتزامنة للجلسة نفسها لا تفقد أي زيادة"""
+        import threading
+        threads_count, hits_per_thread = 8, 25
+        errors = []
+        
+        def worker():
+            try:
+                self._track('upsert_concurrent_session', hits_per_thread)
+            except Exception as error:
+                errors.append(error)
+        
+        threads = [threading.Thread(target=worker) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert errors == []
+        with app.app_context():
+            visitor_session = VisitorSession.query.filter_by(session_id='upsert_concurrent_session').one()
+            assert visitor_session.page_views == threads_count * hits_per_thread
+
+class TestActiveVisitorWindow:
+    """اختبارات النافذة المنزلقة لعدّ الزوار النشطين"""
+    
+    def test_counts_distinct_sessions(self):
+        """اختبار عدّ الجلسات المميزة فقط"""
+        window = ActiveVisitorWindow()
+        window.configure(window_minutes=30, bucket_seconds=60)
+        
+        window.record('window_a')
+        window.record('window_a')
+        window.record('window_b')
+        
+        assert window.count() == 2
+    
+    def test_old_activity_leaves_window(self):
+        """اختبار خروج النشاط القديم من النافذة"""
+        window = ActiveVisitorWindow()
+        window.configure(window_minutes=30, bucket_seconds=60)
+        now = datetime.utcnow()
+        
+        window.record('window_recent', now - timedelta(minutes=2))
+        window.record('window_older', now - timedelta(minutes=20))
+        window.record('window_expired', now - timedelta(minutes=45))
+        
+        assert window.count() == 2
+        assert window.count(minutes=5) == 1
+    
+    def test_warm_from_database(self, client):
+        """اختبار تعبئة النافذة من قاعدة البيانات بعد إعادة التشغيل"""
+        with app.app_context():
+            now = datetime.utcnow()
+            db.session.add_all([
+                VisitorSession(session_id='window_warm_1', first_visit=now, last_activity=now - timedelta(minutes=3)),
+                VisitorSession(session_id='window_warm_2', first_visit=now, last_activity=now - timedelta(minutes=90))
+            ])
+            db.session.commit()
+            
+            window = ActiveVisitorWindow()
+            window.configure(window_minutes=30, bucket_seconds=60)
+            loaded = window.warm()
+            
+            assert window.warmed
+            assert 1 <= window.count(minutes=5) <= window.count() <= loaded
+    
+    def test_service_uses_window_when_enabled(self, client):
+        """اختبار أن الخدمة تجيب من النافذة دون استعلام بعد تعبئتها"""
+        with app.app_context(), patch.object(active_visitor_window, 'enabled', True):
+            active_visitor_window.reset()
+            warmed_count = VisitorCounterService.get_active_visitors_count()
+            
+            active_visitor_window.record('window_service_new')
+            with patch.object(VisitorSession, 'query') as mock_query:
+                assert VisitorCounterService.get_active_visitors_count() == warmed_count + 1
+                mock_query.filter.assert_not_called()
+            
+            active_visitor_window.reset()
+
+class TestHyperLogLog:
+    """اختبارات تقدير الزوار المميزين باستخدام HyperLogLog"""
+    
+    def test_estimate_within_error_bound(self):
+        """اختبار أن التقدير يقع ضمن ثلاثة أضعاف الخطأ المعياري"""
+        sketch = HyperLogLog()
+        for i in range(20000):
+            sketch.add(f'hll_visitor_{i}')
+        
+        assert abs(sketch.count() - 20000) <= 20000 * STANDARD_ERROR * 3
+    
+    def test_small_counts_are_exact_enough(self):
+        """اختبار دقة التقدير للأعداد الصغيرة (linear counting)"""
+        sketch = HyperLogLog()
+        for i in range(50):
+            sketch.add(f'hll_small_{i}')
+            sketch.add(f'hll_small_{i}')
+        
+        assert 48 <= sketch.count() <= 52
+    
+    def test_merge_is_union(self):
+        """اختبار أن الدمج يعطي اتحاد المجموعتين دون تكرار"""
+        monday, tuesday = HyperLogLog(), HyperLogLog()
+        for i in range(3000):
+            monday.add(f'hll_union_{i}')
+        for i in range(2000, 5000):
+            tuesday.add(f'hll_union_{i}')
+        
+        merged = HyperLogLog.from_bytes(monday.to_bytes()).merge(tuesday)
+        
+        assert abs(merged.count() - 5000) <= 5000 * STANDARD_ERROR * 3
+    
+    def test_daily_sketches_merge_in_database(self, client):
+        """اختبار دمج المخططات اليومية داخل SQLite وتقدير نطاق أيام"""
+        first_day = datetime(2002, 5, 1).date()
+        second_day = datetime(2002, 5, 2).date()
+        with app.app_context():
+            VisitorCounterService.record_unique_visitor(first_day, 'hll_db_a', 'hll_db_b')
+            VisitorCounterService.record_unique_visitor(first_day, 'hll_db_c')
+            VisitorCounterService.record_unique_visitor(second_day, 'hll_db_a', 'hll_db_d')
+            db.session.commit()
+            
+            assert VisitorCounterService.get_unique_visitors(first_day, first_day) == 3
+            assert VisitorCounterService.get_unique_visitors(first_day, second_day) == 4
+    
+    def test_track_visitor_updates_today_sketch(self, client):
+        """اختبار أن تتبع زائر جديد يحدّث مخطط اليوم"""
+        today = datetime.utcnow().date()
+        with app.test_request_context('/api/visitor-counter/track'):
+            from flask import session
+            before = VisitorCounterService.get_unique_visitors(today, today)
+            session['visitor_session_id'] = 'hll_tracked_visitor'
+            VisitorCounterService.track_visitor()
+            
+            assert VisitorCounterService.get_unique_visitors(today, today) > before
+
+class TestVisitorIdCookie:
+    """اختبارات ملف تعريف معرف الزائر الموقّع"""
+    
+    def test_round_trip(self):
+        """اختبار أن الترميز ثم فك الترميز يعيد المعرف ووقت أول زيارة"""
+        visitor_id = visitor_id_cookie.new_id(datetime(2024, 1, 15, 10, 30, 45, 123456))
+        token = visitor_id_cookie.encode(visitor_id)
+        
+        assert len(token) == TOKEN_LENGTH
+        assert visitor_id_cookie.decode(token) == VisitorId(visitor_id.session_id, datetime(2024, 1, 15, 10, 30, 45))
+    
+    def test_rejects_tampered_token(self):
+        """اختبار رفض ملف تعريف معدّل أو بطول غير صحيح"""
+        token = visitor_id_cookie.encode(visitor_id_cookie.new_id())
+        tampered = ('A' if token[0] != 'A' else 'B') + token[1:]
+        
+        assert visitor_id_cookie.decode(tampered) is None
+        assert visitor_id_cookie.decode(token[:-1]) is None
+        assert visitor_id_cookie.decode('!' * TOKEN_LENGTH) is None
+        assert visitor_id_cookie.decode(None) is None
+    
+    def test_can_encode_legacy_ids(self):
+        """اختبار أن معرفات md5 القديمة فقط قابلة للنقل إلى ملف التعريف"""
+        assert visitor_id_cookie.can_encode('0123456789abcdef0123456789abcdef')
+        assert not visitor_id_cookie.can_encode('custom_session_id')
+
+class TestCounterStore:
+    """اختبارات واجهات العدادات الساخنة الخلفية (الذاكرة وبروتوكول Redis)"""
+    
+    def _exercise(self, backend):
+        now = datetime.utcnow()
+        earlier = now - timedelta(days=1)
+        
+        first = backend.record_visit('store_a', now, now)
+        again = backend.record_visit('store_a', now, now)
+        returning = backend.record_visit('store_b', earlier, now - timedelta(minutes=45), returning=True)
+        
+        assert (first.is_new, again.is_new, returning.is_new) == (True, False, False)
+        assert again.first_visit == first.first_visit
+        assert again.page_views == 2
+        assert backend.active_count(30) == 1
+        assert backend.active_count(60) == 2
+        assert backend.daily_counts(now.date()) == {'new_visitors': 1, 'page_views': 2}
+        assert backend.daily_counts(earlier.date()) == {'new_visitors': 0, 'page_views': 1}
+    
+    def test_memory_backend(self):
+        """اختبار تتبع الجلسات والعدادات في ذاكرة العملية"""
+        self._exercise(MemoryCounterBackend(session_ttl=timedelta(days=30)))
+    
+    def test_memory_backend_expires_sessions(self):
+        """اختبار نسيان الجلسات الأقدم من فترة الاحتفاظ"""
+        backend = MemoryCounterBackend(session_ttl=timedelta(days=1))
+        old = datetime.utcnow() - timedelta(days=3)
+        backend.record_visit('store_old', old, old)
+        backend.record_visit('store_new', datetime.utcnow(), datetime.utcnow())
+        
+        assert backend.record_visit('store_old', datetime.utcnow(), datetime.utcnow()).is_new
+    
+    def test_redis_backend(self, resp_server):
+        """اختبار الواجهة الخلفية ببروتوكول Redis مقابل خادم محلي بديل"""
+        backend = RedisCounterBackend(url=resp_server.url, prefix='test:', session_ttl=timedelta(days=30))
+        self._exercise(backend)
+        
+        backend.reset()
+        assert resp_server.data == {}
+    
+    def test_redis_batch_uses_two_round_trips(self, resp_server):
+        """اختبار أن دفعة الزيارات تُرسل في رحلتين فقط مهما كان حجمها"""
+        backend = RedisCounterBackend(url=resp_server.url, prefix='test:')
+        now = datetime.utcnow()
+        backend.record_visit('store_warmup', now, now)
+        
+        with patch.object(backend.connection, '_send', wraps=backend.connection._send) as send:
+            records = backend.record_visits([(f'store_batch_{i}', now, now, 1, None) for i in range(100)])
+        
+        assert send.call_count == 2
+        assert all(record.is_new for record in records)
+        assert backend.active_count() == 101
+    
+    def test_redis_retries_only_unsent_commands(self, resp_server):
+        """اختبار إعادة الإرسال عند فشل الاتصال قبل أي بايت، ورفع الخطأ دون تكرار بعد وصول الأوامر"""
+        from src.services.counter_store import RespConnection
+        connection = RespConnection.from_url(resp_server.url)
+        real_connect = socket.create_connection
+        attempts = []
+
+        def flaky_connect(*args, **kwargs):
+            attempts.append(args)
+            if len(attempts) == 1:
+                raise ConnectionRefusedError()
+            return real_connect(*args, **kwargs)
+
+        with patch('src.services.counter_store.socket.create_connection', side_effect=flaky_connect):
+            assert connection.execute('HINCRBY', 'retry:counts', 'views', 1) == 1
+        assert len(attempts) == 2
+
+        with patch.object(connection, '_read_reply', side_effect=EOFError('انقطع الاتصال')):
+            with pytest.raises(EOFError):
+                connection.execute('HINCRBY', 'retry:counts', 'views', 1)
+
+        assert resp_server.data['retry:counts']['views'] == '2'
+        assert connection.execute('HINCRBY', 'retry:counts', 'views', 1) == 3
+
+    def test_incomplete_backend_cannot_be_created(self):
+        """اختبار أن واجهة خلفية لا تنفذ كل دوال CounterBackend تفشل عند إنشائها لا عند أول استدعاء"""
+        from src.services.counter_store import CounterBackend
+
+        class PartialBackend(CounterBackend):
+            def record_visits(self, visits):
+                return []
+
+        with pytest.raises(TypeError):
+            PartialBackend()
+
+    def test_init_app_rejects_unknown_backend(self):
+        """اختبار رفض واجهة خلفية غير معروفة"""
+        fake_app = MagicMock(config={'COUNTER_BACKEND': 'memcached'}, extensions={})
+        with pytest.raises(ValueError):
+            CounterStore().init_app(fake_app)
+    
+    def test_track_visitor_with_memory_backend(self, client):
+        """اختبار أن العدادات تُقرأ من الذاكرة بينما يُكتب تاريخ الجلسة في SQL"""
+        with patch.object(counter_store, 'backend', MemoryCounterBackend()):
+            with app.test_request_context('/api/visitor-counter/track'):
+                visitor_session = VisitorCounterService.track_visitor()
+                
+                assert VisitorCounterService.get_total_visitors_today() == 1
+                assert VisitorCounterService.get_active_visitors_count() == 1
+                with patch.object(db.session, 'execute') as execute:
+                    VisitorCounterService.get_active_visitors_count()
+                    VisitorCounterService.get_total_visitors_today()
+                    execute.assert_not_called()
+                
+                stored = VisitorSession.query.filter_by(session_id=visitor_session.session_id).one()
+                assert stored.page_views == 1
+
+
+class TestAccessLogImport:
+    """اختبارات استيراد سجلات الوصول بصيغة combined"""
+    
+    @staticmethod
+    def _line(ip, when, path='/', status=200, method='GET', agent='Mozilla/5.0 (import-test)'):
+        return (
+            f'{ip} - - [{when:%d/%b/%Y:%H:%M:%S} +0200] "{method} {path} HTTP/1.1" {status} 512 '
+            f'"-" "{agent}"\n'
+        ).encode()
+    
+    def test_parse_log_line(self):
+        """اختبار تحويل الوقت إلى UTC وتجاهل الملفات الثابتة والطلبات غير الناجحة"""
+        from src.services.log_import import parse_log_line
+        when = datetime(2002, 1, 5, 10, 30)
+        
+        ip_address, agent, timestamp = parse_log_line(self._line('10.9.0.1', when).decode().strip())
+        assert ip_address == '10.9.0.1'
+        assert agent == 'Mozilla/5.0 (import-test)'
+        assert timestamp == datetime(2002, 1, 5, 8, 30)
+        for line in (
+            self._line('10.9.0.1', when, path='/static/app.js'),
+            self._line('10.9.0.1', when, status=404),
+            self._line('10.9.0.1', when, method='POST'),
+            b'not a log line\n'
+        ):
+            assert parse_log_line(line.decode().strip()) is None
+    
+    def test_import_gzip_log_and_resume(self, client, tmp_path):
+        """اختبار استيراد سجل مضغوط على دفعات واستئنافه دون تكرار العد"""
+        import gzip
+        from src.services.log_import import import_access_log, log_session_id
+        day = datetime(2002, 2, 10, 12)
+        lines = [
+            self._line('10.9.1.1', day),
+            self._line('10.9.1.1', day + timedelta(minutes=5), path='/about'),
+            self._line('10.9.1.2', day + timedelta(minutes=7)),
+            self._line('10.9.1.2', day + timedelta(minutes=8), path='/logo.png'),
+            self._line('10.9.1.1', day + timedelta(days=1)),
+        ]
+        log_path = tmp_path / 'access.log.1.gz'
+        log_path.write_bytes(gzip.compress(b''.join(lines)))
+        progress = []
+        
+        with app.app_context():
+            result = import_access_log(str(log_path), batch_size=1, chunk_lines=2, workers=1, progress=progress.append)
+            
+            assert result['lines'] == 5
+            assert result['skipped'] == 1
+            assert len(progress) == 3
+            assert all(report['lines_per_second'] > 0 for report in progress)
+            session = VisitorSession.query.filter_by(
+                session_id=log_session_id('10.9.1.1', 'Mozilla/5.0 (import-test)')
+            ).one()
+            assert session.page_views == 3
+            assert session.first_visit == datetime(2002, 2, 10, 10)
+            stats = VisitorStats.query.filter_by(date=datetime(2002, 2, 10).date()).one()
+            assert stats.unique_visitors == 2
+            assert stats.total_page_views == 4
+            
+            again = import_access_log(str(log_path), workers=1)
+            
+            assert again['resumed_from'] == 5
+            assert again['new_sessions'] == again['updated_sessions'] == 0
+            assert VisitorStats.query.filter_by(date=datetime(2002, 2, 10).date()).one().total_page_views == 4
+    
+    def test_resume_appended_log_with_process_pool(self, client, tmp_path):
+        """اختبار متابعة ملف نُمي بعد آخر استيراد مع التحليل في مجمع عمليات"""
+        from src.services.log_import import import_access_log
+        day = datetime(2002, 3, 3, 9)
+        log_path = tmp_path / 'access.log'
+        log_path.write_bytes(self._line('10.9.2.1', day) + self._line('10.9.2.2', day)[:20])
+        
+        with app.app_context():
+            first = import_access_log(str(log_path), workers=1)
+            assert first['lines'] == 1
+            
+            log_path.write_bytes(b''.join(self._line(f'10.9.2.{index}', day) for index in range(1, 41)))
+            second = import_access_log(str(log_path), chunk_lines=7, workers=2)
+            
+            assert second['resumed_from'] == 1
+            assert second['lines'] == 40
+            assert second['new_sessions'] == 39
+            stats = VisitorStats.query.filter_by(date=day.date()).one()
+            assert stats.unique_visitors == 40
+            assert stats.total_page_views == 40
+    
+    def test_returning_visitor_after_retention_purge(self, client, tmp_path):
+        """اختبار أن زائراً حُذفت جلسته المستوردة بعد فترة الاحتفاظ لا يُحتسب جديداً في ملف لاحق"""
+        from src.services.log_import import import_access_log, log_session_id
+        first_day = datetime(2002, 5, 6, 12)
+        later_day = first_day + timedelta(days=45)
+        returning_id = log_session_id('10.9.4.1', 'Mozilla/5.0 (import-test)')
+        older_log = tmp_path / 'access.log.2'
+        older_log.write_bytes(self._line('10.9.4.1', first_day))
+        newer_log = tmp_path / 'access.log.1'
+        newer_log.write_bytes(
+            self._line('10.9.4.1', later_day) + self._line('10.9.4.2', later_day)
+            + self._line('10.9.4.3', first_day - timedelta(days=1))
+        )
+        
+        with app.app_context(), patch.dict(app.config, {'SESSION_RETENTION_DAYS': 30}):
+            assert import_access_log(str(older_log), workers=1)['new_sessions'] == 1
+            VisitorCounterService.cleanup_sessions()
+            assert VisitorSession.query.filter_by(session_id=returning_id).first() is None
+            
+            result = import_access_log(str(newer_log), workers=1)
+            
+            assert result['new_sessions'] == 2
+            assert result['updated_sessions'] == 1
+            assert VisitorStats.query.filter_by(date=later_day.date()).one().unique_visitors == 1
+            assert VisitorStats.query.filter_by(date=first_day.date()).one().unique_visitors == 1
+            earlier = VisitorStats.query.filter_by(date=(first_day - timedelta(days=1)).date()).one()
+            assert earlier.unique_visitors == 1
+    
+    def test_resumed_import_keeps_rollups_after_purge(self, client, tmp_path):
+        """اختبار أن تجميعات كل دفعة تُكتب معها فلا يمحوها حذف الجلسات بين انقطاع الاستيراد واستئنافه"""
+        from src.services import log_import
+        from src.models.visitor_counter import VisitorStatsHourly, VisitorStatsMonthly
+        day = datetime(2002, 7, 8, 9)
+        log_path = tmp_path / 'access.log'
+        log_path.write_bytes(self._line('10.9.6.1', day) + self._line('10.9.6.2', day + timedelta(hours=2)))
+        real_write = log_import.write_visit_batch
+        calls = []
+        
+        def interrupted_write(*args, **kwargs):
+            calls.append(args)
+            if len(calls) > 1:
+                raise RuntimeError('انقطع الاستيراد')
+            return real_write(*args, **kwargs)
+        
+        with app.app_context(), patch.dict(app.config, {'SESSION_RETENTION_DAYS': 30}):
+            with patch.object(log_import, 'write_visit_batch', side_effect=interrupted_write):
+                with pytest.raises(RuntimeError):
+                    log_import.import_access_log(str(log_path), batch_size=1, chunk_lines=1, workers=1)
+            VisitorCounterService.cleanup_sessions()
+            
+            result = log_import.import_access_log(str(log_path), batch_size=1, chunk_lines=1, workers=1)
+            VisitorCounterService.cleanup_sessions()
+            
+            assert result['resumed_from'] == 1
+            assert result['new_sessions'] == 1
+            for hour in (datetime(2002, 7, 8, 7), datetime(2002, 7, 8, 9)):
+                stored = db.session.get(VisitorStatsHourly, hour)
+                assert (stored.unique_visitors, stored.total_page_views) == (1, 1)
+            month = VisitorStatsMonthly.query.filter_by(month=datetime(2002, 7, 1).date()).one()
+            assert (month.unique_visitors, month.total_page_views) == (2, 2)
+    
+    def test_import_command(self, client, tmp_path):
+        """اختبار أمر الاستيراد وطباعة معدل الأسطر في الثانية"""
+        log_path = tmp_path / 'gunicorn-access.log'
+        log_path.write_bytes(self._line('10.9.3.1', datetime(2002, 4, 4, 9)))
+        
+        result = app.test_cli_runner().invoke(args=['import-access-logs', str(log_path), '--workers', '1'])
+        
+        assert result.exit_code == 0
+        assert 'سطر/ثانية' in result.output